@@ -0,0 +1,301 @@
+"""
+Semantic answer cache for whole question -> SQL results.
+
+Entries are keyed by the question embedding. A lookup is a nearest-neighbour
+search over the cached (normalized) embeddings and hits only when the cosine
+similarity clears a threshold, so near-paraphrases of a recent question are
+answered without retrieval or any LLM call. Questions that differ only in a
+value ("account 12345" / "account 67890", "in 2023" / "in 2024") embed as
+near-duplicates, so every entry also stores the question's literals (quoted
+strings and tokens containing a digit) and a hit needs them to match exactly.
+
+Every entry stores the schema fingerprint it was generated against, and a
+lookup only considers entries for the caller's fingerprint. Entries for
+other fingerprints are left alone (another process sharing the SQLite file
+may still be on that index build); like every entry they expire after a
+TTL, and since they no longer get hits they are the first least recently
+used ones evicted when the cache is full. Storage is an in-memory matrix backed by
+SQLite so the cache survives restarts.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+_QUOTED = re.compile(r"'([^']*)'|\"([^\"]*)\"")
+_DIGIT_TOKEN = re.compile(r"[\w.\-/:]*\d[\w.\-/:]*")
+
+
+def question_literals(question: str) -> str:
+    """
+    Normalized literals of a question, in order: quoted strings, then tokens
+    containing a digit (ids, years, dates, amounts). Two questions can share
+    an answer only if these are equal.
+    """
+    quoted = [a or b for a, b in _QUOTED.findall(question)]
+    rest = _QUOTED.sub(" ", question)
+    tokens = [t.strip(".-/:").lower() for t in _DIGIT_TOKEN.findall(rest)]
+    return "\x1f".join([f"'{' '.join(q.split()).lower()}'" for q in quoted] + tokens)
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    sql_query: str
+    full_response: str
+    schema_fingerprint: str
+    similarity: float
+    created_at: float
+    hits: int
+
+
+class SemanticAnswerCache:
+    """
+    Args:
+        path: SQLite file, or None for a memory-only cache
+        threshold: minimum cosine similarity for a hit
+        ttl_s: entry lifetime in seconds
+        max_entries: LRU capacity
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        threshold: float = 0.95,
+        ttl_s: float = 7 * 24 * 3600,
+        max_entries: int = 5000,
+    ):
+        self.threshold = threshold
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        # parallel arrays: row i of _matrix belongs to _entries[i]
+        self._matrix = np.zeros((0, 0), dtype="float32")
+        self._entries: list[dict] = []
+
+        self.stats = {"hits": 0, "misses": 0, "expirations": 0, "evictions": 0, "invalidations": 0}
+
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS answers (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    question TEXT NOT NULL,
+                    embedding BLOB NOT NULL,
+                    sql_query TEXT NOT NULL,
+                    full_response TEXT NOT NULL,
+                    schema_fingerprint TEXT NOT NULL,
+                    literals TEXT,
+                    created_at REAL NOT NULL,
+                    last_hit REAL NOT NULL,
+                    hits INTEGER NOT NULL DEFAULT 0
+                )
+                """
+            )
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(answers)")}
+            if "literals" not in columns:
+                # older cache file: its rows keep NULL literals, never hit again and age out
+                self._conn.execute("ALTER TABLE answers ADD COLUMN literals TEXT")
+            self._conn.commit()
+            self._load()
+
+    # ---- storage ----
+
+    def _load(self) -> None:
+        rows = self._conn.execute(
+            "SELECT id, question, embedding, sql_query, full_response, schema_fingerprint, literals, created_at, last_hit, hits"
+            " FROM answers"
+        ).fetchall()
+        entries, vectors = [], []
+        for row_id, question, blob, sql_query, full_response, fp, literals, created_at, last_hit, hits in rows:
+            entries.append(
+                {
+                    "id": row_id,
+                    "question": question,
+                    "sql_query": sql_query,
+                    "full_response": full_response,
+                    "schema_fingerprint": fp,
+                    "literals": literals,
+                    "created_at": created_at,
+                    "last_hit": last_hit,
+                    "hits": hits,
+                }
+            )
+            vectors.append(np.frombuffer(blob, dtype="float32"))
+        self._entries = entries
+        self._matrix = np.vstack(vectors) if vectors else np.zeros((0, 0), dtype="float32")
+
+    def _delete_rows(self, keep: np.ndarray) -> None:
+        """Drop every entry whose `keep` flag is False (memory and disk)."""
+        dropped = [e["id"] for e, k in zip(self._entries, keep) if not k and e.get("id") is not None]
+        self._entries = [e for e, k in zip(self._entries, keep) if k]
+        self._matrix = self._matrix[keep] if len(self._matrix) else self._matrix
+        if self._conn is not None and dropped:
+            self._conn.executemany("DELETE FROM answers WHERE id = ?", [(i,) for i in dropped])
+            self._conn.commit()
+
+    def _expire(self, now: float) -> None:
+        if not self._entries:
+            return
+        keep = np.array([now - e["created_at"] <= self.ttl_s for e in self._entries])
+        if not keep.all():
+            self.stats["expirations"] += int((~keep).sum())
+            self._delete_rows(keep)
+
+    # ---- public API ----
+
+    def lookup(self, question: str, question_vec: np.ndarray, schema_fingerprint: str) -> Optional[CachedAnswer]:
+        """
+        Return the closest cached answer for the same schema fingerprint and the
+        same question literals whose similarity is at least `threshold`, or
+        None. `question_vec` must be L2-normalized.
+        """
+        q = np.asarray(question_vec, dtype="float32").reshape(-1)
+        literals = question_literals(question)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if not self._entries or self._matrix.shape[1] != q.shape[0]:
+                self.stats["misses"] += 1
+                return None
+
+            sims = self._matrix @ q
+            sims[
+                [e["schema_fingerprint"] != schema_fingerprint or e["literals"] != literals for e in self._entries]
+            ] = -np.inf
+            best = int(np.argmax(sims))
+            similarity = float(sims[best])
+            if similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            entry = self._entries[best]
+            entry["last_hit"] = now
+            entry["hits"] += 1
+            if self._conn is not None and entry.get("id") is not None:
+                self._conn.execute(
+                    "UPDATE answers SET last_hit = ?, hits = ? WHERE id = ?",
+                    (now, entry["hits"], entry["id"]),
+                )
+                self._conn.commit()
+            self.stats["hits"] += 1
+            return CachedAnswer(
+                question=entry["question"],
+                sql_query=entry["sql_query"],
+                full_response=entry["full_response"],
+                schema_fingerprint=entry["schema_fingerprint"],
+                similarity=similarity,
+                created_at=entry["created_at"],
+                hits=entry["hits"],
+            )
+
+    def put(
+        self,
+        question: str,
+        question_vec: np.ndarray,
+        sql_query: str,
+        full_response: str,
+        schema_fingerprint: str,
+    ) -> None:
+        q = np.asarray(question_vec, dtype="float32").reshape(1, -1)
+        now = time.time()
+        entry = {
+            "id": None,
+            "question": question,
+            "sql_query": sql_query,
+            "full_response": full_response,
+            "schema_fingerprint": schema_fingerprint,
+            "literals": question_literals(question),
+            "created_at": now,
+            "last_hit": now,
+            "hits": 0,
+        }
+        with self._lock:
+            if self._conn is not None:
+                cur = self._conn.execute(
+                    """
+                    INSERT INTO answers (question, embedding, sql_query, full_response, schema_fingerprint, literals, created_at, last_hit, hits)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, 0)
+                    """,
+                    (question, q.tobytes(), sql_query, full_response, schema_fingerprint, entry["literals"], now, now),
+                )
+                self._conn.commit()
+                entry["id"] = cur.lastrowid
+
+            if len(self._matrix) and self._matrix.shape[1] != q.shape[1]:
+                # embedding model changed: old vectors are not comparable
+                self._delete_rows(np.zeros(len(self._entries), dtype=bool))
+            self._matrix = np.vstack([self._matrix, q]) if len(self._matrix) else q
+            self._entries.append(entry)
+
+            overflow = len(self._entries) - self.max_entries
+            if overflow > 0:
+                order = np.argsort([e["last_hit"] for e in self._entries])
+                keep = np.ones(len(self._entries), dtype=bool)
+                keep[order[:overflow]] = False
+                self.stats["evictions"] += overflow
+                self._delete_rows(keep)
+
+    def discard(self, answer: CachedAnswer) -> None:
+        """Drop the entry `answer` came from, e.g. when its SQL no longer validates."""
+        with self._lock:
+            keep = np.array(
+                [
+                    not (
+                        e["question"] == answer.question
+                        and e["sql_query"] == answer.sql_query
+                        and e["schema_fingerprint"] == answer.schema_fingerprint
+                    )
+                    for e in self._entries
+                ],
+                dtype=bool,
+            )
+            if not keep.all():
+                self.stats["invalidations"] += int((~keep).sum())
+                self._delete_rows(keep)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._delete_rows(np.zeros(len(self._entries), dtype=bool))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+# ========= SHARED INSTANCE =========
+
+_default_cache: Optional[SemanticAnswerCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """
+    Process-wide answer cache configured from the environment:
+    - ANSWER_CACHE_ENABLED: 0 disables the cache (default 1)
+    - ANSWER_CACHE_PATH: SQLite file ("" keeps it memory-only)
+    - ANSWER_CACHE_THRESHOLD: cosine similarity needed for a hit (default 0.95)
+    - ANSWER_CACHE_TTL_S / ANSWER_CACHE_MAX_ENTRIES: expiry and LRU size
+    """
+    global _default_cache
+    if os.getenv("ANSWER_CACHE_ENABLED", "1") != "1":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = SemanticAnswerCache(
+                path=os.getenv("ANSWER_CACHE_PATH", "answer_cache.sqlite") or None,
+                threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95")),
+                ttl_s=float(os.getenv("ANSWER_CACHE_TTL_S", str(7 * 24 * 3600))),
+                max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000")),
+            )
+        return _default_cache
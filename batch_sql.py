@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Batch LLM-to-SQL runner.
+
+Reads questions from a JSONL or CSV file, retrieves the schema for all of
+them with one batched embedding call and one FAISS search, then generates
+and validates SQL for several questions concurrently. Each result is
+appended to the output JSONL as soon as its question finishes.
+
+Input formats:
+- JSONL: one object per line with "question" (or "user_question") and an optional "id"
+- CSV: a "question" column (otherwise the first column) and an optional "id" column
+
+Usage:
+    python3 batch_sql.py questions.jsonl --output results.jsonl --workers 4
+"""
+
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import asdict
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from preprocess import query_schema_batch
+from llm_to_query import SCHEMA_RETRIEVAL_PARAMS, run_sql_pipeline
+from tracing import configure_logging, current_span, span, start_metrics_server, write_metrics_textfile
+
+
+def read_questions(path: str) -> list[dict]:
+    """Return [{"id": ..., "question": ...}] from a JSONL or CSV file."""
+    questions = []
+    if path.lower().endswith(".csv"):
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            reader = csv.DictReader(f)
+            question_col = "question" if "question" in (reader.fieldnames or []) else reader.fieldnames[0]
+            for i, row in enumerate(reader):
+                q = (row.get(question_col) or "").strip()
+                if q:
+                    questions.append({"id": row.get("id") or str(i), "question": q})
+    else:
+        with open(path, "r", encoding="utf-8") as f:
+            for i, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                q = (record.get("question") or record.get("user_question") or "").strip()
+                if q:
+                    questions.append({"id": str(record.get("id", record.get("session_id", i))), "question": q})
+    return questions
+
+
+def run_batch(
+    questions: list[dict],
+    output_path: str,
+    max_workers: int = 4,
+    max_attempts: int = 3,
+) -> dict:
+    """
+    Generate SQL for every question and stream results to `output_path`.
+    Returns a small summary (counts and wall-clock time).
+    """
+    start = time.perf_counter()
+
+    # 1) Batched retrieval: one embedding call + one FAISS search for all questions
+    print(f"🔍 Retrieving schema for {len(questions)} questions...")
+    schemas = query_schema_batch([q["question"] for q in questions], **SCHEMA_RETRIEVAL_PARAMS)
+    retrieval_s = time.perf_counter() - start
+    print(f"✅ Retrieval done in {retrieval_s:.2f}s")
+
+    write_lock = threading.Lock()
+    summary = {"total": len(questions), "succeeded": 0, "failed": 0, "valid": 0, "llm_calls": 0}
+
+    def run_one(item: dict, pruned_schema: str) -> dict:
+        t0 = time.perf_counter()
+        record = {"id": item["id"], "question": item["question"]}
+        try:
+            with span("batch.question", id=item["id"]):
+                record["trace_id"] = current_span().trace_id  # joins the row to TRACE_LOG_PATH
+                result = run_sql_pipeline(item["question"], max_attempts=max_attempts, pruned_schema=pruned_schema)
+            record.update(
+                {
+                    "sql_query": result.sql_query,
+                    "full_response": result.wait_full_response(),  # streamed: the explanation may still be arriving
+                    "is_valid": result.is_valid,
+                    "validation_errors": result.validation["errors"],
+                    "llm_calls": result.llm_calls,
+                    "cancelled_calls": result.cancelled_calls,
+                    "llm_latency_s": round(result.llm_latency_s, 3),
+                    "cache_hit": result.cache_hit,
+                    "calls": [asdict(c) for c in result.calls],
+                    "error": None,
+                }
+            )
+        except Exception as e:
+            record.update({"sql_query": None, "full_response": None, "is_valid": False, "error": str(e)})
+        record["elapsed_s"] = round(time.perf_counter() - t0, 3)
+        return record
+
+    # 2) Generation + validation with bounded parallelism, streamed to JSONL
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [pool.submit(run_one, item, schema) for item, schema in zip(questions, schemas)]
+        for future in as_completed(futures):
+            record = future.result()
+            with write_lock:
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                summary["failed" if record["error"] else "succeeded"] += 1
+                summary["valid"] += int(bool(record.get("is_valid")))
+                summary["llm_calls"] += record.get("llm_calls", 0)
+
+    summary["retrieval_s"] = round(retrieval_s, 3)
+    summary["wall_s"] = round(time.perf_counter() - start, 3)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate SQL for a file of questions")
+    parser.add_argument("input", help="questions file (.jsonl or .csv)")
+    parser.add_argument("--output", default="batch_results.jsonl", help="results JSONL (appended)")
+    parser.add_argument("--workers", type=int, default=4, help="questions processed concurrently")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    args = parser.parse_args()
+    configure_logging()
+    start_metrics_server()
+
+    questions = read_questions(args.input)
+    if not questions:
+        print("❌ No questions found in input. Exiting.")
+        sys.exit(1)
+
+    summary = run_batch(questions, args.output, max_workers=args.workers, max_attempts=args.max_attempts)
+    print(
+        f"\n📊 {summary['succeeded']}/{summary['total']} succeeded ({summary['valid']} valid), "
+        f"{summary['failed']} failed, {summary['llm_calls']} LLM calls "
+        f"in {summary['wall_s']:.1f}s → {args.output}"
+    )
+    metrics_path = write_metrics_textfile()
+    if metrics_path:
+        print(f"📈 Metrics written to {metrics_path}")
+
+
+if __name__ == "__main__":
+    main()
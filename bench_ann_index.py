@@ -0,0 +1,147 @@
+"""
+Benchmark: approximate index types (HNSW, IVF-PQ) vs the exact flat index.
+
+Vectors come from the existing flat schema index (reconstructed, no
+embedding calls) or are generated synthetically. Queries are perturbed copies of
+catalog vectors, the way paraphrased questions land near their table. For
+each index type and search setting it reports recall@k against exact flat
+search, per-query latency (p50/p95), build time and index size, so the
+tradeoff can be picked per deployment. It then removes ids from the flat
+and IVF-PQ indexes, as incremental updates do, and fails if the remaining
+vectors come back under different ids.
+
+    python3 bench_ann_index.py --index schema_tables.faiss --scale 50
+    python3 bench_ann_index.py --synthetic 200000 --dim 1536 --queries 500
+"""
+
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+from index_factory import IndexSpec, apply_search_params, build_index
+
+
+def load_vectors(index_path: str) -> np.ndarray:
+    index = faiss.read_index(index_path)
+    base = faiss.downcast_index(index.index if hasattr(index, "id_map") else index)
+    if not isinstance(base, faiss.IndexFlat):
+        raise SystemExit(f"❌ {index_path} is not a flat index; vectors cannot be reconstructed exactly")
+    return base.reconstruct_n(0, base.ntotal)
+
+
+def synthetic_vectors(n: int, dim: int, rng: np.random.Generator) -> np.ndarray:
+    # clustered data: tables of the same subject area sit close together
+    centers = rng.normal(size=(max(1, n // 50), dim))
+    x = centers[rng.integers(0, len(centers), n)] + 0.5 * rng.normal(size=(n, dim))
+    return x.astype("float32")
+
+
+def normalize(x: np.ndarray) -> np.ndarray:
+    return (x / (np.linalg.norm(x, axis=1, keepdims=True) + 1e-10)).astype("float32")
+
+
+def scale_vectors(x: np.ndarray, factor: int, rng: np.random.Generator) -> np.ndarray:
+    if factor <= 1:
+        return x
+    copies = [x] + [normalize(x + 0.05 * rng.normal(size=x.shape)) for _ in range(factor - 1)]
+    return np.vstack(copies).astype("float32")
+
+
+def run_queries(index, queries: np.ndarray, k: int) -> tuple[np.ndarray, list[float]]:
+    ids, latencies = [], []
+    for q in queries:
+        start = time.perf_counter()
+        _, I = index.search(q.reshape(1, -1), k)
+        latencies.append(time.perf_counter() - start)
+        ids.append(I[0])
+    return np.vstack(ids), latencies
+
+
+def recall_at_k(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def check_remove(index, queries: np.ndarray, k: int, count: int = 16) -> bool:
+    """
+    Remove `count` ids that no query returns; every query must then return
+    exactly the ids it returned before (the id mapping survives remove_ids).
+    """
+    _, before = index.search(queries, k)
+    returned = set(before.ravel().tolist())
+    candidates = [i for i in range(index.ntotal) if i not in returned][:count]
+    index.remove_ids(np.array(candidates, dtype="int64"))
+    _, after = index.search(queries, k)
+    return bool(np.array_equal(before, after))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--index", default=os.getenv("FAISS_INDEX_PATH") or "schema_tables.faiss")
+    parser.add_argument("--synthetic", type=int, default=0, help="use N synthetic vectors instead of --index")
+    parser.add_argument("--dim", type=int, default=1536, help="dimension for --synthetic")
+    parser.add_argument("--scale", type=int, default=1, help="replicate the vectors N times (with noise)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", default="1,4,16,64", help="IVF-PQ settings to sweep")
+    parser.add_argument("--ef-search", default="16,64,256", help="HNSW settings to sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    if args.synthetic:
+        vectors = normalize(synthetic_vectors(args.synthetic, args.dim, rng))
+    else:
+        vectors = load_vectors(args.index)
+    vectors = scale_vectors(vectors, args.scale, rng)
+    n, dim = vectors.shape
+    ids = np.arange(n, dtype="int64")
+
+    sample = vectors[rng.integers(0, n, args.queries)]
+    queries = normalize(sample + 0.3 * rng.normal(size=sample.shape) / np.sqrt(dim))
+    print(f"Vectors: {n} x {dim}, queries: {len(queries)}, k={args.k}")
+
+    results = []
+
+    def measure(label: str, index, build_s: float, truth=None):
+        found, latencies = run_queries(index, queries, args.k)
+        recall = 1.0 if truth is None else recall_at_k(found, truth)
+        size_mb = faiss.serialize_index(index).nbytes / 1e6
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        results.append((label, recall, p50, p95, build_s, size_mb))
+        return found
+
+    start = time.perf_counter()
+    flat = build_index(vectors, ids, IndexSpec(kind="flat"))
+    truth = measure("flat (exact)", flat, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    hnsw = build_index(vectors, ids, IndexSpec(kind="hnsw"))
+    hnsw_build_s = time.perf_counter() - start
+    for ef in [int(v) for v in args.ef_search.split(",") if v]:
+        apply_search_params(hnsw, ef_search=ef)
+        measure(f"hnsw efSearch={ef}", hnsw, hnsw_build_s, truth)
+
+    start = time.perf_counter()
+    ivfpq = build_index(vectors, ids, IndexSpec(kind="ivfpq"))
+    ivfpq_build_s = time.perf_counter() - start
+    for nprobe in [int(v) for v in args.nprobe.split(",") if v]:
+        apply_search_params(ivfpq, nprobe=nprobe)
+        measure(f"ivfpq nprobe={nprobe}", ivfpq, ivfpq_build_s, truth)
+
+    print(f"\n{'index':<22} {'recall@' + str(args.k):>10} {'p50 ms':>9} {'p95 ms':>9} {'build s':>9} {'size MB':>9}")
+    for label, recall, p50, p95, build_s, size_mb in results:
+        print(f"{label:<22} {recall:>10.3f} {p50:>9.3f} {p95:>9.3f} {build_s:>9.2f} {size_mb:>9.1f}")
+
+    # incremental updates drop changed / deleted vectors; the other ids must be unaffected
+    broken = [label for label, index in (("flat", flat), ("ivfpq", ivfpq)) if not check_remove(index, queries, args.k)]
+    if broken:
+        raise SystemExit(f"❌ Search results changed after remove_ids: {', '.join(broken)}")
+    print("\n✅ Search results unchanged after remove_ids (flat, ivfpq)")
+
+
+if __name__ == "__main__":
+    main()
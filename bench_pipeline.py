@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Benchmark: end-to-end pipeline throughput and latency per concurrency level.
+
+Runs run_sql_pipeline for every question at each concurrency level and
+reports throughput, per-question latency (p50/p95), LLM calls, valid rate
+and pipeline overhead (wall time not spent waiting on the LLM). With
+--stub, an in-process llm_stub_server replays recorded responses with the
+given latency and error injection, so runs are deterministic and need no
+API key. Combine with EMBEDDING_PROVIDER=hashing (or --no-retrieval) to run
+fully offline.
+
+    python3 bench_pipeline.py --stub --latency-ms 800 --jitter-ms 200 --concurrency 1,4,8,16 --repeat 64
+    python3 bench_pipeline.py --stub --tokens-per-s 40 --stream --no-retrieval   # time-to-SQL
+    python3 bench_pipeline.py --stub --jitter-ms 400 --error-rate 0.2 --candidates 3   # speculative p95
+    python3 bench_pipeline.py --questions questions.jsonl --concurrency 1,4   # configured LLM_PROVIDER
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from batch_sql import read_questions
+from llm_providers import (
+    DEFAULT_REPLAY_PATH,
+    OpenAICompatibleClient,
+    OpenAICompatibleProvider,
+    ReplayResponses,
+    get_llm_provider,
+    set_llm_provider,
+)
+from llm_stub_server import StubConfig, start_stub_server
+from llm_to_query import SCHEMA_RETRIEVAL_PARAMS, run_sql_pipeline
+from preprocess import query_schema_batch
+from tracing import SPAN_DURATION, configure_logging, metrics
+
+
+def run_level(
+    questions: list[str],
+    schemas: list[str],
+    concurrency: int,
+    max_attempts: int,
+    stream: bool = False,
+    candidates: int = 1,
+) -> dict:
+    latencies, llm_latencies, calls, valid, errors = [], [], 0, 0, 0
+    time_to_sql = []
+
+    def run_one(question: str, schema: str):
+        t0 = time.perf_counter()
+        try:
+            result = run_sql_pipeline(
+                question,
+                max_attempts=max_attempts,
+                pruned_schema=schema,
+                use_cache=False,
+                stream=stream,
+                candidates=candidates,
+            )
+        except Exception:
+            return time.perf_counter() - t0, None
+        return time.perf_counter() - t0, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for elapsed, result in pool.map(run_one, questions, schemas):
+            latencies.append(elapsed)
+            if result is None:
+                errors += 1
+                continue
+            llm_latencies.append(result.llm_latency_s)
+            time_to_sql.extend(c.time_to_sql_s for c in result.calls[:1] if c.time_to_sql_s is not None)
+            calls += result.llm_calls + result.cancelled_calls
+            valid += int(result.is_valid)
+    wall = time.perf_counter() - start
+
+    p50, p95 = np.percentile(latencies, [50, 95])
+    overhead = [lat - llm for lat, llm in zip(latencies, llm_latencies)]
+    return {
+        "concurrency": concurrency,
+        "throughput": len(questions) / wall,
+        "p50": p50,
+        "p95": p95,
+        "calls": calls,
+        "valid": valid,
+        "errors": errors,
+        "overhead_ms": 1000 * float(np.mean(overhead)) if overhead else 0.0,
+        "time_to_sql": float(np.mean(time_to_sql)) if time_to_sql else None,
+        "wall": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", default=DEFAULT_REPLAY_PATH, help="questions file (.jsonl or .csv)")
+    parser.add_argument("--repeat", type=int, default=0, help="cycle the questions up to N per level")
+    parser.add_argument("--concurrency", default="1,4,8", help="concurrency levels to measure")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--no-retrieval", action="store_true", help="skip schema retrieval (empty schema block)")
+    parser.add_argument("--stub", action="store_true", help="answer from an in-process llm_stub_server")
+    parser.add_argument("--replay", default=DEFAULT_REPLAY_PATH, help="recorded responses for --stub")
+    parser.add_argument("--stream", action="store_true", help="stream completions (early SQL extraction)")
+    parser.add_argument("--candidates", type=int, default=1, help="speculative candidates per question")
+    parser.add_argument("--latency-ms", type=float, default=500.0, help="--stub mean latency")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="--stub latency jitter")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="--stub generation speed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="--stub injected failure rate")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    # the pipeline logs progress for every call; keep the report readable
+    configure_logging(os.getenv("LOG_LEVEL") or "WARNING")
+
+    items = read_questions(args.questions)
+    if not items:
+        print("❌ No questions found in input. Exiting.")
+        sys.exit(1)
+    questions = [q["question"] for q in items]
+    if args.repeat:
+        questions = [questions[i % len(questions)] for i in range(args.repeat)]
+    levels = [int(v) for v in args.concurrency.split(",") if v]
+
+    server = None
+    if args.stub:
+        config = StubConfig(
+            ReplayResponses.from_jsonl(args.replay),
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            seed=args.seed,
+            tokens_per_s=args.tokens_per_s,
+        )
+        server = start_stub_server(config)
+        host, port = server.server_address[:2]
+        # every worker may have `candidates` requests in flight
+        client = OpenAICompatibleClient(
+            f"http://{host}:{port}", None, "stub", backoff_base=0.05, max_concurrency=max(levels) * max(1, args.candidates)
+        )
+        set_llm_provider(OpenAICompatibleProvider(client))
+    print(f"LLM: {get_llm_provider().label}")
+
+    if args.no_retrieval:
+        schemas = [""] * len(questions)
+    else:
+        print(f"🔍 Retrieving schema for {len(set(questions))} distinct questions...")
+        distinct = list(dict.fromkeys(questions))
+        by_question = dict(zip(distinct, query_schema_batch(distinct, **SCHEMA_RETRIEVAL_PARAMS)))
+        schemas = [by_question[q] for q in questions]
+
+    print(f"Questions per level: {len(questions)}, max attempts: {args.max_attempts}")
+    print(
+        f"\n{'workers':>7} {'q/s':>8} {'p50 s':>8} {'p95 s':>8} {'calls':>6} {'valid':>6} {'errors':>6} "
+        f"{'overhead ms':>12} {'to SQL s':>9}"
+    )
+    for level in levels:
+        r = run_level(questions, schemas, level, args.max_attempts, stream=args.stream, candidates=args.candidates)
+        to_sql = f"{r['time_to_sql']:>9.2f}" if r["time_to_sql"] is not None else f"{'-':>9}"
+        print(
+            f"{r['concurrency']:>7} {r['throughput']:>8.2f} {r['p50']:>8.2f} {r['p95']:>8.2f} "
+            f"{r['calls']:>6} {r['valid']:>6} {r['errors']:>6} {r['overhead_ms']:>12.1f} {to_sql}"
+        )
+
+    stages = metrics.summary(SPAN_DURATION, "span")
+    if stages:
+        print(f"\n{'stage':<30} {'calls':>7} {'mean ms':>9} {'total s':>9}")
+        for name, (count, total) in sorted(stages.items(), key=lambda kv: -kv[1][1]):
+            print(f"{name:<30} {count:>7} {1000 * total / count:>9.1f} {total:>9.2f}")
+
+    if server is not None:
+        server.shutdown()
+        print(
+            f"\nStub: {config.stats['requests']} requests, {config.stats['errors']} injected errors, "
+            f"{config.stats['cancelled']} streams cancelled"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Benchmark: retrieval quality and latency against a gold set of questions.
+
+Each gold entry names the tables a question needs (retrieval_gold.jsonl,
+one {"question", "tables", "source"} object per line). The set is seeded
+from feedback_data.jsonl: the tables used by every recorded query that was
+not rated bad. Hand-written entries can be added to the file directly.
+Re-seeding keeps them, and it never overwrites the tables of a question
+already in the file.
+
+For every retrieval method and parameter set it runs query_schema on each
+gold question and reads the ranked table list back from the schema block
+the LLM would see. It reports:
+- recall@k: share of the gold tables among the first k tables of the block
+- recall: share of the gold tables anywhere in the block
+- MRR: mean reciprocal rank of the first gold table
+- tokens: mean size of the schema block (schema_packer tokenizer)
+- p50 / p95: per-question retrieval latency, indexes already loaded
+
+With EMBEDDING_PROVIDER=hashing (and indexes built with it) everything runs
+offline, so parameters can be tuned without an embedding endpoint.
+
+    python3 bench_retrieval.py --seed                     # (re)seed retrieval_gold.jsonl from feedback
+    python3 bench_retrieval.py --methods simple,chess --k 5,10 --k-cols 20,40 --max-tables 3,5
+    python3 bench_retrieval.py --token-budget none,1500,3000 --retrieval-mode vector,hybrid --misses
+"""
+
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from llm_providers import DEFAULT_REPLAY_PATH
+from preprocess import query_schema
+from retrieval_context import get_retrieval_context
+from schema_packer import default_token_budget, get_tokenizer
+from sql_validation import SQLGLOT_AVAILABLE
+
+if SQLGLOT_AVAILABLE:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+
+DEFAULT_GOLD_PATH = "retrieval_gold.jsonl"
+RECALL_AT = (1, 3, 5, 10)
+
+# "Table dbo.t_billed:" (CHESS / packed blocks) and "Table dbo.t_billed. This table ..." (table-level text)
+_TABLE_HEADER = re.compile(r"^Table ([^\s.:]+\.[^\s:]+?)[.:]?(?:\s|$)", re.MULTILINE)
+_FROM_JOIN = re.compile(r"\b(?:FROM|JOIN)\s+((?:\[?\w+\]?\.){0,2}\[?#?\w+\]?)", re.IGNORECASE)
+
+
+# ========= GOLD SET =========
+
+def load_gold(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    gold = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"⚠️  Skipping line {line_no} of {path}: {e}")
+                continue
+            if entry.get("question") and entry.get("tables"):
+                gold.append(entry)
+    return gold
+
+
+def tables_in_sql(sql_query: str, catalog) -> list[str]:
+    """Catalog ids of the tables `sql_query` reads, in order of appearance (CTEs and temp tables excluded)."""
+    names = []
+    if SQLGLOT_AVAILABLE:
+        try:
+            for tree in sqlglot.parse(sql_query, read="tsql"):
+                if tree is None:
+                    continue
+                ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+                names.extend(
+                    ".".join(p for p in (t.db, t.name) if p)
+                    for t in tree.find_all(exp.Table)
+                    if t.name and t.name.lower() not in ctes
+                )
+        except SqlglotError:
+            names = []
+    if not names:
+        names = _FROM_JOIN.findall(sql_query)
+
+    tables = []
+    for name in names:
+        info = catalog.resolve_table(name)
+        if info is not None and info.id not in tables:
+            tables.append(info.id)
+    return tables
+
+
+def seed_gold(feedback_path: str, gold_path: str, catalog) -> tuple[int, int]:
+    """Add the feedback questions missing from `gold_path`; returns (added, total)."""
+    gold = load_gold(gold_path)
+    known = {g["question"].strip().lower() for g in gold}
+    added = []
+    with open(feedback_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            question = (record.get("user_question") or "").strip()
+            if not question or question.lower() in known or record.get("rating") == "bad":
+                continue
+            tables = tables_in_sql(record.get("sql_query") or "", catalog)
+            if not tables:
+                continue
+            known.add(question.lower())
+            added.append({"question": question, "tables": tables, "source": "feedback_data"})
+
+    if added:
+        with open(gold_path, "a", encoding="utf-8") as f:
+            for entry in added:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    return len(added), len(gold) + len(added)
+
+
+# ========= EVALUATION =========
+
+def ranked_tables(schema_text: str) -> list[str]:
+    """Table ids in the order the schema block presents them."""
+    return list(dict.fromkeys(m.lower() for m in _TABLE_HEADER.findall(schema_text)))
+
+
+def score_question(expected: list[str], ranked: list[str]) -> dict:
+    expected = {t.lower() for t in expected}
+    scores = {f"recall@{k}": len(expected.intersection(ranked[:k])) / len(expected) for k in RECALL_AT}
+    scores["recall"] = len(expected.intersection(ranked)) / len(expected)
+    first = next((i for i, t in enumerate(ranked) if t in expected), None)
+    scores["rr"] = 1.0 / (first + 1) if first is not None else 0.0
+    return scores
+
+
+def parameter_grid(args) -> list[dict]:
+    def values(text: str, cast=int) -> list:
+        return [None if v.lower() == "none" else cast(v) for v in text.split(",") if v]
+
+    modes = values(args.retrieval_mode, str) if args.retrieval_mode else [None]
+    configs = []
+    for method in values(args.methods, str):
+        if method == "simple":
+            for k, mode in itertools.product(values(args.k), modes):
+                configs.append({"method": "simple", "k": k, "retrieval_mode": mode})
+        elif method == "chess":
+            for k_cols, max_tables, max_cols, budget, mode in itertools.product(
+                values(args.k_cols), values(args.max_tables), values(args.max_cols_per_table),
+                values(args.token_budget), modes,
+            ):
+                configs.append(
+                    {
+                        "method": "chess",
+                        "k_cols": k_cols,
+                        "max_tables": max_tables,
+                        "max_cols_per_table": max_cols,
+                        "max_char_per_table": args.max_char_per_table,
+                        "token_budget": budget,
+                        "retrieval_mode": mode,
+                    }
+                )
+        else:
+            raise SystemExit(f"❌ Unknown method '{method}'. Use 'simple' or 'chess'.")
+    return configs
+
+
+def config_label(config: dict) -> str:
+    keys = {"k": "k", "k_cols": "k_cols", "max_tables": "tables", "max_cols_per_table": "cols", "token_budget": "budget"}
+    parts = [config["method"]] + [f"{short}={config[key]}" for key, short in keys.items() if key in config]
+    if config.get("retrieval_mode"):
+        parts.append(config["retrieval_mode"])
+    return " ".join(parts)
+
+
+def evaluate(config: dict, gold: list[dict], repeat: int = 1) -> dict:
+    count_tokens = get_tokenizer()
+    params = {key: value for key, value in config.items() if value is not None}
+    rows, latencies = [], []
+    for entry in gold:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            schema = query_schema(entry["question"], **params)
+            latencies.append(time.perf_counter() - started)
+        ranked = ranked_tables(schema)
+        rows.append(
+            {
+                "question": entry["question"],
+                "expected": entry["tables"],
+                "ranked": ranked,
+                "tokens": count_tokens(schema),
+                **score_question(entry["tables"], ranked),
+            }
+        )
+
+    p50, p95 = np.percentile(latencies, [50, 95])
+    summary = {
+        "config": config,
+        "questions": len(rows),
+        **{key: float(np.mean([r[key] for r in rows])) for key in [f"recall@{k}" for k in RECALL_AT] + ["recall"]},
+        "mrr": float(np.mean([r["rr"] for r in rows])),
+        "tokens": float(np.mean([r["tokens"] for r in rows])),
+        "p50_ms": 1000 * float(p50),
+        "p95_ms": 1000 * float(p95),
+        "rows": rows,
+    }
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gold", default=DEFAULT_GOLD_PATH, help="gold set (.jsonl)")
+    parser.add_argument("--seed", action="store_true", help="add feedback questions to the gold set and exit")
+    parser.add_argument("--feedback", default=DEFAULT_REPLAY_PATH, help="feedback file used by --seed")
+    parser.add_argument("--methods", default="simple,chess")
+    parser.add_argument("--k", default="5,10", help="simple: tables retrieved")
+    parser.add_argument("--k-cols", default="40", help="chess: column hits")
+    parser.add_argument("--max-tables", default="5", help="chess: tables selected")
+    parser.add_argument("--max-cols-per-table", default="10", help="chess: columns kept per table")
+    parser.add_argument("--max-char-per-table", type=int, default=1000, help="chess: per-table cap without a budget")
+    parser.add_argument(
+        "--token-budget", default=str(default_token_budget()), help="chess: schema token budgets ('none' = char caps)"
+    )
+    parser.add_argument("--retrieval-mode", default="", help="vector, lexical, hybrid, auto (default RETRIEVAL_MODE)")
+    parser.add_argument("--repeat", type=int, default=1, help="timed runs per question")
+    parser.add_argument("--misses", action="store_true", help="list the gold tables each config missed")
+    parser.add_argument("--output", help="write per-config summaries and per-question rankings as JSON")
+    args = parser.parse_args()
+
+    ctx = get_retrieval_context()
+    if args.seed:
+        added, total = seed_gold(args.feedback, args.gold, ctx.schema_catalog)
+        print(f"✅ Added {added} questions from {args.feedback}; {args.gold} now has {total}")
+        return
+
+    gold = load_gold(args.gold)
+    if not gold:
+        print(f"❌ No gold questions in {args.gold}. Run with --seed first.")
+        sys.exit(1)
+    configs = parameter_grid(args)
+
+    # load indexes, catalog and tokenizer up front so the first config is not charged for them
+    ctx.warm()
+    _ = ctx.schema_catalog
+    query_schema(gold[0]["question"], **{key: v for key, v in configs[0].items() if v is not None})
+
+    print(f"Gold questions: {len(gold)}, configurations: {len(configs)}")
+    recall_header = " ".join(f"{f'R@{k}':>6}" for k in RECALL_AT)
+    print(f"\n{'configuration':<52} {recall_header} {'recall':>6} {'MRR':>6} {'tokens':>7} {'p50 ms':>8} {'p95 ms':>8}")
+    results = []
+    for config in configs:
+        r = evaluate(config, gold, repeat=max(1, args.repeat))
+        results.append(r)
+        recalls = " ".join(f"{r[f'recall@{k}']:>6.2f}" for k in RECALL_AT)
+        print(
+            f"{config_label(config):<52} {recalls} {r['recall']:>6.2f} {r['mrr']:>6.2f} "
+            f"{r['tokens']:>7.0f} {r['p50_ms']:>8.1f} {r['p95_ms']:>8.1f}"
+        )
+        if args.misses:
+            for row in r["rows"]:
+                missed = [t for t in row["expected"] if t.lower() not in row["ranked"]]
+                if missed:
+                    print(f"    ✗ {row['question'][:60]!r}: {', '.join(missed)}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
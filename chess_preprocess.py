@@ -5,59 +5,83 @@ CHESS-style schema retrieval:
 - Final column filtering
 
 This script:
-- Loads the column-level FAISS index + metadata
+- Lazily loads the column-level FAISS index + metadata on first use
 - Given a natural-language question, returns a pruned schema block
   you can plug into your LLM SQL prompt.
 """
 
-import json
-from typing import List, Dict
+import logging
+from typing import List, Dict, Optional
 
-import faiss
+from preprocess import embed_texts, normalize_rows  # reuse your embedding logic
+from retrieval_context import get_retrieval_context
+from join_paths import get_join_graph, render_join_paths
+from lexical_index import search_schema
+from schema_packer import catalog_column_line, catalog_fk_line, pack_schema
+from tracing import span
 
-from preprocess import embed_texts_azure, normalize_rows  # reuse your embedding logic
-
-# ---- paths to your index / metadata files ----
-COLUMN_FAISS_PATH = "/Users/krahman/LLM-to-SQL-experiment/schema_tables.faiss"
-COLUMN_METADATA_PATH = "/Users/krahman/LLM-to-SQL-experiment/schema_tables_metadata.json"
+logger = logging.getLogger(__name__)
 
 
 # ========= LOAD COLUMN INDEX + METADATA =========
+# Paths come from COLUMN_FAISS_PATH / COLUMN_METADATA_PATH (default
+# schema_columns.*, built by `python3 preprocess.py`). Without a column index
+# the table-level index is used and every "column hit" is a whole table.
+# Nothing is loaded until the first question.
 
 def load_column_index_and_metadata():
-    index = faiss.read_index(COLUMN_FAISS_PATH)
-    with open(COLUMN_METADATA_PATH, "r", encoding="utf-8") as f:
-        metadata = json.load(f)
-    return index, metadata
-
-
-column_index, column_meta = load_column_index_and_metadata()
+    return get_retrieval_context().column_index
 
 
 # ========= CHESS STEPS =========
 
-def column_filtering(question: str, k_cols: int = 40) -> List[Dict]:
+def column_filtering(question: str, k_cols: int = 40, retrieval_mode: Optional[str] = None) -> List[Dict]:
     """
     Step 1: Column filtering.
-    Use FAISS + Azure embeddings to find the top-k relevant columns
-    for a natural language question.
-    """
-    q_vec = embed_texts_azure([question])
-    q_vec = normalize_rows(q_vec)
-
-    D, I = column_index.search(q_vec, k_cols)
-
-    results = []
-    for rank, idx in enumerate(I[0]):
-        m = column_meta[idx]
-        results.append(
-            {
-                "rank": rank + 1,
-                "score": float(D[0][rank]),
-                **m,  # includes: id, table_schema, table_name, column_name, text
-            }
-        )
-    return results
+    Use FAISS + Azure embeddings (and/or BM25 over the column names, see
+    lexical_index) to find the top-k relevant columns for a natural
+    language question.
+    """
+    return column_filtering_batch([question], k_cols=k_cols, retrieval_mode=retrieval_mode)[0]
+
+
+def column_filtering_batch(questions: List[str], k_cols: int = 40, retrieval_mode: Optional[str] = None) -> List[List[Dict]]:
+    """
+    Column filtering for many questions at once: one embedding call for
+    all questions and one FAISS search over the whole query matrix.
+    Questions answered by the lexical fast path are not embedded at all.
+    Returns one hit list per question, in input order.
+    """
+    ctx = get_retrieval_context()
+    column_index, column_meta = ctx.column_index
+
+    ranked = search_schema(
+        questions,
+        k_cols,
+        column_index,
+        ctx.column_lexical,
+        embed=lambda texts: normalize_rows(embed_texts(texts)),
+        mode=retrieval_mode,
+    )
+
+    all_results = []
+    for hits in ranked:
+        results = []
+        seen = set()
+        for rank, (idx, score) in enumerate(hits):
+            m = column_meta.get(idx)
+            if m is None or m["id"] in seen:
+                continue
+            seen.add(m["id"])
+            results.append(
+                {
+                    "rank": rank + 1,
+                    "score": score,
+                    **m,  # includes: id, table_schema, table_name, column_name, text
+                }
+            )
+        all_results.append(results)
+    return all_results
 
 
 def table_selection(filtered_columns: List[Dict], max_tables: int = 5) -> List[str]:
@@ -104,55 +128,167 @@ def final_column_filtering(
     return per_table
 
 
+def _truncate_table_text(table_text: str, max_char_per_table: int) -> str:
+    """Smart truncation of a full table description that preserves column information."""
+    if len(table_text) <= max_char_per_table:
+        return table_text
+
+    # Try to preserve the columns section
+    if "Columns:" in table_text:
+        parts = table_text.split("Columns:")
+        header = parts[0]
+        columns_section = "Columns:" + parts[1]
+
+        # Keep full columns section if possible, truncate header if needed
+        if len(columns_section) <= max_char_per_table - 100:
+            if len(header) > 100:
+                header = header[:100] + "..."
+            return header + "\n" + columns_section
+        # Truncate but ensure we show critical column info
+        return table_text[:max_char_per_table-50] + "\n... [Schema truncated, key columns shown above]"
+    return table_text[:max_char_per_table] + "... [Schema truncated]"
+
+
+def _column_block_lines(cols: List[Dict], max_char_per_table: int) -> List[str]:
+    """'Columns:' / 'Foreign keys:' lines for the selected columns only, within the char budget."""
+    lines = ["Columns:"]
+    used = 0
+    fk_lines = []
+    for i, c in enumerate(cols):
+        line = f"- {c['line']}"
+        if used + len(line) > max_char_per_table and i > 0:
+            lines.append(f"- ... ({len(cols) - i} more columns omitted)")
+            break
+        lines.append(line)
+        used += len(line) + 1
+        fk_lines.extend(c.get("fks") or [])
+    if fk_lines:
+        lines.append("Foreign keys:")
+        lines.extend(f"- {fk}" for fk in fk_lines)
+    return lines
+
+
 def build_chess_schema_block(per_table_columns: Dict[str, List[Dict]], max_char_per_table: int = 2000) -> str:
     """
     Build a human-/LLM-friendly schema snippet from the
-    CHESS-selected columns with smart truncation that preserves column information.
+    CHESS-selected columns.
+
+    With a column-level index each table gets one block listing only its
+    selected columns (and their FKs). Hits from a table-level index carry
+    the whole table description, which is emitted once per table with
+    smart truncation that preserves column information.
     """
     lines = []
     for tid, cols in per_table_columns.items():
         lines.append(f"Table {tid}:")
-        for c in cols:
-            table_text = c['text']
-            
-            # If the table description is too long, smart truncate
-            if len(table_text) > max_char_per_table:
-                # Try to preserve the columns section
-                if "Columns:" in table_text:
-                    parts = table_text.split("Columns:")
-                    header = parts[0]
-                    columns_section = "Columns:" + parts[1]
-                    
-                    # Keep full columns section if possible, truncate header if needed
-                    if len(columns_section) <= max_char_per_table - 100:
-                        if len(header) > 100:
-                            header = header[:100] + "..."
-                        table_text = header + "\n" + columns_section
-                    else:
-                        # Truncate but ensure we show critical column info
-                        table_text = table_text[:max_char_per_table-50] + "\n... [Schema truncated, key columns shown above]"
-                else:
-                    table_text = table_text[:max_char_per_table] + "... [Schema truncated]"
-            
-            lines.append(f"{table_text}")
+        if cols and all("line" in c for c in cols):
+            lines.extend(_column_block_lines(cols, max_char_per_table))
+        else:
+            emitted = set()
+            for c in cols:
+                if c["text"] in emitted:
+                    continue
+                emitted.add(c["text"])
+                lines.append(_truncate_table_text(c["text"], max_char_per_table))
         lines.append("")  # blank line between tables
     return "\n".join(lines).rstrip()
 
 
+def _catalog_column_entry(info, col) -> Dict:
+    return {
+        "table_schema": info.schema,
+        "table_name": info.name,
+        "column_name": col.name,
+        "line": catalog_column_line(col),
+        "fks": [fk] if (fk := catalog_fk_line(col)) else [],
+        "score": 0.0,
+    }
+
+
+def add_join_tables(per_table_columns: Dict[str, List[Dict]], plan, catalog) -> None:
+    """
+    Add the bridge tables of a JoinPlan (with their PK / FK columns) and make
+    sure every column used by the plan's join conditions is listed.
+    """
+    for bridge in plan.bridges:
+        info = catalog.resolve_table(bridge)
+        per_table_columns[bridge] = [
+            _catalog_column_entry(info, col) for col in info.columns if col.is_primary_key or col.is_foreign_key
+        ]
+    for edge in plan.edges:
+        for tid, column in ((edge.table, edge.column), (edge.ref_table, edge.ref_column)):
+            cols = per_table_columns.get(tid)
+            if not cols or not all("line" in c for c in cols):
+                continue  # whole-table text already lists every column
+            if all(c["column_name"].lower() != column.lower() for c in cols):
+                info = catalog.resolve_table(tid)
+                cols.append(_catalog_column_entry(info, info.column(column)))
+
+
+def _schema_catalog_or_none():
+    try:
+        return get_retrieval_context().schema_catalog
+    except Exception as e:  # missing / unreadable schema export: pack without join columns
+        logger.warning(f"⚠️ Schema catalog unavailable, packing without PK/FK columns: {e}")
+        return None
+
+
 def get_pruned_schema_for_question(
     question: str,
     k_cols: int = 40,
     max_tables: int = 5,
     max_cols_per_table: int = 10,
     max_char_per_table: int = 2000,  # Add character limit per table
+    col_hits: Optional[List[Dict]] = None,
+    token_budget: Optional[int] = None,
+    retrieval_mode: Optional[str] = None,
 ) -> str:
     """
     Convenience wrapper:
     Given a user question, run all CHESS steps and return a single
     pruned schema block (string) to drop into your LLM prompt.
+    Pass `col_hits` to reuse column filtering results computed in a batch.
+    With `token_budget`, tables and columns are packed into that many tokens
+    (keeping PK/FK join columns) instead of being capped per table by characters.
     """
+    with span("retrieval.chess", k_cols=k_cols, max_tables=max_tables, batched=col_hits is not None) as s:
+        return _pruned_schema(
+            s, question, k_cols, max_tables, max_cols_per_table, max_char_per_table, col_hits, token_budget, retrieval_mode
+        )
+
+
+def _pruned_schema(
+    s,
+    question: str,
+    k_cols: int,
+    max_tables: int,
+    max_cols_per_table: int,
+    max_char_per_table: int,
+    col_hits: Optional[List[Dict]],
+    token_budget: Optional[int],
+    retrieval_mode: Optional[str],
+) -> str:
     # 1) Column filtering
-    col_hits = column_filtering(question, k_cols=k_cols)
+    if col_hits is None:
+        col_hits = column_filtering(question, k_cols=k_cols, retrieval_mode=retrieval_mode)
+
+    catalog = _schema_catalog_or_none()
+    join_graph = get_join_graph(catalog) if catalog is not None else None
+
+    if token_budget is not None:
+        with span("schema.pack", token_budget=token_budget) as pack_span:
+            packed = pack_schema(
+                col_hits,
+                token_budget,
+                catalog=catalog,
+                max_tables=max_tables,
+                max_cols_per_table=max_cols_per_table,
+                join_graph=join_graph,
+            )
+            pack_span.set(schema_chars=len(packed.text))
+        logger.info(f"📦 Schema packed: {packed.summary()}")
+        s.set(schema_chars=len(packed.text))
+        return packed.text
 
     # 2) Table selection
     top_tables = table_selection(col_hits, max_tables=max_tables)
@@ -164,10 +300,48 @@ def get_pruned_schema_for_question(
         max_cols_per_table=max_cols_per_table,
     )
 
-    # 4) Build schema block with smart truncation
+    # 4) Add the tables that join the selected ones (FK graph)
+    join_edges = []
+    if join_graph is not None and len(top_tables) > 1:
+        plan = join_graph.connect(top_tables)
+        add_join_tables(per_table_cols, plan, catalog)
+        join_edges = plan.edges
+
+    # 5) Build schema block with smart truncation
     schema_block = build_chess_schema_block(per_table_cols, max_char_per_table)
+    if join_edges:
+        schema_block += "\n\n" + render_join_paths(join_edges)
+    s.set(tables=len(per_table_cols), schema_chars=len(schema_block))
     return schema_block
 
 
+def get_pruned_schemas_for_questions(
+    questions: List[str],
+    k_cols: int = 40,
+    max_tables: int = 5,
+    max_cols_per_table: int = 10,
+    max_char_per_table: int = 2000,
+    token_budget: Optional[int] = None,
+    retrieval_mode: Optional[str] = None,
+) -> List[str]:
+    """
+    Batch version of get_pruned_schema_for_question: column filtering runs
+    once for all questions, the remaining CHESS steps are local.
+    """
+    all_hits = column_filtering_batch(questions, k_cols=k_cols, retrieval_mode=retrieval_mode)
+    return [
+        get_pruned_schema_for_question(
+            question,
+            k_cols=k_cols,
+            max_tables=max_tables,
+            max_cols_per_table=max_cols_per_table,
+            max_char_per_table=max_char_per_table,
+            col_hits=hits,
+            token_budget=token_budget,
+        )
+        for question, hits in zip(questions, all_hits)
+    ]
+
+
 # ========= SIMPLE CLI TEST =========
 
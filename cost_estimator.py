@@ -0,0 +1,531 @@
+#!/usr/bin/env python3
+"""
+Cost estimation for generated queries, from table statistics.
+
+Row counts and indexes come from a local stats file (TABLE_STATS_PATH,
+attached to the schema catalog by retrieval_context). The query is parsed
+with sqlglot and estimated scope by scope, the way a textbook (System R)
+optimizer would:
+- each table's rows are reduced by its local predicates (equality 1/10,
+  range 1/3, BETWEEN 1/4, IN n/10; an equality on a unique key is 1 row)
+- a table is read with a seek when a sargable predicate hits the leading
+  column of one of its indexes, and with a full scan otherwise
+- tables are joined greedily, smallest first; an equi-join on a key
+  keeps |A| x |B| / |key side| rows, and a table that has an index on its
+  join column is read by lookups instead of a scan
+- GROUP BY, aggregates and TOP shrink a scope's output for the scopes
+  that read it
+- a TOP with no ORDER BY, GROUP BY, DISTINCT or aggregate is a row goal:
+  the scope stops after N output rows, so its reads and joins are scaled
+  by N / (rows it would otherwise produce)
+
+The cost is the rows read plus the rows produced by joins. A query whose
+estimated cost exceeds COST_BUDGET_ROWS is rejected (cost_over_budget), and
+the issue names the most expensive table and its indexed columns, so the
+fix prompt can ask for a selective filter. Full scans of large tables with
+no filter at all are reported as warnings.
+
+Environment:
+- TABLE_STATS_PATH: stats file (default table_stats.json; no file, no cost stage)
+- COST_BUDGET_ROWS: estimated rows read + joined per query (default 50,000,000)
+- COST_BUDGET_ACTION: reject | warn (default reject)
+- COST_LARGE_TABLE_ROWS: unfiltered scans of tables this big are flagged (default 1,000,000)
+- COST_DEFAULT_ROWS: rows assumed for tables missing from the stats file (default 1000)
+
+    python3 cost_estimator.py "SELECT * FROM t_billed WHERE billed_amt > 100"
+    python3 cost_estimator.py "SELECT TOP 10 * FROM t_billed"   # row goal: ~10 rows read
+    python3 cost_estimator.py --export-sql > export_stats.sql   # run on SQL Server, save as TSV
+    python3 cost_estimator.py --import stats.tsv --output table_stats.json
+"""
+
+import argparse
+import csv
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from schema_catalog import IndexInfo
+from sql_validation import SQLGLOT_AVAILABLE, ValidationIssue
+from tracing import span
+
+if SQLGLOT_AVAILABLE:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import SqlglotError
+    from sqlglot.optimizer.scope import Scope, traverse_scope
+
+load_dotenv()
+
+EQ_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1 / 3
+BETWEEN_SELECTIVITY = 0.25
+DEFAULT_SELECTIVITY = 1 / 3
+NOT_EQ_SELECTIVITY = 0.9
+GROUP_BY_REDUCTION = 0.1
+
+# Stats export for SQL Server; save the result grid as tab-separated text and --import it
+STATS_EXPORT_SQL = """\
+SELECT s.name AS table_schema,
+       t.name AS table_name,
+       (SELECT SUM(p.rows) FROM sys.partitions p
+         WHERE p.object_id = t.object_id AND p.index_id IN (0, 1)) AS row_count,
+       i.name AS index_name,
+       i.is_unique,
+       CASE WHEN i.type = 1 THEN 1 ELSE 0 END AS is_clustered,
+       STUFF((SELECT ',' + c.name
+                FROM sys.index_columns ic
+                JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+               WHERE ic.object_id = i.object_id AND ic.index_id = i.index_id AND ic.is_included_column = 0
+               ORDER BY ic.key_ordinal
+                 FOR XML PATH('')), 1, 1, '') AS index_columns
+  FROM sys.tables t
+  JOIN sys.schemas s ON s.schema_id = t.schema_id
+  LEFT JOIN sys.indexes i ON i.object_id = t.object_id AND i.type IN (1, 2)
+ ORDER BY s.name, t.name, i.index_id;
+"""
+
+
+def cost_budget_rows() -> float:
+    return float(os.getenv("COST_BUDGET_ROWS", "50000000"))
+
+
+@dataclass
+class TableAccess:
+    table: str  # catalog id, or the CTE / derived-table alias
+    alias: str
+    rows: float  # table rows (stats, or the estimate of a derived table)
+    estimated_rows: float  # after local predicates
+    access: str  # seek | scan | lookup | derived
+    index: Optional[str] = None
+    rows_read: float = 0.0
+    filtered: bool = False
+    has_stats: bool = True
+
+
+@dataclass
+class CostEstimate:
+    accesses: list[TableAccess] = field(default_factory=list)
+    rows_read: float = 0.0
+    rows_joined: float = 0.0
+    output_rows: float = 0.0
+
+    @property
+    def cost(self) -> float:
+        return self.rows_read + self.rows_joined
+
+    @property
+    def tables_without_stats(self) -> list[str]:
+        return sorted({a.table for a in self.accesses if not a.has_stats})
+
+
+def _conjuncts(predicate) -> list:
+    if isinstance(predicate, exp.And):
+        return _conjuncts(predicate.left) + _conjuncts(predicate.right)
+    if isinstance(predicate, exp.Paren):
+        return _conjuncts(predicate.this)
+    return [predicate]
+
+
+def _own_columns(node) -> list:
+    """Columns of `node`, not of the subqueries nested in it (those are other scopes)."""
+    select = node.find_ancestor(exp.Select)
+    return [c for c in node.find_all(exp.Column) if c.find_ancestor(exp.Subquery, exp.Select) is select]
+
+
+def _row_limit(select) -> tuple[Optional[float], bool]:
+    """(N, is_percent) of a literal TOP / LIMIT; (None, False) without one."""
+    limit = select.args.get("limit") or select.args.get("top")
+    if not isinstance(limit, exp.Limit):
+        return None, False
+    value = limit.args.get("expression") or limit.this
+    if not (isinstance(value, exp.Literal) and value.is_number):
+        return None, False
+    options = limit.args.get("limit_options")
+    return float(value.this), bool(options is not None and options.args.get("percent"))
+
+
+def _has_row_goal(select) -> bool:
+    """
+    True when the scope can stop after its first TOP rows: nothing forces it
+    to see every row first (ORDER BY, GROUP BY, DISTINCT, aggregates,
+    window functions).
+    """
+    if any(select.args.get(arg) for arg in ("order", "group", "distinct", "having")):
+        return False
+    return not any(
+        node.find_ancestor(exp.Select) is select for node in select.find_all(exp.AggFunc, exp.Window)
+    )
+
+
+class _Estimator:
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self.default_rows = float(os.getenv("COST_DEFAULT_ROWS", "1000"))
+        self.scope_rows: dict[int, float] = {}
+        self.estimate = CostEstimate()
+
+    # ---- sources ----
+
+    def _indexes(self, info, stats) -> tuple[IndexInfo, ...]:
+        if stats is not None and stats.indexes:
+            return stats.indexes
+        if info is not None and info.primary_key:
+            # no index metadata: the primary key is the clustered index on SQL Server by default
+            return (IndexInfo("PK", info.primary_key, unique=True, clustered=True),)
+        return ()
+
+    def _source(self, alias: str, source) -> dict:
+        if isinstance(source, Scope):
+            rows = self.scope_rows.get(id(source), self.default_rows)
+            return {
+                "alias": alias,
+                "table": alias,
+                "rows": rows,
+                "info": None,
+                "indexes": (),
+                "has_stats": True,
+                "derived": True,
+            }
+        info = self.catalog.resolve_table(".".join(p for p in (source.db, source.name) if p))
+        stats = self.catalog.stats_of(info.id) if info else None
+        return {
+            "alias": alias,
+            "table": info.id if info else source.name,
+            "rows": float(stats.rows) if stats else self.default_rows,
+            "info": info,
+            "indexes": self._indexes(info, stats),
+            "has_stats": stats is not None,
+            "derived": False,
+        }
+
+    def _owner(self, column, sources: dict) -> Optional[str]:
+        """Alias of the source `column` belongs to (None if it is an outer or unknown reference)."""
+        if column.table:
+            alias = column.table.lower()
+            return alias if alias in sources else None
+        if len(sources) == 1:
+            return next(iter(sources))
+        owners = [a for a, s in sources.items() if s["info"] is not None and s["info"].column(column.name)]
+        return owners[0] if len(owners) == 1 else None
+
+    @staticmethod
+    def _index_on(source: dict, column: str) -> Optional[IndexInfo]:
+        leading = [ix for ix in source["indexes"] if ix.columns and ix.columns[0].lower() == column.lower()]
+        return max(leading, key=lambda ix: (ix.unique, len(ix.columns) == 1), default=None)
+
+    def _is_key(self, source: dict, column: str) -> bool:
+        ix = self._index_on(source, column)
+        return ix is not None and ix.unique and len(ix.columns) == 1
+
+    # ---- predicates ----
+
+    def _filter(self, predicate, column, source: dict) -> tuple[float, bool]:
+        """(selectivity, sargable on `column`) of a single-table predicate."""
+        bare = column.parent is predicate or isinstance(column.parent, exp.Paren)
+        if isinstance(predicate, exp.EQ):
+            if bare and self._is_key(source, column.name):
+                return 1 / max(source["rows"], 1.0), True
+            return EQ_SELECTIVITY, bare
+        if isinstance(predicate, exp.In):
+            n = len(predicate.expressions) or 1
+            return min(1.0, n * EQ_SELECTIVITY), bare
+        if isinstance(predicate, (exp.GT, exp.GTE, exp.LT, exp.LTE)):
+            return RANGE_SELECTIVITY, bare
+        if isinstance(predicate, exp.Between):
+            return BETWEEN_SELECTIVITY, bare
+        if isinstance(predicate, exp.Like):
+            pattern = predicate.expression
+            prefix = isinstance(pattern, exp.Literal) and not pattern.this.startswith(("%", "_"))
+            return EQ_SELECTIVITY, bare and prefix
+        if isinstance(predicate, exp.Is):
+            return EQ_SELECTIVITY, bare
+        if isinstance(predicate, (exp.NEQ, exp.Not)):
+            return NOT_EQ_SELECTIVITY, False
+        return DEFAULT_SELECTIVITY, False
+
+    # ---- scopes ----
+
+    def run_scope(self, scope) -> None:
+        select = scope.expression
+        if isinstance(select, exp.Values):
+            # VALUES (...), (...): one row per tuple
+            self.scope_rows[id(scope)] = float(max(1, len(select.expressions)))
+            return
+        if isinstance(select, exp.Lateral):
+            # CROSS / OUTER APPLY: the applied subquery's rows (per outer row)
+            inner = scope.subquery_scopes + scope.derived_table_scopes
+            self.scope_rows[id(scope)] = sum(self.scope_rows.get(id(s), self.default_rows) for s in inner) or self.default_rows
+            return
+        if not isinstance(select, exp.Select):
+            # UNION: the sum of its branches (union_scopes in older sqlglot releases);
+            # anything else (e.g. a table-valued function) gets the default size
+            branches = getattr(scope, "set_operation_scopes", None) or getattr(scope, "union_scopes", [])
+            if branches:
+                self.scope_rows[id(scope)] = sum(self.scope_rows.get(id(s), 0.0) for s in branches)
+            else:
+                self.scope_rows[id(scope)] = self.default_rows
+            return
+
+        sources = {alias.lower(): self._source(alias, src) for alias, (_, src) in scope.selected_sources.items()}
+        for s in sources.values():
+            s.update(selectivity=1.0, seek=None, filtered=False)
+        edges = []  # (alias_a, alias_b, selectivity, column of b, column of a)
+
+        predicates = [select.args["where"].this] if select.args.get("where") else []
+        predicates += [j.args["on"] for j in select.args.get("joins") or [] if j.args.get("on") is not None]
+        for predicate in (c for p in predicates for c in _conjuncts(p)):
+            columns = _own_columns(predicate)
+            owners = {self._owner(c, sources) for c in columns} - {None}
+            if len(owners) == 1:
+                alias = owners.pop()
+                source = sources[alias]
+                column = next(c for c in columns if self._owner(c, sources) == alias)
+                selectivity, sargable = self._filter(predicate, column, source)
+                source["selectivity"] *= selectivity
+                source["filtered"] = True
+                index = self._index_on(source, column.name) if sargable else None
+                if index is not None and source["seek"] is None:
+                    source["seek"] = index.name
+            elif len(owners) == 2:
+                a, b = sorted(owners)
+                if isinstance(predicate, exp.EQ) and all(isinstance(side, exp.Column) for side in (predicate.left, predicate.right)):
+                    col_a = next(c.name for c in columns if self._owner(c, sources) == a)
+                    col_b = next(c.name for c in columns if self._owner(c, sources) == b)
+                    if self._is_key(sources[b], col_b):
+                        selectivity = 1 / max(sources[b]["rows"], 1.0)
+                    elif self._is_key(sources[a], col_a):
+                        selectivity = 1 / max(sources[a]["rows"], 1.0)
+                    else:
+                        selectivity = 1 / max(sources[a]["rows"], sources[b]["rows"], 1.0)
+                    edges.append((a, b, selectivity, col_b, col_a))
+                else:
+                    edges.append((a, b, DEFAULT_SELECTIVITY, None, None))
+
+        accesses = {}
+        for alias, s in sources.items():
+            estimated = max(1.0, s["rows"] * s["selectivity"])
+            if s["derived"]:
+                access, read = "derived", 0.0  # counted in its own scope
+            elif s["seek"] is not None:
+                access, read = "seek", estimated
+            else:
+                access, read = "scan", s["rows"]
+            accesses[alias] = TableAccess(
+                s["table"], s["alias"], s["rows"], estimated, access, s["seek"], read, s["filtered"], s["has_stats"]
+            )
+
+        # greedy join order: start small, then always add the connected table that keeps the result smallest
+        remaining = set(accesses)
+        joined: set[str] = set()
+        card = 0.0
+        rows_joined = 0.0
+        lookups: dict[str, float] = {}  # alias -> outer rows driving its index lookups
+        while remaining:
+            best = None
+            for alias in remaining:
+                links = [e for e in edges if (e[0] == alias and e[1] in joined) or (e[1] == alias and e[0] in joined)]
+                selectivity = min((e[2] for e in links), default=1.0)
+                new_card = accesses[alias].estimated_rows * (card * selectivity if joined else 1.0)
+                key = (not links and bool(joined), new_card)
+                if best is None or key < best[0]:
+                    best = (key, alias, new_card, links)
+            _, alias, new_card, links = best
+            access = accesses[alias]
+            if joined and access.access == "scan":
+                for a, b, _, col_b, col_a in links:
+                    col = col_b if b == alias else col_a
+                    index = self._index_on(sources[alias], col) if col else None
+                    if index is not None:
+                        # index nested loop: one lookup per outer row instead of a scan
+                        access.access, access.index = "lookup", index.name
+                        lookups[alias] = max(card, new_card)
+                        access.rows_read = min(access.rows, lookups[alias])
+                        break
+            if joined:
+                rows_joined += new_card
+            card = new_card
+            joined.add(alias)
+            remaining.discard(alias)
+
+        rows = max(card, 1.0) if accesses else 1.0
+        limit, percent = _row_limit(select)
+        if limit is not None and not percent and _has_row_goal(select) and rows > limit:
+            # row goal: execution stops once TOP rows came out of the joins, so every
+            # input is read (and every join runs) only for that fraction of its rows
+            fraction = limit / rows
+            for alias, access in accesses.items():
+                if access.rows_read:
+                    driven = lookups.get(alias, access.rows_read)
+                    access.rows_read = min(access.rows_read, max(1.0, driven * fraction))
+            rows_joined *= fraction
+
+        self.estimate.accesses.extend(accesses.values())
+        self.estimate.rows_read += sum(a.rows_read for a in accesses.values())
+        self.estimate.rows_joined += rows_joined
+
+        if select.args.get("group"):
+            rows = max(1.0, rows * GROUP_BY_REDUCTION)
+        elif any(isinstance(e, exp.AggFunc) for e in select.find_all(exp.AggFunc) if e.find_ancestor(exp.Select) is select):
+            rows = 1.0
+        if limit is not None:
+            rows = min(rows, max(1.0, rows * limit / 100) if percent else limit)
+        self.scope_rows[id(scope)] = rows
+
+
+def estimate_query_cost(sql_query: str, catalog) -> CostEstimate:
+    """Estimate the rows `sql_query` reads and joins, using the catalog's table statistics."""
+    estimator = _Estimator(catalog)
+    for statement in (s for s in sqlglot.parse(sql_query, read="tsql") if s is not None):
+        scopes = list(traverse_scope(statement))  # innermost first, so derived tables are sized before use
+        for scope in scopes:
+            estimator.run_scope(scope)
+        if scopes:
+            estimator.estimate.output_rows += estimator.scope_rows.get(id(scopes[-1]), 0.0)
+    return estimator.estimate
+
+
+def cost_issues(estimate: CostEstimate, catalog, budget: Optional[float] = None) -> list[ValidationIssue]:
+    """Budget and large-scan findings for `estimate`, as validation issues."""
+    budget = cost_budget_rows() if budget is None else budget
+    action = os.getenv("COST_BUDGET_ACTION", "reject").lower()
+    large = float(os.getenv("COST_LARGE_TABLE_ROWS", "1000000"))
+
+    def indexed_columns(table: str) -> list[str]:
+        stats = catalog.stats_of(table)
+        return stats.indexed_columns if stats else []
+
+    issues = []
+    if estimate.cost > budget:
+        worst = max(estimate.accesses, key=lambda a: a.rows_read, default=None)
+        detail = ""
+        if worst is not None and worst.rows_read:
+            how = "full scan" if worst.access == "scan" else f"{worst.access} via {worst.index}"
+            detail = f"; the largest read is a {how} of {worst.table} ({worst.rows_read:,.0f} rows)"
+        if estimate.rows_joined > estimate.rows_read:
+            detail += f"; joins produce about {estimate.rows_joined:,.0f} intermediate rows"
+        suggestions = indexed_columns(worst.table) if worst is not None else []
+        issues.append(
+            ValidationIssue(
+                "cost_over_budget",
+                f"Estimated cost of {estimate.cost:,.0f} rows exceeds the budget of {budget:,.0f}{detail}. "
+                "Add selective filters on indexed columns or aggregate before joining",
+                "warning" if action == "warn" else "error",
+                table=worst.table if worst is not None else None,
+                suggestions=suggestions,
+            )
+        )
+    for access in estimate.accesses:
+        # rows_read, not rows: a TOP without ORDER BY stops its scan early
+        if access.access == "scan" and not access.filtered and access.has_stats and access.rows_read >= large:
+            issues.append(
+                ValidationIssue(
+                    "unfiltered_scan",
+                    f"Full scan of {access.table} ({access.rows:,.0f} rows) with no filter",
+                    "warning",
+                    table=access.table,
+                    suggestions=indexed_columns(access.table),
+                )
+            )
+    return issues
+
+
+def apply_cost_budget(validation_results: dict, sql_query: str, catalog) -> dict:
+    """
+    Estimate the cost of a query that passed validation and merge the
+    findings into `validation_results`. A no-op without table statistics.
+    """
+    if not validation_results.get("is_valid") or not SQLGLOT_AVAILABLE or not catalog.has_stats:
+        return validation_results
+    with span("sql.cost") as s:
+        try:
+            estimate = estimate_query_cost(sql_query, catalog)
+        except SqlglotError:
+            return validation_results
+        except Exception as e:
+            # the estimate is advisory: a shape it does not understand must not block a valid query
+            s.set(error=type(e).__name__)
+            validation_results["warnings"].append(f"Cost estimate skipped ({type(e).__name__}: {e})")
+            return validation_results
+        issues = cost_issues(estimate, catalog)
+        s.set(estimated_cost=estimate.cost, rows_read=estimate.rows_read, rows_joined=estimate.rows_joined)
+    validation_results["errors"].extend(i.message for i in issues if i.severity == "error")
+    validation_results["warnings"].extend(i.message for i in issues if i.severity != "error")
+    validation_results.setdefault("issues", []).extend(asdict(i) for i in issues)
+    validation_results["estimated_cost"] = estimate.cost
+    validation_results["is_valid"] = not validation_results["errors"]
+    return validation_results
+
+
+def import_stats_tsv(path: str) -> dict:
+    """Convert the tab-separated result of STATS_EXPORT_SQL into the stats file format."""
+    tables = {}
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        for row in csv.DictReader(f, delimiter="\t"):
+            table_id = f"{row['table_schema']}.{row['table_name']}"
+            entry = tables.setdefault(table_id, {"rows": int(float(row.get("row_count") or 0)), "indexes": []})
+            columns = [c for c in (row.get("index_columns") or "").split(",") if c and c != "NULL"]
+            if row.get("index_name") and row["index_name"] != "NULL" and columns:
+                entry["indexes"].append(
+                    {
+                        "name": row["index_name"],
+                        "columns": columns,
+                        "unique": row.get("is_unique") in ("1", "True", "true"),
+                        "clustered": row.get("is_clustered") in ("1", "True", "true"),
+                    }
+                )
+    return {"tables": tables}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", nargs="?", help="T-SQL query (or @file) to estimate")
+    parser.add_argument("--export-sql", action="store_true", help="print the SQL Server stats export query")
+    parser.add_argument("--import", dest="import_path", help="TSV result of --export-sql to convert")
+    parser.add_argument("--output", default=None, help="stats file to write (default TABLE_STATS_PATH)")
+    args = parser.parse_args()
+
+    if args.export_sql:
+        print(STATS_EXPORT_SQL)
+        return
+
+    from retrieval_context import get_retrieval_context
+
+    context = get_retrieval_context()
+    if args.import_path:
+        stats = import_stats_tsv(args.import_path)
+        output = args.output or context.table_stats_path
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(stats, f, indent=2)
+        print(f"💾 Saved stats for {len(stats['tables'])} tables to {output}")
+        return
+
+    if not args.query:
+        parser.error("a query, --export-sql or --import is required")
+    query = args.query
+    if query.startswith("@"):
+        with open(query[1:], "r", encoding="utf-8") as f:
+            query = f.read()
+
+    catalog = context.schema_catalog
+    if not catalog.has_stats:
+        print(f"⚠️ No table statistics at {context.table_stats_path}; assuming {os.getenv('COST_DEFAULT_ROWS', '1000')} rows per table")
+    estimate = estimate_query_cost(query, catalog)
+    print(f"\n{'table':<40} {'alias':<10} {'access':<8} {'rows':>14} {'estimated':>14} {'read':>14}  index")
+    for a in estimate.accesses:
+        print(
+            f"{a.table:<40} {a.alias:<10} {a.access:<8} {a.rows:>14,.0f} {a.estimated_rows:>14,.0f} "
+            f"{a.rows_read:>14,.0f}  {a.index or ''}"
+        )
+    print(
+        f"\nRows read: {estimate.rows_read:,.0f}, joined: {estimate.rows_joined:,.0f}, "
+        f"output: {estimate.output_rows:,.0f}, cost: {estimate.cost:,.0f} (budget {cost_budget_rows():,.0f})"
+    )
+    for issue in cost_issues(estimate, catalog):
+        print(f"{'❌' if issue.severity == 'error' else '⚠️'} [{issue.code}] {issue.message}")
+
+
+if __name__ == "__main__":
+    main()
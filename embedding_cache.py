@@ -0,0 +1,276 @@
+"""
+Content-addressed embedding cache.
+
+Embeddings are keyed by (model name, normalized text) and kept in two tiers:
+- an in-process LRU for repeat questions within one session
+- an on-disk SQLite store shared across runs and index rebuilds
+
+Both tiers are size-bounded and track hit/miss counters so we can see
+how many calls to the embedding service were avoided.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text so trivially different spellings of the same question
+    ("How many  orgs?" vs "how many orgs?") share one cache entry.
+    """
+    text = unicodedata.normalize("NFKC", text)
+    return " ".join(text.split()).casefold()
+
+
+def cache_key(model: str, text: str) -> str:
+    payload = f"{model}\x00{normalize_text(text)}".encode("utf-8")
+    return hashlib.sha256(payload).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier (memory LRU + SQLite) cache of float32 embedding vectors.
+
+    Args:
+        path: SQLite file for the disk tier, or None for a memory-only cache
+        max_memory_entries: LRU capacity of the in-process tier
+        max_disk_entries: row limit of the disk tier (least recently used rows are evicted)
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        max_memory_entries: int = 4096,
+        max_disk_entries: int = 200_000,
+    ):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+        self.stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "evictions": 0,
+        }
+
+        if path:
+            self._conn = sqlite3.connect(path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    dim INTEGER NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_embeddings_last_access ON embeddings(last_access)"
+            )
+            self._conn.commit()
+
+    # ---- memory tier ----
+
+    def _memory_get(self, key: str) -> Optional[np.ndarray]:
+        vec = self._memory.get(key)
+        if vec is not None:
+            self._memory.move_to_end(key)
+        return vec
+
+    def _memory_put(self, key: str, vec: np.ndarray) -> None:
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    # ---- disk tier ----
+
+    def _disk_get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if self._conn is None or not keys:
+            return {}
+        found: Dict[str, np.ndarray] = {}
+        # stay well below SQLite's bound-parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            placeholders = ",".join("?" for _ in chunk)
+            rows = self._conn.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                chunk,
+            ).fetchall()
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype="float32").copy()
+        if found:
+            now = time.time()
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE key = ?",
+                [(now, k) for k in found],
+            )
+            self._conn.commit()
+        return found
+
+    def _disk_put_many(self, model: str, items: Dict[str, np.ndarray]) -> None:
+        if self._conn is None or not items:
+            return
+        now = time.time()
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, model, dim, vector, last_access) VALUES (?, ?, ?, ?, ?)",
+            [
+                (k, model, int(v.shape[0]), np.asarray(v, dtype="float32").tobytes(), now)
+                for k, v in items.items()
+            ],
+        )
+        self._evict_disk()
+        self._conn.commit()
+
+    def _evict_disk(self) -> None:
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        overflow = count - self.max_disk_entries
+        if overflow > 0:
+            self._conn.execute(
+                """
+                DELETE FROM embeddings WHERE key IN (
+                    SELECT key FROM embeddings ORDER BY last_access ASC LIMIT ?
+                )
+                """,
+                (overflow,),
+            )
+            self.stats["evictions"] += overflow
+
+    # ---- public API ----
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """
+        Look up embeddings for `texts`. Returns a list aligned with the input,
+        with None for every text that is not cached in either tier.
+        """
+        keys = [cache_key(model, t) for t in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+
+        with self._lock:
+            pending: Dict[str, List[int]] = {}
+            for i, key in enumerate(keys):
+                vec = self._memory_get(key)
+                if vec is not None:
+                    results[i] = vec
+                    self.stats["memory_hits"] += 1
+                else:
+                    pending.setdefault(key, []).append(i)
+
+            disk_found = self._disk_get_many(list(pending))
+            for key, positions in pending.items():
+                vec = disk_found.get(key)
+                if vec is None:
+                    self.stats["misses"] += len(positions)
+                    continue
+                self._memory_put(key, vec)
+                self.stats["disk_hits"] += len(positions)
+                for i in positions:
+                    results[i] = vec
+
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: np.ndarray) -> None:
+        items = {
+            cache_key(model, t): np.asarray(v, dtype="float32")
+            for t, v in zip(texts, vectors)
+        }
+        with self._lock:
+            for key, vec in items.items():
+                self._memory_put(key, vec)
+            self._disk_put_many(model, items)
+            self.stats["writes"] += len(items)
+
+    def get_or_embed(
+        self,
+        model: str,
+        texts: List[str],
+        embed_fn: Callable[[List[str]], np.ndarray],
+    ) -> np.ndarray:
+        """
+        Return embeddings for all `texts`, calling `embed_fn` only for the
+        (deduplicated) texts that are not already cached.
+        """
+        if not texts:
+            return np.zeros((0, 0), dtype="float32")
+
+        cached = self.get_many(model, texts)
+
+        missing: Dict[str, str] = {}
+        for text, vec in zip(texts, cached):
+            if vec is None:
+                missing.setdefault(cache_key(model, text), text)
+
+        fresh: Dict[str, np.ndarray] = {}
+        if missing:
+            miss_texts = list(missing.values())
+            miss_vectors = np.asarray(embed_fn(miss_texts), dtype="float32")
+            self.put_many(model, miss_texts, miss_vectors)
+            fresh = dict(zip(missing.keys(), miss_vectors))
+
+        rows = [
+            vec if vec is not None else fresh[cache_key(model, text)]
+            for text, vec in zip(texts, cached)
+        ]
+        return np.vstack(rows).astype("float32")
+
+    def hit_rate(self) -> float:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._conn is not None:
+                self._conn.execute("DELETE FROM embeddings")
+                self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+# ========= SHARED INSTANCE =========
+
+_default_cache: Optional[EmbeddingCache] = None
+_default_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Process-wide cache configured from the environment:
+    - EMBEDDING_CACHE_PATH: SQLite file ("" keeps the cache memory-only)
+    - EMBEDDING_CACHE_MAX_MEMORY / EMBEDDING_CACHE_MAX_DISK: tier sizes
+    - EMBEDDING_CACHE_DISABLED=1 turns caching off entirely
+    """
+    global _default_cache
+    if os.getenv("EMBEDDING_CACHE_DISABLED", "0") == "1":
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = EmbeddingCache(
+                path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite") or None,
+                max_memory_entries=int(os.getenv("EMBEDDING_CACHE_MAX_MEMORY", "4096")),
+                max_disk_entries=int(os.getenv("EMBEDDING_CACHE_MAX_DISK", "200000")),
+            )
+        return _default_cache
@@ -0,0 +1,170 @@
+"""
+Concurrent, rate-limit-aware batch embedding.
+
+Texts are packed into batches bounded by both item count and an estimated
+token budget, the batches are sent from a thread pool, throttled or failed
+calls (429 / 5xx / connection errors) are retried with exponential backoff,
+and the vectors come back in input order.
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple
+
+import numpy as np
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Rough chars-per-token ratio for English/identifier text; good enough for batching
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def plan_batches(
+    texts: List[str],
+    max_batch_size: int = 16,
+    max_batch_tokens: int = 8000,
+) -> List[Tuple[int, int]]:
+    """
+    Split `texts` into contiguous [start, end) ranges so that every batch has
+    at most `max_batch_size` items and (unless a single text is larger on its
+    own) at most `max_batch_tokens` estimated tokens.
+    """
+    batches: List[Tuple[int, int]] = []
+    start = 0
+    tokens = 0
+    for i, text in enumerate(texts):
+        t = estimate_tokens(text)
+        full = (i - start) >= max_batch_size or (tokens + t > max_batch_tokens and i > start)
+        if full:
+            batches.append((start, i))
+            start, tokens = i, 0
+        tokens += t
+    if start < len(texts):
+        batches.append((start, len(texts)))
+    return batches
+
+
+def _status_code(exc: BaseException) -> Optional[int]:
+    code = getattr(exc, "status_code", None)
+    if code is None:
+        response = getattr(exc, "response", None)
+        code = getattr(response, "status_code", None)
+    return code
+
+
+def _retry_after_seconds(exc: BaseException) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After") or headers.get("retry-after")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(exc: BaseException) -> bool:
+    code = _status_code(exc)
+    if code is not None:
+        return code in RETRYABLE_STATUS_CODES
+    # no HTTP status: connection resets, timeouts, DNS hiccups
+    return isinstance(exc, (ConnectionError, TimeoutError)) or type(exc).__name__ in {
+        "ServiceRequestError",
+        "ServiceResponseError",
+    }
+
+
+def is_payload_too_large(exc: BaseException) -> bool:
+    code = _status_code(exc)
+    if code == 413:
+        return True
+    return code == 400 and "maximum context length" in str(exc).lower()
+
+
+class _Backoff:
+    """Exponential backoff with full jitter, honouring Retry-After when present."""
+
+    def __init__(self, base_delay: float = 1.0, max_delay: float = 60.0):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, exc: BaseException) -> float:
+        retry_after = _retry_after_seconds(exc)
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+
+def embed_concurrently(
+    texts: List[str],
+    embed_batch: Callable[[List[str]], List[List[float]]],
+    max_workers: int = 4,
+    max_batch_size: int = 16,
+    max_batch_tokens: int = 8000,
+    max_retries: int = 5,
+    base_delay: float = 1.0,
+) -> np.ndarray:
+    """
+    Embed `texts` with up to `max_workers` batches in flight.
+
+    Args:
+        texts: Strings to embed
+        embed_batch: Function that embeds one batch and returns vectors in input order
+        max_workers: Number of concurrent requests
+        max_batch_size: Maximum number of texts per request
+        max_batch_tokens: Estimated token budget per request
+        max_retries: Retries per batch on throttling / transient errors
+        base_delay: Initial backoff delay in seconds
+
+    Returns:
+        float32 array of shape (len(texts), embedding_dim), in input order
+    """
+    if not texts:
+        return np.zeros((0, 0), dtype="float32")
+
+    backoff = _Backoff(base_delay=base_delay)
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    results_lock = threading.Lock()
+
+    def run_batch(start: int, end: int) -> None:
+        attempt = 0
+        while True:
+            try:
+                vectors = embed_batch(texts[start:end])
+                break
+            except Exception as exc:
+                if is_payload_too_large(exc) and end - start > 1:
+                    # adapt: the token estimate was too optimistic, split and retry
+                    mid = (start + end) // 2
+                    run_batch(start, mid)
+                    run_batch(mid, end)
+                    return
+                if not is_retryable(exc) or attempt >= max_retries:
+                    raise
+                time.sleep(backoff.delay(attempt, exc))
+                attempt += 1
+
+        if len(vectors) != end - start:
+            raise RuntimeError(
+                f"Embedding service returned {len(vectors)} vectors for a batch of {end - start} texts"
+            )
+        with results_lock:
+            results[start:end] = vectors
+
+    batches = plan_batches(texts, max_batch_size=max_batch_size, max_batch_tokens=max_batch_tokens)
+
+    if max_workers <= 1 or len(batches) == 1:
+        for start, end in batches:
+            run_batch(start, end)
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="embed") as pool:
+            futures = [pool.submit(run_batch, start, end) for start, end in batches]
+            for f in futures:
+                f.result()  # re-raise the first failure
+
+    return np.array(results, dtype="float32")
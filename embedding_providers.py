@@ -0,0 +1,216 @@
+"""
+Pluggable embedding providers.
+
+EMBEDDING_PROVIDER picks the backend used for index builds and question
+embeddings:
+- azure:   Azure AI Inference embeddings (AZURE_OPENAI_*), the default
+- hashing: signed feature hashing of identifier tokens and character
+           trigrams; pure numpy, no model download, fully offline
+- sentence-transformers: a local CPU model (EMBEDDING_MODEL, default
+           all-MiniLM-L6-v2); needs the optional sentence-transformers package
+
+Every provider embeds in batches from a thread pool (embedding_pipeline).
+Each index build records the provider, model and dimension in its manifest,
+and loading an index built by a different provider raises, because those
+vectors cannot be compared with the question vectors.
+
+Environment:
+- EMBEDDING_PROVIDER: azure | hashing | sentence-transformers (default azure)
+- EMBEDDING_MODEL: sentence-transformers model name or path
+- EMBEDDING_DIM: hashing dimension (default 1024)
+- EMBEDDING_LOCAL_WORKERS: threads for the local providers (default min(4, CPUs))
+- EMBEDDING_MAX_WORKERS / EMBEDDING_MAX_BATCH_TOKENS / EMBEDDING_MAX_RETRIES: Azure throughput
+"""
+
+import os
+import zlib
+from collections import Counter
+from functools import lru_cache
+from typing import List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embedding_pipeline import embed_concurrently
+
+load_dotenv()
+
+EMBEDDING_PROVIDERS = ("azure", "hashing", "sentence-transformers")
+DEFAULT_HASHING_DIM = 1024
+DEFAULT_SENTENCE_TRANSFORMERS_MODEL = "all-MiniLM-L6-v2"
+
+
+def _local_workers() -> int:
+    return int(os.getenv("EMBEDDING_LOCAL_WORKERS") or min(4, os.cpu_count() or 1))
+
+
+class EmbeddingProvider:
+    """Base class: subclasses set `name` / `model` and implement embed_batch."""
+
+    name = ""
+    model = ""
+    max_workers = 1
+    batch_size = 16
+    max_batch_tokens = 8000
+    max_retries = 0
+
+    def embed_batch(self, batch: List[str]):
+        raise NotImplementedError
+
+    def embed(self, texts: List[str], batch_size: Optional[int] = None) -> np.ndarray:
+        """Embed `texts` (not normalized); returns float32 (len(texts), dim) in input order."""
+        return embed_concurrently(
+            texts,
+            self.embed_batch,
+            max_workers=self.max_workers,
+            max_batch_size=batch_size or self.batch_size,
+            max_batch_tokens=self.max_batch_tokens,
+            max_retries=self.max_retries,
+        )
+
+    @property
+    def cache_model(self) -> str:
+        """Key under which the embedding cache stores this provider's vectors."""
+        return f"{self.name}:{self.model}"
+
+    def describe(self, dim: int) -> dict:
+        """Manifest entry for an index built with this provider."""
+        return {"provider": self.name, "model": self.model, "dim": int(dim)}
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    name = "azure"
+
+    def __init__(self):
+        from retrieval_context import get_retrieval_context
+
+        self._context = get_retrieval_context
+        self.max_workers = int(os.getenv("EMBEDDING_MAX_WORKERS", "4"))
+        self.max_batch_tokens = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", "8000"))
+        self.max_retries = int(os.getenv("EMBEDDING_MAX_RETRIES", "5"))
+
+    @property
+    def model(self) -> str:
+        return self._context().embedding_model or ""
+
+    @property
+    def cache_model(self) -> str:
+        # plain model name, so caches filled before providers existed stay valid
+        return self.model
+
+    def embed_batch(self, batch: List[str]) -> List[List[float]]:
+        context = self._context()
+        response = context.embeddings_client.embed(input=batch, model=context.embedding_model)
+        # response.data is in order of input
+        return [item.embedding for item in response.data]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Feature hashing over identifier-aware tokens (see lexical_index.tokenize)
+    and character trigrams, so "organizations" lands near "organization_nme".
+    Deterministic across processes and machines (crc32, not hash()).
+    """
+
+    name = "hashing"
+    batch_size = 256
+    max_batch_tokens = 1_000_000
+
+    def __init__(self, dim: Optional[int] = None):
+        self.dim = int(dim or os.getenv("EMBEDDING_DIM") or DEFAULT_HASHING_DIM)
+        self.model = f"hashing-{self.dim}"
+        self.max_workers = _local_workers()
+
+    @staticmethod
+    def features(text: str) -> Counter:
+        from lexical_index import tokenize
+
+        feats = Counter()
+        for token in tokenize(text):
+            feats[token] += 1.0
+            padded = f"#{token}#"
+            for i in range(len(padded) - 2):
+                feats["3:" + padded[i:i + 3]] += 0.5
+        return feats
+
+    def embed_one(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype="float32")
+        feats = self.features(text)
+        if not feats:
+            return vec
+        hashes = np.array([zlib.crc32(f.encode("utf-8")) for f in feats], dtype="uint64")
+        signs = np.where(hashes & 1, -1.0, 1.0).astype("float32")
+        weights = np.log1p(np.array(list(feats.values()), dtype="float32"))  # sublinear tf
+        np.add.at(vec, ((hashes >> 1) % self.dim).astype("int64"), signs * weights)
+        return vec
+
+    def embed_batch(self, batch: List[str]) -> np.ndarray:
+        return np.vstack([self.embed_one(text) for text in batch])
+
+
+class SentenceTransformerProvider(EmbeddingProvider):
+    name = "sentence-transformers"
+    batch_size = 64
+    max_batch_tokens = 1_000_000
+
+    def __init__(self, model: Optional[str] = None):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise RuntimeError(
+                "EMBEDDING_PROVIDER=sentence-transformers needs `pip install sentence-transformers`"
+            ) from e
+        self.model = model or os.getenv("EMBEDDING_MODEL") or DEFAULT_SENTENCE_TRANSFORMERS_MODEL
+        self._st = SentenceTransformer(self.model, device="cpu")
+        self.max_workers = _local_workers()
+
+    def embed_batch(self, batch: List[str]) -> np.ndarray:
+        return self._st.encode(batch, batch_size=len(batch), convert_to_numpy=True, show_progress_bar=False)
+
+
+def resolve_provider_name(name: Optional[str] = None) -> str:
+    name = (name or os.getenv("EMBEDDING_PROVIDER") or "azure").lower()
+    if name not in EMBEDDING_PROVIDERS:
+        raise ValueError(f"Unknown embedding provider '{name}'. Use one of: {', '.join(EMBEDDING_PROVIDERS)}")
+    return name
+
+
+@lru_cache(maxsize=None)
+def _create_provider(name: str) -> EmbeddingProvider:
+    if name == "hashing":
+        return HashingEmbeddingProvider()
+    if name == "sentence-transformers":
+        return SentenceTransformerProvider()
+    return AzureEmbeddingProvider()
+
+
+def get_embedding_provider(name: Optional[str] = None) -> EmbeddingProvider:
+    """Provider `name` (default EMBEDDING_PROVIDER), created once per process."""
+    return _create_provider(resolve_provider_name(name))
+
+
+def check_index_embedding(index_path: str, index, provider: Optional[EmbeddingProvider] = None) -> None:
+    """
+    Raise ValueError when the index at `index_path` was built by another
+    embedding provider / model or has another dimension. Indexes without an
+    embedding entry in their manifest (built before it existed) are accepted.
+    """
+    from index_factory import read_manifest
+
+    manifest = read_manifest(index_path) or {}
+    built = manifest.get("embedding")
+    if not built:
+        return
+    provider = provider or get_embedding_provider()
+    current = provider.describe(index.d)
+    mismatched = built.get("provider") != current["provider"] or (
+        built.get("model") and current["model"] and built["model"] != current["model"]
+    )
+    dim = getattr(provider, "dim", None)
+    if mismatched or (dim is not None and dim != index.d):
+        raise ValueError(
+            f"{index_path} was built with {built.get('provider')} ({built.get('model')}, dim={built.get('dim')}) "
+            f"but EMBEDDING_PROVIDER is {current['provider']} ({current['model']}, "
+            f"dim={dim if dim is not None else 'n/a'}). "
+            "Rebuild it with `python3 preprocess.py` or switch the provider back."
+        )
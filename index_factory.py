@@ -0,0 +1,242 @@
+"""
+FAISS index factory for schema retrieval.
+
+Three index kinds, all cosine similarity (inner product on normalized
+vectors) and all keyed by stable vector ids. Flat and HNSW are wrapped in
+IndexIDMap2; IVF-PQ stores the ids in its inverted lists itself, because
+IndexIDMap2.remove_ids shifts its id table out of step with an IVF index:
+- flat:  exact brute-force search (IndexFlatIP). Best for a few thousand vectors.
+- hnsw:  graph index (IndexHNSWFlat). Fast, high recall, no training, but
+         vectors cannot be removed, so incremental updates rebuild it.
+- ivfpq: inverted lists + product quantization (IndexIVFPQ). Needs training;
+         the trained quantizers are saved inside the index file and reused by
+         incremental updates. Smallest memory footprint for very large catalogs.
+
+Build parameters come from IndexSpec (or the environment, see
+IndexSpec.from_env); search-time knobs (nprobe / efSearch) can be changed
+on a loaded index with apply_search_params. Each saved index gets a
+`<index>.manifest.json` sidecar recording how it was built and the SHA-256
+of the index and metadata files. The manifest is written last, so it is
+the commit point of a build: read_index_files only hands out an index and
+metadata whose hashes match it, and a vector id can never be looked up in
+the metadata of another build.
+"""
+
+import hashlib
+import json
+import math
+import os
+import time
+from dataclasses import asdict, dataclass, fields
+from typing import Optional
+
+import numpy as np
+
+INDEX_KINDS = ("flat", "hnsw", "ivfpq")
+
+
+@dataclass
+class IndexSpec:
+    kind: str = "flat"
+    # HNSW build / search
+    hnsw_m: int = 32
+    ef_construction: int = 200
+    ef_search: int = 64
+    # IVF-PQ build / search (0 = derive from the data size / dimension)
+    nlist: int = 0
+    pq_m: int = 0
+    pq_nbits: int = 8
+    nprobe: int = 16
+
+    def __post_init__(self):
+        self.kind = self.kind.lower()
+        if self.kind not in INDEX_KINDS:
+            raise ValueError(f"Unknown index kind '{self.kind}'. Use one of: {', '.join(INDEX_KINDS)}")
+
+    @classmethod
+    def from_env(cls) -> "IndexSpec":
+        """
+        FAISS_INDEX_TYPE (flat | hnsw | ivfpq), FAISS_HNSW_M, FAISS_EF_CONSTRUCTION,
+        FAISS_EF_SEARCH, FAISS_NLIST, FAISS_PQ_M, FAISS_PQ_NBITS, FAISS_NPROBE.
+        """
+        defaults = cls()
+        env = {
+            "kind": os.getenv("FAISS_INDEX_TYPE"),
+            "hnsw_m": os.getenv("FAISS_HNSW_M"),
+            "ef_construction": os.getenv("FAISS_EF_CONSTRUCTION"),
+            "ef_search": os.getenv("FAISS_EF_SEARCH"),
+            "nlist": os.getenv("FAISS_NLIST"),
+            "pq_m": os.getenv("FAISS_PQ_M"),
+            "pq_nbits": os.getenv("FAISS_PQ_NBITS"),
+            "nprobe": os.getenv("FAISS_NPROBE"),
+        }
+        values = {}
+        for f in fields(cls):
+            raw = env.get(f.name)
+            default = getattr(defaults, f.name)
+            values[f.name] = default if not raw else type(default)(raw)
+        return cls(**values)
+
+    @property
+    def supports_remove(self) -> bool:
+        return self.kind != "hnsw"
+
+
+# ========= BUILD =========
+
+def _default_nlist(n: int) -> int:
+    # ~4*sqrt(n) lists, with at least ~39 training points per centroid
+    return max(1, min(int(4 * math.sqrt(n)), n // 39 or 1))
+
+
+def _default_pq_m(dim: int) -> int:
+    # largest sub-quantizer count giving >= 4 dims per sub-vector
+    for m in (96, 64, 48, 32, 24, 16, 12, 8, 4, 2, 1):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+
+def build_index(vectors: np.ndarray, ids: np.ndarray, spec: Optional[IndexSpec] = None):
+    """
+    Build an id-mapped index over L2-normalized `vectors` with the given ids.
+    IVF-PQ is trained on `vectors` first; parameters that do not fit the
+    data (too many lists / codes for too few vectors) are scaled down.
+    """
+    import faiss
+
+    spec = spec or IndexSpec()
+    vectors = np.ascontiguousarray(vectors, dtype="float32")
+    n, dim = vectors.shape
+
+    if spec.kind == "flat":
+        base = faiss.IndexFlatIP(dim)
+    elif spec.kind == "hnsw":
+        base = faiss.IndexHNSWFlat(dim, spec.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        base.hnsw.efConstruction = spec.ef_construction
+    else:
+        nlist = spec.nlist or _default_nlist(n)
+        nlist = max(1, min(nlist, n))
+        pq_m = spec.pq_m or _default_pq_m(dim)
+        if dim % pq_m:
+            raise ValueError(f"FAISS_PQ_M={pq_m} must divide the embedding dimension {dim}")
+        # PQ k-means wants ~39 training points per code (2**nbits codes)
+        nbits = max(1, min(spec.pq_nbits, int(math.log2(max(n // 39, 2)))))
+        quantizer = faiss.IndexFlatIP(dim)
+        base = faiss.IndexIVFPQ(quantizer, dim, nlist, pq_m, nbits, faiss.METRIC_INNER_PRODUCT)
+        base.train(vectors)
+
+    # IVF keeps ids in its inverted lists (add_with_ids / remove_ids work natively)
+    index = base if spec.kind == "ivfpq" else faiss.IndexIDMap2(base)
+    index.add_with_ids(vectors, np.asarray(ids, dtype="int64"))
+    apply_search_params(index, spec.nprobe, spec.ef_search)
+    return index
+
+
+# ========= SEARCH KNOBS =========
+
+def _base_index(index):
+    import faiss
+
+    inner = index.index if hasattr(index, "id_map") else index
+    return faiss.downcast_index(inner)
+
+
+def index_kind(index) -> str:
+    import faiss
+
+    base = _base_index(index)
+    if isinstance(base, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(base, faiss.IndexIVF):
+        return "ivfpq"
+    return "flat"
+
+
+def apply_search_params(index, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+    """Set nprobe (IVF) / efSearch (HNSW) on a built or loaded index; no-op for flat."""
+    import faiss
+
+    base = _base_index(index)
+    if nprobe and isinstance(base, faiss.IndexIVF):
+        base.nprobe = min(int(nprobe), base.nlist)
+    if ef_search and isinstance(base, faiss.IndexHNSW):
+        base.hnsw.efSearch = int(ef_search)
+    return index
+
+
+def apply_search_params_from_env(index):
+    """Apply FAISS_NPROBE / FAISS_EF_SEARCH, if set, to a loaded index."""
+    nprobe = os.getenv("FAISS_NPROBE")
+    ef_search = os.getenv("FAISS_EF_SEARCH")
+    return apply_search_params(index, int(nprobe) if nprobe else None, int(ef_search) if ef_search else None)
+
+
+# ========= MANIFEST =========
+
+def manifest_path(index_path: str) -> str:
+    return f"{index_path}.manifest.json"
+
+
+def build_manifest(
+    index, spec: IndexSpec, embedding: Optional[dict] = None, files: Optional[dict] = None
+) -> dict:
+    """
+    Build parameters of `index`; `embedding` records the provider / model / dim
+    that produced its vectors, `files` the {"index", "metadata"} SHA-256 digests.
+    """
+    manifest = {"kind": index_kind(index), "dim": int(index.d), "ntotal": int(index.ntotal), "spec": asdict(spec)}
+    if embedding:
+        manifest["embedding"] = embedding
+    if files:
+        manifest["files"] = files
+    base = _base_index(index)
+    if hasattr(base, "nlist"):
+        manifest["nlist"] = int(base.nlist)
+    if hasattr(base, "pq"):
+        manifest["pq_m"] = int(base.pq.M)
+        manifest["pq_nbits"] = int(base.pq.nbits)
+    return manifest
+
+
+def read_manifest(index_path: str) -> Optional[dict]:
+    path = manifest_path(index_path)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def sha256_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def read_index_files(index_path: str, metadata_path: str, retries: int = 5, wait_s: float = 0.2):
+    """
+    (index, metadata bytes, manifest) of one build. Index and metadata are
+    read into memory and checked against the digests in the manifest; a
+    reader that lands between the writes of a rebuild retries, and a set
+    left mixed by an interrupted build raises. Manifests from before the
+    digests were recorded are not checked.
+    """
+    import faiss
+
+    for attempt in range(retries + 1):
+        manifest = read_manifest(index_path) or {}
+        with open(index_path, "rb") as f:
+            index_bytes = f.read()
+        with open(metadata_path, "rb") as f:
+            metadata_bytes = f.read()
+        expected = manifest.get("files")
+        if not expected or (
+            sha256_bytes(index_bytes) == expected.get("index")
+            and sha256_bytes(metadata_bytes) == expected.get("metadata")
+        ):
+            index = faiss.deserialize_index(np.frombuffer(index_bytes, dtype="uint8"))
+            return index, metadata_bytes, manifest
+        if attempt < retries:
+            time.sleep(wait_s)
+    raise RuntimeError(
+        f"{index_path} and {metadata_path} do not match their manifest (a rebuild was interrupted "
+        "or is still running). Rebuild with `python3 preprocess.py`."
+    )
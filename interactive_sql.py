@@ -9,9 +9,12 @@ import os
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
 from llm_to_query import generate_sql_with_feedback
+from tracing import configure_logging, start_metrics_server
 
 def main():
     """Interactive query interface with feedback collection."""
+    configure_logging()
+    start_metrics_server()
     print("🔍 Interactive LLM-to-SQL Query Generator")
     print("=" * 50)
     print("Ask natural language questions to generate SQL queries.")
@@ -0,0 +1,182 @@
+"""
+Join-path expansion over the foreign-key graph.
+
+Retrieval ranks tables one by one, so two relevant tables often arrive
+without the table that joins them. JoinGraph is built once per schema
+catalog from the declared FKs (referenced_schema / referenced_table /
+referenced_column in the schema export). Because that export declares
+few constraints, it also infers an edge for every `<x>_id` column that
+names the single-column primary key of exactly one table, or of the one
+table named after it (acct_id -> dbo.t_acct).
+
+connect() approximates a Steiner tree over the selected tables, in
+ranking order. Each step attaches the nearest unconnected table to the
+tree via its shortest path and adds the tables along that path as bridges.
+Declared FKs are preferred over inferred edges.
+
+Environment:
+- JOIN_MAX_HOPS: longest path considered between two selected tables (default 3)
+- JOIN_INFER_FKS: 0 to use declared foreign keys only (default 1)
+"""
+
+import heapq
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+DECLARED_EDGE_WEIGHT = 1.0
+INFERRED_EDGE_WEIGHT = 1.5
+
+
+@dataclass(frozen=True)
+class JoinEdge:
+    table: str
+    column: str
+    ref_table: str
+    ref_column: str
+    inferred: bool = False
+
+    def condition(self) -> str:
+        return f"{self.table}.{self.column} = {self.ref_table}.{self.ref_column}"
+
+
+@dataclass
+class JoinPlan:
+    tables: List[str]  # selected tables followed by the bridges, in order added
+    bridges: List[str] = field(default_factory=list)
+    edges: List[JoinEdge] = field(default_factory=list)
+    unconnected: List[str] = field(default_factory=list)  # not reachable within max_hops
+
+
+class JoinGraph:
+    """Undirected table graph; nodes are catalog table ids, edges are (declared or inferred) FKs."""
+
+    def __init__(self, catalog, infer_edges: bool = True):
+        self.catalog = catalog
+        self.edges: List[JoinEdge] = []
+        self._adj: Dict[str, List[tuple]] = {}
+
+        seen = set()
+        for fk in catalog.foreign_keys:
+            src, dst = catalog.resolve_table(fk.table), catalog.resolve_table(fk.ref_table)
+            if src is None or dst is None or src.id == dst.id:
+                continue
+            self._add(JoinEdge(src.id, fk.column, dst.id, fk.ref_column), DECLARED_EDGE_WEIGHT, seen)
+
+        if infer_edges:
+            owners: Dict[str, List[str]] = {}
+            for info in catalog.tables.values():
+                if len(info.primary_key) == 1 and info.primary_key[0].lower().endswith("_id"):
+                    owners.setdefault(info.primary_key[0].lower(), []).append(info.id)
+            unique_owner = {}
+            for col, ids in owners.items():
+                if len(ids) > 1:
+                    # several tables key on it (acct_id): keep the one named after it (t_acct)
+                    stem = col[: -len("_id")]
+                    ids = [t for t in ids if t.split(".")[-1].lower() in (stem, f"t_{stem}")]
+                if len(ids) == 1:
+                    unique_owner[col] = ids[0]
+            for info in catalog.tables.values():
+                for col in info.columns:
+                    owner = unique_owner.get(col.name.lower())
+                    if owner and owner != info.id:
+                        ref = catalog.resolve_table(owner).primary_key[0]
+                        self._add(JoinEdge(info.id, col.name, owner, ref, inferred=True), INFERRED_EDGE_WEIGHT, seen)
+
+    def _add(self, edge: JoinEdge, weight: float, seen: set) -> None:
+        key = (edge.table.lower(), edge.column.lower(), edge.ref_table.lower())
+        if key in seen:
+            return
+        seen.add(key)
+        self.edges.append(edge)
+        a, b = edge.table.lower(), edge.ref_table.lower()
+        self._adj.setdefault(a, []).append((b, edge, weight))
+        self._adj.setdefault(b, []).append((a, edge, weight))
+
+    def _table_id(self, name: str) -> Optional[str]:
+        info = self.catalog.resolve_table(name)
+        return info.id if info else None
+
+    def _nearest(self, sources: set, targets: set, max_hops: int):
+        """Multi-source Dijkstra from `sources` to the closest node in `targets`."""
+        heap = [(0.0, 0, node) for node in sources]
+        heapq.heapify(heap)
+        best = {node: 0.0 for node in sources}
+        back: Dict[str, tuple] = {}
+        while heap:
+            cost, hops, node = heapq.heappop(heap)
+            if cost > best.get(node, float("inf")):
+                continue
+            if node in targets:
+                path = []
+                while node in back:
+                    prev, edge = back[node]
+                    path.append(edge)
+                    node = prev
+                return list(reversed(path))
+            if hops >= max_hops:
+                continue
+            for neighbor, edge, weight in self._adj.get(node, ()):
+                new_cost = cost + weight
+                if new_cost < best.get(neighbor, float("inf")):
+                    best[neighbor] = new_cost
+                    back[neighbor] = (node, edge)
+                    heapq.heappush(heap, (new_cost, hops + 1, neighbor))
+        return None
+
+    def shortest_path(self, source: str, target: str, max_hops: int = 3) -> Optional[List[JoinEdge]]:
+        a, b = self._table_id(source), self._table_id(target)
+        if a is None or b is None:
+            return None
+        return self._nearest({a.lower()}, {b.lower()}, max_hops)
+
+    def connect(self, tables: List[str], max_hops: Optional[int] = None, max_bridges: Optional[int] = None) -> JoinPlan:
+        """
+        Connect `tables` (highest ranked first) with as few extra tables as possible.
+        Tables unknown to the catalog are kept but not connected.
+        """
+        max_hops = max_hops if max_hops is not None else int(os.getenv("JOIN_MAX_HOPS", "3"))
+        plan = JoinPlan(tables=list(tables))
+        ids = {t: self._table_id(t) for t in tables}
+        remaining = [ids[t].lower() for t in tables if ids[t]]
+        if not remaining:
+            return plan
+
+        tree = {remaining.pop(0)}
+        while remaining:
+            path = self._nearest(tree, set(remaining), max_hops)
+            if path is None:
+                # nothing reachable: start a new component with the best-ranked leftover
+                node = remaining.pop(0)
+                plan.unconnected.append(self.catalog.resolve_table(node).id)
+                tree.add(node)
+                continue
+
+            new_bridges = []
+            for edge in path:
+                for end in (edge.table, edge.ref_table):
+                    node = end.lower()
+                    if node not in tree and node not in remaining:
+                        new_bridges.append(end)
+                    tree.add(node)
+            if max_bridges is not None and len(plan.bridges) + len(new_bridges) > max_bridges:
+                break
+            plan.bridges.extend(new_bridges)
+            plan.tables.extend(new_bridges)
+            plan.edges.extend(e for e in path if e not in plan.edges)
+            remaining = [node for node in remaining if node not in tree]
+        return plan
+
+
+@lru_cache(maxsize=4)
+def get_join_graph(catalog) -> JoinGraph:
+    """Join graph for `catalog`, built once per catalog instance."""
+    return JoinGraph(catalog, infer_edges=os.getenv("JOIN_INFER_FKS", "1") == "1")
+
+
+def render_join_paths(edges: List[JoinEdge]) -> str:
+    """'Join paths:' section listing the join conditions used to connect the tables."""
+    if not edges:
+        return ""
+    return "Join paths:\n" + "\n".join(f"- {edge.condition()}" for edge in edges)
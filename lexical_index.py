@@ -0,0 +1,199 @@
+"""
+In-process lexical retrieval over the schema metadata.
+
+BM25 over identifier-aware tokens: `t_billed.acct_id` indexes as
+`t_billed`, `billed`, `acct_id`, `acct` and `id`, and camelCase names are
+split too. Questions that name tables or columns directly ("sum billed_amt
+from t_billed") then rank those entries first, which embeddings often miss.
+
+Lexical results can be fused with the vector results by reciprocal rank
+fusion (hybrid mode). When every identifier in the question names a known
+table or column, the lexical results are returned on their own, without
+an embedding call (the "auto" fast path).
+
+Retrieval modes (RETRIEVAL_MODE, default "auto"):
+- vector:  embeddings + FAISS only (previous behaviour)
+- lexical: BM25 only, no network call
+- hybrid:  both, fused with reciprocal rank fusion
+- auto:    lexical fast path on exact identifier matches, hybrid otherwise
+"""
+
+import math
+import os
+import re
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from tracing import span
+
+RETRIEVAL_MODES = ("vector", "lexical", "hybrid", "auto")
+RRF_K = 60
+NAME_WEIGHT = 3
+
+_WORD = re.compile(r"[A-Za-z0-9_]+")
+_IDENTIFIER = re.compile(r"\b[A-Za-z][A-Za-z0-9]*(?:[_.][A-Za-z0-9]+)+\b")
+_CAMEL = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how i in is it many me much of on or per show "
+    "that the their there this to want was what which who with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Identifier-aware tokens: whole snake_case names plus their parts, camelCase split, lowercased."""
+    tokens = []
+    for word in _WORD.findall(text):
+        lower = word.lower()
+        if "_" in word:
+            tokens.append(lower)
+        for part in word.split("_"):
+            for piece in _CAMEL.findall(part):
+                piece = piece.lower()
+                if piece and piece not in STOPWORDS:
+                    tokens.append(piece)
+    return tokens
+
+
+def identifiers_in(text: str) -> List[str]:
+    """Identifier-looking words in a question (contain '_' or '.'), lowercased."""
+    found = []
+    for match in _IDENTIFIER.findall(text):
+        # "b.acct_id" / "dbo.t_billed": keep the snake_case parts, drop aliases and schema names
+        found.extend(part.lower() for part in match.split(".") if "_" in part)
+    return found
+
+
+def resolve_mode(mode: Optional[str]) -> str:
+    mode = (mode or os.getenv("RETRIEVAL_MODE") or "auto").lower()
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode '{mode}'. Use one of: {', '.join(RETRIEVAL_MODES)}")
+    return mode
+
+
+class BM25Index:
+    """
+    Okapi BM25 over schema metadata entries.
+
+    Args:
+        metadata: {vector_id: entry} as loaded with the FAISS index; entries
+            are indexed by their `text` (plus table / column names)
+    """
+
+    def __init__(self, metadata: Dict[int, dict], k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.ids = np.array(list(metadata), dtype="int64")
+        self.identifiers: set = set()
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        lengths = np.zeros(len(self.ids), dtype="float32")
+        for row, entry in enumerate(metadata.values()):
+            names = [entry.get("id", ""), entry.get("table_name", ""), entry.get("column_name", "")]
+            self.identifiers.update(n.lower() for n in names if n)
+            self.identifiers.update(p.lower() for n in names if n for p in n.split("."))
+            # names count NAME_WEIGHT times so "t_billed" outranks long tables that mention it
+            counts = Counter(tokenize(" ".join(names)) * NAME_WEIGHT + tokenize(entry.get("text", "")))
+            # whole snake_case names in the text: the column list of a table-level entry
+            self.identifiers.update(token for token in counts if "_" in token)
+            lengths[row] = sum(counts.values())
+            for token, tf in counts.items():
+                postings.setdefault(token, []).append((row, tf))
+
+        n_docs = max(len(self.ids), 1)
+        self.avg_len = float(lengths.mean()) if len(lengths) else 0.0
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / (self.avg_len or 1.0))
+        self._postings = {}
+        for token, entries in postings.items():
+            rows = np.array([r for r, _ in entries], dtype="int64")
+            tfs = np.array([tf for _, tf in entries], dtype="float32")
+            idf = math.log(1 + (n_docs - len(entries) + 0.5) / (len(entries) + 0.5))
+            self._postings[token] = (rows, tfs, idf)
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.ids), dtype="float32")
+        for token in set(tokenize(query)):
+            posting = self._postings.get(token)
+            if posting is None:
+                continue
+            rows, tfs, idf = posting
+            scores[rows] += idf * tfs * (self.k1 + 1) / (tfs + self._norm[rows])
+        return scores
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Top-k (vector_id, score) with a positive score, best first."""
+        scores = self.scores(query)
+        k = min(k, len(scores))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(self.ids[i]), float(scores[i])) for i in top if scores[i] > 0]
+
+    def exact_match(self, query: str) -> bool:
+        """True when the question names identifiers and every one of them is a known table / column."""
+        names = identifiers_in(query)
+        return bool(names) and all(name in self.identifiers for name in names)
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """Fuse several ranked id lists; score = sum of 1 / (k + rank)."""
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda x: x[1], reverse=True)
+
+
+def search_schema(
+    questions: List[str],
+    k: int,
+    index,
+    lexical: BM25Index,
+    embed: Callable[[List[str]], np.ndarray],
+    mode: Optional[str] = None,
+) -> List[List[Tuple[int, float]]]:
+    """
+    Rank metadata entries for each question. Returns one [(vector_id, score)]
+    list per question, best first.
+
+    Args:
+        questions: Natural-language questions
+        k: Results per question
+        index: FAISS index over the same metadata (vector / hybrid modes)
+        lexical: BM25Index over the same metadata
+        embed: Returns normalized question vectors; only called for the
+            questions that need the vector side, in a single batch
+        mode: vector | lexical | hybrid | auto (default RETRIEVAL_MODE)
+    """
+    mode = resolve_mode(mode)
+    results: List[Optional[List[Tuple[int, float]]]] = [None] * len(questions)
+
+    lexical_hits: List[List[Tuple[int, float]]] = [[] for _ in questions]
+    if mode != "vector":
+        candidates = k if mode == "lexical" else 2 * k
+        with span("retrieval.bm25", questions=len(questions), k=candidates):
+            lexical_hits = [lexical.search(q, candidates) for q in questions]
+
+    for i, q in enumerate(questions):
+        if mode == "lexical" or (mode == "auto" and lexical_hits[i] and lexical.exact_match(q)):
+            results[i] = lexical_hits[i][:k]
+
+    pending = [i for i, r in enumerate(results) if r is None]
+    if pending:
+        q_vecs = embed([questions[i] for i in pending])
+        with span("retrieval.faiss", questions=len(pending), k=k if mode == "vector" else 2 * k):
+            D, I = index.search(q_vecs, k if mode == "vector" else 2 * k)
+        for row, i in enumerate(pending):
+            vector_hits = [(int(idx), float(score)) for idx, score in zip(I[row], D[row]) if idx != -1]
+            if mode == "vector" or not lexical_hits[i]:
+                results[i] = vector_hits[:k]
+            else:
+                fused = reciprocal_rank_fusion([[v for v, _ in vector_hits], [v for v, _ in lexical_hits[i]]])
+                results[i] = fused[:k]
+    return results
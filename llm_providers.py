@@ -0,0 +1,310 @@
+"""
+Pluggable LLM backends for SQL generation.
+
+LLM_PROVIDER picks where chat_once sends prompts:
+- matcha: Matcha /completions through the shared pooled client (default)
+- openai: any OpenAI-compatible /chat/completions endpoint (OpenAI, Azure
+          OpenAI proxies, vLLM, Ollama, llm_stub_server.py, ...)
+- replay: answers in-process from recorded responses (feedback_data.jsonl),
+          no network at all
+
+The HTTP providers share MatchaClient's pooled session, retries with
+backoff and in-flight cap. For load tests, run llm_stub_server.py (which
+speaks both the Matcha and the OpenAI protocol) and point MATCHA_BASE_URL
+or LLM_BASE_URL at it.
+
+Environment:
+- LLM_PROVIDER: matcha | openai | replay (default matcha)
+- LLM_BASE_URL, LLM_API_KEY, LLM_MODEL, LLM_TEMPERATURE: OpenAI-compatible endpoint
+- LLM_READ_TIMEOUT / LLM_MAX_RETRIES / LLM_MAX_CONCURRENCY: OpenAI-compatible client limits
+- LLM_REPLAY_PATH: recorded responses for replay (default feedback_data.jsonl)
+- LLM_REPLAY_LATENCY_MS: simulated latency per replayed call (default 0)
+- LLM_REPLAY_TOKENS_PER_S: simulated generation speed for replay (default 0 = instant)
+
+Providers also offer stream(prompt), an iterator of text chunks (see
+sql_stream). The OpenAI-compatible backend streams over server-sent
+events; Matcha's /completions has no streaming mode, so it yields the
+whole answer at once.
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from typing import Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from matcha_client import MatchaClient, MatchaError, get_matcha_client
+
+load_dotenv()
+
+LLM_PROVIDERS = ("matcha", "openai", "replay")
+DEFAULT_REPLAY_PATH = "feedback_data.jsonl"
+
+_QUESTION_MARKERS = ("# User Question\n\n", "USER QUESTION:\n")
+_FIX_MARKER = "needs to be corrected"
+_WORDS = re.compile(r"[a-z0-9_]+")
+
+
+# ========= RECORDED RESPONSES =========
+
+def split_tokens(text: str) -> List[str]:
+    """Word-ish chunks (whitespace kept) used to replay a response as a token stream."""
+    return re.findall(r"\S+\s*|\s+", text)
+
+
+class ReplayResponses:
+    """
+    Recorded question -> response pairs (feedback_data.jsonl format: user_question,
+    full_response, sql_query). A prompt is answered with the recording whose
+    question matches the prompt's "User Question" exactly, else the one with
+    the largest word overlap. Fix prompts get the recorded SQL only, the way
+    the fix prompt asks for it.
+    """
+
+    def __init__(self, records: List[dict]):
+        self.records = [r for r in records if r.get("full_response")]
+        if not self.records:
+            raise ValueError("No recorded responses to replay (need records with a full_response)")
+        self._by_question = {self._normalize(r.get("user_question", "")): r for r in self.records}
+        self._words = [set(_WORDS.findall(self._normalize(r.get("user_question", "")))) for r in self.records]
+
+    @classmethod
+    def from_jsonl(cls, path: str) -> "ReplayResponses":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()])
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def question_in_prompt(prompt: str) -> str:
+        for marker in _QUESTION_MARKERS:
+            pos = prompt.rfind(marker)
+            if pos != -1:
+                question = prompt[pos + len(marker):]
+                return question.split("\n\nReturn ONLY", 1)[0].strip()
+        return prompt.strip()
+
+    def match(self, prompt: str) -> dict:
+        question = self._normalize(self.question_in_prompt(prompt))
+        record = self._by_question.get(question)
+        if record is None:
+            words = set(_WORDS.findall(question))
+            overlaps = [len(words & w) / (len(words | w) or 1) for w in self._words]
+            record = self.records[max(range(len(overlaps)), key=overlaps.__getitem__)]
+        return record
+
+    def respond(self, prompt: str) -> str:
+        record = self.match(prompt)
+        if _FIX_MARKER in prompt and record.get("sql_query"):
+            return f"```sql\n{record['sql_query']}\n```"
+        return record["full_response"]
+
+
+# ========= PROVIDERS =========
+
+class LLMProvider:
+    """Base class: `complete(prompt)` returns the model's text answer."""
+
+    name = ""
+
+    @property
+    def label(self) -> str:
+        return self.name
+
+    def complete(self, prompt: str) -> str:
+        raise NotImplementedError
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Answer as text chunks; backends without streaming yield the whole answer once."""
+        yield self.complete(prompt)
+
+    def close(self) -> None:
+        pass
+
+
+class MatchaProvider(LLMProvider):
+    name = "matcha"
+
+    @property
+    def label(self) -> str:
+        return "Matcha API"
+
+    def complete(self, prompt: str) -> str:
+        return get_matcha_client().complete(prompt)
+
+
+class OpenAICompatibleClient(MatchaClient):
+    """MatchaClient transport (pooling, retries, in-flight cap) speaking /chat/completions."""
+
+    completion_path = "/chat/completions"
+
+    def __init__(self, base_url: str, api_key: Optional[str], model: str, temperature: float = 0.0, **kwargs):
+        super().__init__(base_url, api_key or "", mission_id=0, **kwargs)
+        self.model = model
+        self.temperature = temperature
+        self.headers.pop("MATCHA-API-KEY", None)
+        if api_key:
+            self.headers["Authorization"] = f"Bearer {api_key}"
+
+    @classmethod
+    def from_env(cls) -> "OpenAICompatibleClient":
+        base_url = os.getenv("LLM_BASE_URL")
+        model = os.getenv("LLM_MODEL")
+        missing_vars = [var for var, value in {"LLM_BASE_URL": base_url, "LLM_MODEL": model}.items() if not value]
+        if missing_vars:
+            raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
+        return cls(
+            base_url=base_url,
+            api_key=os.getenv("LLM_API_KEY"),
+            model=model,
+            temperature=float(os.getenv("LLM_TEMPERATURE", "0")),
+            read_timeout=float(os.getenv("LLM_READ_TIMEOUT", "200")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "8")),
+        )
+
+    def _payload(self, prompt: str) -> str:
+        return json.dumps(
+            {
+                "model": self.model,
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": self.temperature,
+            }
+        )
+
+    @staticmethod
+    def _parse_completion(data: dict) -> str:
+        if "error" in data:
+            raise MatchaError(f"LLM error: {data['error']}")
+        return data["choices"][0]["message"]["content"]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        """Server-sent events completion; closing the generator drops the connection."""
+        payload = json.loads(self._payload(prompt))
+        payload["stream"] = True
+        resp = self.request("POST", self.completion_path, data=json.dumps(payload), stream=True)
+        try:
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                event = json.loads(data)
+                if "error" in event:
+                    raise MatchaError(f"LLM error: {event['error']}")
+                delta = (event.get("choices") or [{}])[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+        finally:
+            resp.close()
+
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, client: Optional[OpenAICompatibleClient] = None):
+        self.client = client or OpenAICompatibleClient.from_env()
+
+    @property
+    def label(self) -> str:
+        return f"{self.client.model} at {self.client.base_url}"
+
+    def complete(self, prompt: str) -> str:
+        return self.client.complete(prompt)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        return self.client.stream(prompt)
+
+    def close(self) -> None:
+        self.client.close()
+
+
+class ReplayProvider(LLMProvider):
+    name = "replay"
+
+    def __init__(
+        self,
+        responses: Optional[ReplayResponses] = None,
+        latency_s: Optional[float] = None,
+        tokens_per_s: Optional[float] = None,
+    ):
+        self.responses = responses or ReplayResponses.from_jsonl(os.getenv("LLM_REPLAY_PATH") or DEFAULT_REPLAY_PATH)
+        if latency_s is None:
+            latency_s = float(os.getenv("LLM_REPLAY_LATENCY_MS", "0")) / 1000
+        if tokens_per_s is None:
+            tokens_per_s = float(os.getenv("LLM_REPLAY_TOKENS_PER_S", "0"))
+        self.latency_s = latency_s
+        self.tokens_per_s = tokens_per_s
+
+    @property
+    def label(self) -> str:
+        return f"replay ({len(self.responses.records)} recorded responses)"
+
+    def complete(self, prompt: str) -> str:
+        text = self.responses.respond(prompt)
+        delay = self.latency_s + (len(split_tokens(text)) / self.tokens_per_s if self.tokens_per_s else 0.0)
+        if delay:
+            time.sleep(delay)
+        return text
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        text = self.responses.respond(prompt)
+        if self.latency_s:
+            time.sleep(self.latency_s)  # time to first token
+        for token in split_tokens(text):
+            if self.tokens_per_s:
+                time.sleep(1.0 / self.tokens_per_s)
+            yield token
+
+
+# ========= SHARED INSTANCE =========
+
+_provider: Optional[LLMProvider] = None
+_provider_lock = threading.Lock()
+
+
+def create_llm_provider(name: Optional[str] = None) -> LLMProvider:
+    name = (name or os.getenv("LLM_PROVIDER") or "matcha").lower()
+    if name == "matcha":
+        return MatchaProvider()
+    if name == "openai":
+        return OpenAICompatibleProvider()
+    if name == "replay":
+        return ReplayProvider()
+    raise ValueError(f"Unknown LLM provider '{name}'. Use one of: {', '.join(LLM_PROVIDERS)}")
+
+
+def get_llm_provider() -> LLMProvider:
+    """The LLM_PROVIDER backend, created once per process."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_llm_provider()
+    return _provider
+
+
+def set_llm_provider(provider: Optional[LLMProvider]) -> None:
+    """Swap the shared provider (e.g. a ReplayProvider in a benchmark); None resets to LLM_PROVIDER."""
+    global _provider
+    with _provider_lock:
+        if _provider is not None and _provider is not provider:
+            _provider.close()
+        _provider = provider
+
+
+def _after_fork_in_child() -> None:
+    # pooled sockets must not be shared with the parent process
+    global _provider, _provider_lock
+    _provider = None
+    _provider_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
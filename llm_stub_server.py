@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Local LLM stub server for load tests and offline runs.
+
+Replays recorded responses (feedback_data.jsonl by default, see
+llm_providers.ReplayResponses) over HTTP and speaks both protocols the
+pipeline uses:
+- Matcha:  POST /completions        {"mission_id", "input"}
+- OpenAI:  POST /chat/completions   (also /v1/chat/completions), with
+           "stream": true answered as server-sent events
+
+Latency, generation speed (tokens per second) and failures are injected
+deterministically (seeded), so pipeline throughput, retries and
+concurrency limits can be measured without the live service:
+
+    python3 llm_stub_server.py --port 8765 --latency-ms 1500 --jitter-ms 300 --tokens-per-s 40 --error-rate 0.05
+    MATCHA_BASE_URL=http://127.0.0.1:8765 MATCHA_API_KEY=stub MATCHA_MISSION_ID=1 python3 batch_sql.py questions.jsonl
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from llm_providers import DEFAULT_REPLAY_PATH, ReplayResponses, split_tokens
+
+
+class StubConfig:
+    def __init__(
+        self,
+        responses: ReplayResponses,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        seed: int = 0,
+        tokens_per_s: float = 0.0,
+    ):
+        self.responses = responses
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.tokens_per_s = tokens_per_s
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "cancelled": 0}
+
+    def count_cancelled(self) -> None:
+        with self._lock:
+            self.stats["cancelled"] += 1
+
+    def draw(self) -> tuple[float, bool]:
+        """(delay in seconds, inject an error?) for the next request."""
+        with self._lock:
+            self.stats["requests"] += 1
+            delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.stats["errors"] += 1
+        return delay, fail
+
+
+def make_handler(config: StubConfig):
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real service
+
+        def log_message(self, *args):
+            pass
+
+        def _send_json(self, status: int, payload: dict, headers: Optional[dict] = None) -> None:
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, tokens: list) -> None:
+            # server-sent events, one token per event; the connection closes at the end
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+            self.close_connection = True
+            try:
+                for token in tokens:
+                    if config.tokens_per_s:
+                        time.sleep(1.0 / config.tokens_per_s)
+                    event = {"choices": [{"index": 0, "delta": {"content": token}}]}
+                    self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+                    self.wfile.flush()
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                config.count_cancelled()  # client stopped reading after the SQL
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            try:
+                request = json.loads(self.rfile.read(length) or b"{}")
+            except json.JSONDecodeError:
+                self._send_json(400, {"status": "error", "error": "invalid JSON"})
+                return
+
+            path = self.path.rstrip("/")
+            if path.endswith("/chat/completions"):
+                messages = request.get("messages") or [{}]
+                prompt = messages[-1].get("content") or ""
+            elif path.endswith("/completions"):
+                prompt = request.get("input") or ""
+            else:
+                self._send_json(404, {"status": "error", "error": f"unknown path {self.path}"})
+                return
+
+            delay, fail = config.draw()
+            time.sleep(delay)
+            if fail:
+                retry_after = {"Retry-After": "0"} if config.error_status == 429 else None
+                self._send_json(config.error_status, {"status": "error", "error": "injected failure"}, retry_after)
+                return
+
+            text = config.responses.respond(prompt)
+            tokens = split_tokens(text)
+            if path.endswith("/chat/completions") and request.get("stream"):
+                self._send_stream(tokens)
+                return
+            if config.tokens_per_s:
+                time.sleep(len(tokens) / config.tokens_per_s)  # generation time
+            if path.endswith("/chat/completions"):
+                self._send_json(
+                    200,
+                    {
+                        "object": "chat.completion",
+                        "model": request.get("model", "stub"),
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+                    },
+                )
+            else:
+                self._send_json(200, {"status": "success", "output": [{"content": [{"text": text}]}]})
+
+    return StubHandler
+
+
+def start_stub_server(config: StubConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve `config` from a daemon thread; port 0 picks a free port (see server.server_address)."""
+    server = ThreadingHTTPServer((host, port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--replay", default=DEFAULT_REPLAY_PATH, help="recorded responses (JSONL)")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="mean delay per request")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="uniform +/- jitter around the mean")
+    parser.add_argument("--tokens-per-s", type=float, default=0.0, help="generation speed (0 = instant)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        ReplayResponses.from_jsonl(args.replay),
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        seed=args.seed,
+        tokens_per_s=args.tokens_per_s,
+    )
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(config))
+    server.daemon_threads = True
+    print(f"🧪 LLM stub serving {len(config.responses.records)} recorded responses on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f"\n👋 Stopped after {config.stats['requests']} requests ({config.stats['errors']} injected errors)")
+
+
+if __name__ == "__main__":
+    main()
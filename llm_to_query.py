@@ -1,9 +1,22 @@
+import logging
 import os
-import requests
-import json
 import re
-import pandas as pd
-from preprocess import query_schema
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from enum import Enum
+from preprocess import query_schema, embed_texts, normalize_rows
+from answer_cache import get_answer_cache
+from schema_packer import default_token_budget
+from prompt_templates import render_fix_prompt, render_sql_prompt
+from llm_providers import get_llm_provider
+from sql_stream import StreamedCompletion
+from retrieval_context import get_retrieval_context
+from schema_catalog import tables_in_schema_text
+from sql_validation import SQLGLOT_AVAILABLE, format_issues_for_fix, validate_sql
+from sql_sandbox import apply_sandbox
+from cost_estimator import apply_cost_budget
+from tracing import configure_logging, metrics, propagate, span, start_metrics_server
 from dotenv import load_dotenv
 from datetime import datetime
 import uuid
@@ -11,54 +24,141 @@ import uuid
 # Load environment variables
 load_dotenv()
 
-# Configuration from environment variables
-BASE_URL = os.getenv("MATCHA_BASE_URL")
-API_KEY = os.getenv("MATCHA_API_KEY")
-MISSION_ID_STR = os.getenv("MATCHA_MISSION_ID")
+logger = logging.getLogger(__name__)
 
-# Validate required environment variables
-required_vars = {
-    "MATCHA_BASE_URL": BASE_URL,
-    "MATCHA_API_KEY": API_KEY,
-    "MATCHA_MISSION_ID": MISSION_ID_STR,
-}
 
-missing_vars = [var for var, value in required_vars.items() if not value]
-if missing_vars:
-    raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
+def chat_once(prompt: str) -> str:
+    """
+    Send a single-turn prompt to the configured LLM backend (LLM_PROVIDER,
+    Matcha by default, see llm_providers) and return its text answer.
+    """
+    provider = get_llm_provider()
+    logger.info(f"🤖 Sending request to {provider.label}... Please wait for response.")
+    with span("llm.complete", provider=provider.name, prompt_chars=len(prompt)) as s:
+        response = provider.complete(prompt)
+        s.set(response_chars=len(response))
+    metrics.inc("llm_sql_llm_prompt_chars_total", len(prompt), provider=provider.name)
+    metrics.inc("llm_sql_llm_response_chars_total", len(response), provider=provider.name)
+    return response
 
-MISSION_ID = int(MISSION_ID_STR)
 
-headers = {
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-    "MATCHA-API-KEY": API_KEY,
-}
+def stream_once(prompt: str, cancel_after_sql: bool = False) -> StreamedCompletion:
+    """
+    Like chat_once, but streamed: the returned StreamedCompletion exposes the
+    ```sql block as soon as it is closed (wait_sql) while the rest of the
+    answer keeps arriving in the background, or is dropped with cancel_after_sql.
+    """
+    provider = get_llm_provider()
+    logger.info(f"🤖 Streaming request to {provider.label}...")
+    metrics.inc("llm_sql_llm_prompt_chars_total", len(prompt), provider=provider.name)
+    return StreamedCompletion(provider.stream(prompt), cancel_after_sql=cancel_after_sql)
 
-def chat_once(prompt: str) -> str:
-    url = f"{BASE_URL}/completions"
 
-    payload = {
-        "mission_id": MISSION_ID,
-        "input": prompt,   # simple, single-turn
-    }
+# FROM/JOIN targets, including [bracketed] and db.schema.table names
+TABLE_REF_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+((?:\[[^\]]+\]|\w+)(?:\s*\.\s*(?:\[[^\]]+\]|\w+)){0,2})',
+    re.IGNORECASE,
+)
+CTE_NAME_PATTERN = re.compile(r'(?:\bWITH|,)\s*(\w+)\s*(?:\([^)]*\))?\s+AS\s*\(', re.IGNORECASE)
+
+
+def get_schema_catalog_or_none():
+    """The compiled schema catalog, or None when the schema export is not available."""
+    try:
+        return get_retrieval_context().schema_catalog
+    except (FileNotFoundError, OSError) as e:
+        logger.warning(f"Warning: schema catalog unavailable ({e}). Falling back to prompt-text validation.")
+        return None
+
+
+def _basic_syntax_errors(sql_query: str) -> list[str]:
+    errors = []
+    if 'SELECT' not in sql_query.upper():
+        errors.append("Query does not appear to be a valid SELECT statement")
+    # Check for common T-SQL syntax
+    if sql_query.count('(') != sql_query.count(')'):
+        errors.append("Unmatched parentheses in query")
+    return errors
 
-    resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=200)
-    resp.raise_for_status()
-    data = resp.json()
 
-    if data.get("status") != "success":
-        raise RuntimeError(f"Matcha error: {data.get('error')}")
+def validate_sql_against_catalog(sql_query: str, catalog, allowed_tables=None) -> dict:
+    """
+    Validate table references with O(1) catalog lookups.
 
-    # first text block
-    return data["output"][0]["content"][0]["text"]
+    Args:
+        sql_query: Query to check
+        catalog: Compiled SchemaCatalog
+        allowed_tables: Table ids the LLM was shown; referencing a catalog table
+            outside this set is an error. None/empty skips that check.
+    """
+    validation_results = {
+        "is_valid": True,
+        "errors": [],
+        "warnings": []
+    }
+
+    allowed = set()
+    for tid in allowed_tables or ():
+        info = catalog.resolve_table(tid)
+        if info is not None:
+            allowed.add(info.id.lower())
+
+    cte_names = {name.lower() for name in CTE_NAME_PATTERN.findall(sql_query)}
+
+    for match in TABLE_REF_PATTERN.finditer(sql_query):
+        table = re.sub(r'\s+', '', match.group(1))
+        if table.lower() in cte_names:
+            continue
+        info = catalog.resolve_table(table)
+        if info is None:
+            validation_results["errors"].append(f"Table '{table}' not found in schema catalog")
+        elif allowed and info.id.lower() not in allowed:
+            validation_results["errors"].append(f"Table '{table}' not found in provided schema")
+
+    validation_results["errors"].extend(_basic_syntax_errors(sql_query))
+    validation_results["is_valid"] = not validation_results["errors"]
+    return validation_results
 
 
-def validate_sql_against_schema(sql_query: str, schema_text: str) -> dict:
+def validate_sql_against_schema(sql_query: str, schema_text: str, catalog=None, allowed_tables=None) -> dict:
     """
     Validate a SQL query against the provided schema.
     Returns a dictionary with validation results.
+
+    With a compiled `catalog`, the query is parsed (sqlglot, tsql dialect) and
+    every table and column reference is checked by hashed lookup instead of
+    re-parsing `schema_text`; only the "Table ..." headers of `schema_text`
+    are read, to know which tables were in the prompt (unless `allowed_tables`
+    is given). Results then also carry structured "issues". Queries that
+    pass are compiled in the SQL sandbox (see sql_sandbox, SQL_SANDBOX), which
+    rejects cartesian joins and anything SQLite cannot compile, and then
+    costed against the table statistics (see cost_estimator, COST_BUDGET_ROWS).
     """
+    with span("sql.validate", sql_chars=len(sql_query), catalog=catalog is not None) as s:
+        validation_results = _validate_sql_against_schema(sql_query, schema_text, catalog, allowed_tables)
+        s.set(
+            is_valid=validation_results["is_valid"],
+            errors=len(validation_results["errors"]),
+            warnings=len(validation_results["warnings"]),
+            estimated_cost=validation_results.get("estimated_cost"),
+        )
+    metrics.inc("llm_sql_validations_total", result="valid" if validation_results["is_valid"] else "invalid")
+    return validation_results
+
+
+def _validate_sql_against_schema(sql_query: str, schema_text: str, catalog, allowed_tables) -> dict:
+    """validate_sql_against_schema inside its "sql.validate" span."""
+    if catalog is not None:
+        if allowed_tables is None:
+            allowed_tables = tables_in_schema_text(schema_text)
+        if SQLGLOT_AVAILABLE:
+            # full parse: aliases, CTEs, subqueries and every column reference,
+            # then compile + EXPLAIN against the empty schema in SQLite
+            validation_results = apply_sandbox(validate_sql(sql_query, catalog, allowed_tables), sql_query, catalog)
+            # estimated rows read / joined against TABLE_STATS_PATH, when that file exists
+            return apply_cost_budget(validation_results, sql_query, catalog)
+        return validate_sql_against_catalog(sql_query, catalog, allowed_tables)
+
     validation_results = {
         "is_valid": True,
         "errors": [],
@@ -110,13 +210,9 @@ def validate_sql_against_schema(sql_query: str, schema_text: str) -> dict:
                 validation_results["is_valid"] = False
         
         # Basic SQL syntax checks
-        if 'SELECT' not in sql_upper:
-            validation_results["errors"].append("Query does not appear to be a valid SELECT statement")
-            validation_results["is_valid"] = False
-            
-        # Check for common T-SQL syntax
-        if sql_query.count('(') != sql_query.count(')'):
-            validation_results["errors"].append("Unmatched parentheses in query")
+        syntax_errors = _basic_syntax_errors(sql_query)
+        if syntax_errors:
+            validation_results["errors"].extend(syntax_errors)
             validation_results["is_valid"] = False
             
     except Exception as e:
@@ -126,10 +222,20 @@ def validate_sql_against_schema(sql_query: str, schema_text: str) -> dict:
     return validation_results
 
 
-def fix_sql_with_feedback(original_query: str, validation_errors: list, schema_text: str, user_question: str) -> str:
+def fix_sql_with_feedback(original_query: str, validation_errors: list, schema_text: str, user_question: str, issues: list | None = None, catalog=None) -> str:
     """
     Attempt to fix SQL query based on validation errors.
+    Returns the raw LLM response; pass it through extract_sql_from_response.
+    """
+    return chat_once(build_fix_prompt(original_query, validation_errors, schema_text, user_question, issues, catalog))
+
+
+def build_fix_prompt(original_query: str, validation_errors: list, schema_text: str, user_question: str, issues: list | None = None, catalog=None) -> str:
+    """
+    Build the prompt that asks the LLM to fix a query that failed validation.
     Intelligently includes hierarchy context only when ID-related errors are detected.
+    Structured `issues` (from the parser-based validator) are rendered as targeted
+    fixes, including the real column list of tables with unknown columns.
     """
     # Check if errors are related to ID confusion or hierarchy issues
     id_related_keywords = ['id', 'account', 'organization', 'client', 'user', 'sub_account', 'statement', 'hierarchy']
@@ -140,358 +246,488 @@ def fix_sql_with_feedback(original_query: str, validation_errors: list, schema_t
     
     # Also check if the user question mentions IDs or relationships
     question_needs_context = any(keyword in user_question.lower() for keyword in id_related_keywords)
-    
-    feedback_prompt = f"""
-The following SQL query has validation errors and needs to be corrected:
-
-ORIGINAL QUERY:
-```sql
-{original_query}
-```
-
-VALIDATION ERRORS:
-{chr(10).join(validation_errors)}
-
-AVAILABLE SCHEMA:
-{schema_text}
-
-USER QUESTION:
-{user_question}
-"""
-    
-    # Add hierarchy context only when ID-related errors are detected
-    if needs_hierarchy_context or question_needs_context:
-        try:
-            with open("DATA_HIERARCHY_CONTEXT.md", "r", encoding="utf-8") as f:
-                hierarchy_context = f.read()
-            feedback_prompt += f"""
-
-{hierarchy_context}
-
-IMPORTANT: The validation errors suggest confusion about ID relationships. Use the hierarchy context above to understand the correct relationships between different ID types.
-"""
-        except FileNotFoundError:
-            print("Warning: DATA_HIERARCHY_CONTEXT.md not found. Proceeding without hierarchy context.")
-    
-    feedback_prompt += """
-Please provide a corrected T-SQL query that:
-1. Fixes all the validation errors listed above
-2. Uses only tables and columns that exist in the provided schema
-3. Still answers the original user question accurately
-
-Return ONLY the corrected SQL query without any explanation:
-"""
-    
-    return chat_once(feedback_prompt)
-    
 
+    errors_text = format_issues_for_fix(issues, catalog) if issues else "\n".join(validation_errors)
+    return render_fix_prompt(
+        original_query,
+        errors_text,
+        schema_text,
+        user_question,
+        include_hierarchy_context=needs_hierarchy_context or question_needs_context,
+    )
 
 
 def build_sql_prompt(user_question: str, relevant_schema: str, include_hierarchy_context: bool = False) -> str:
     """
     Build the user-facing prompt that will be sent to the chat model.
+    The static instructions come first (built once, see prompt_templates),
+    followed by the schema and the question.
     
     Args:
         user_question: The user's natural language question
         relevant_schema: The database schema context
         include_hierarchy_context: Whether to include the full hierarchy context (used for error correction)
     """
-    # Base prompt without hierarchy context (for initial attempts)
-    prompt = f"""
-You are an expert T-SQL assistant. You write correct and efficient queries for Microsoft SQL Server.
-
-User question:
-{user_question}
-
-# Role Definition
-
-You are an expert T-SQL database developer with deep expertise in query optimization, schema analysis, and translating natural language questions into precise, efficient SQL queries. Your queries will be automatically validated against the provided schema, so accuracy is critical.
-
-# Data Structure Awareness
-
-This system follows a strict hierarchical data structure with specific ID relationships:
-- **Client ID** → **Product/Bundle ID** → **Organization ID** → **Account ID** → **User ID / Sub_Account ID**
-- Be especially careful when distinguishing between **Account ID** (customer entity) and **Sub_Account ID** (specific services/usage data)
-- When queries involve multiple ID types, consider their hierarchical relationships
-- If your initial query fails validation due to ID relationship issues, additional hierarchy context will be provided
-
-# Important ID Guidelines
-
-- For usage/data queries: Focus on **Sub_Account ID** level
-- For customer/billing queries: Focus on **Account ID** level  
-- For organizational structure: Focus on **Organization ID** level
-- Always verify ID relationships match the hierarchical structure"""
-    
-    # Only add hierarchy context when needed (error correction attempts)
-    if include_hierarchy_context:
-        try:
-            with open("DATA_HIERARCHY_CONTEXT.md", "r", encoding="utf-8") as f:
-                hierarchy_context = f.read()
-            prompt = f"""
-You are an expert T-SQL assistant. You write correct and efficient queries for Microsoft SQL Server.
-
-User question:
-{user_question}
-
-{hierarchy_context}
-
-# Role Definition
-
-You are an expert T-SQL database developer with deep expertise in query optimization, schema analysis, and translating natural language questions into precise, efficient SQL queries. Your queries will be automatically validated against the provided schema, so accuracy is critical."""
-        except FileNotFoundError:
-            print("Warning: DATA_HIERARCHY_CONTEXT.md not found. Proceeding without hierarchy context.")
-    
-    prompt += f"""
+    return render_sql_prompt(user_question, relevant_schema, include_hierarchy_context)
 
-# CRITICAL: Schema Validation Process
 
- **IMPORTANT**: Your generated SQL will be automatically validated against the provided schema. Queries that reference non-existent tables or columns will be rejected and you'll be asked to fix them. To avoid validation errors:
-
-1. **Use ONLY the tables explicitly listed in the schema below**
-2. **Use ONLY the columns that exist in those tables**
-3. **Match table names exactly as they appear in the schema**
-4. **Pay attention to schema prefixes (e.g., dbo.table_name)**
-
-# Contextual Information
-
-You will be provided with:
-- A curated list of the most relevant database tables with their complete schemas
-- Table names, column names, data types, constraints, and relationships
-- A natural language question that requires a SQL query to answer
-
-The tables provided have been pre-selected as the most relevant to the user's question through semantic search. You are working within a T-SQL environment (SQL Server/Azure SQL Database).
-
-# Available Schema
-
-{relevant_schema}
-
-# Task Description and Goals
-
-Your primary goal is to generate a precise, executable T-SQL query that accurately answers the user's question using the provided table schemas. The query should be:
-
-1. **Schema-Compliant**: Uses only tables and columns that exist in the provided schema
-2. **Accurate**: Directly answers the specific question asked
-3. **Efficient**: Uses appropriate joins, filters, and indexing strategies
-4. **Executable**: Valid T-SQL syntax that will run without errors
-5. **Readable**: Well-formatted with clear aliasing and logical structure
-
-# Instructional Guidance and Constraints
-
-Follow this systematic approach:
-
-1. **Schema Analysis First**: Before writing any SQL, carefully review the provided schema to identify:
-   - Exact table names and how they're referenced (with/without schema prefix)
-   - Available columns in each table and their data types
-   - Primary keys ([PK]) and foreign keys ([FK]) for joins
-   - Relationships between tables based on foreign key references
-
-2. **Question Analysis**: Break down what the user is asking for:
-   - Required columns for the output
-   - Filtering conditions needed
-   - Aggregations or calculations required
-   - Relationships between tables needed
-
-3. **Query Construction**:
-   - Start with the main table that contains the core data
-   - Add JOINs only for tables that are necessary and exist in the schema
-   - Use explicit JOIN syntax (INNER JOIN, LEFT JOIN, etc.)
-   - Reference columns exactly as they appear in the schema
-   - Add WHERE clauses for filtering
-   - Include appropriate ORDER BY, GROUP BY, or HAVING clauses
-
-4. **Pre-Validation Checklist** (CRITICAL - Follow Before Writing SQL):
-   ✅ Verify ALL table names exist exactly as shown in the schema above
-   ✅ Verify ALL column names exist in their respective tables 
-   ✅ Ensure JOIN conditions use valid foreign key relationships from the schema
-   ✅ Check that data types are compatible for comparisons and operations
-   ✅ Confirm SQL syntax follows valid T-SQL standards
-   ✅ Double-check that no assumptions are made about tables/columns not in the schema
-
-5. **Schema Validation Requirements**:
-   - **MANDATORY**: Every table name in your query MUST appear in the schema above
-   - **MANDATORY**: Every column name in your query MUST exist in the specified table
-   - **MANDATORY**: Use exact naming conventions including schema prefixes (e.g., dbo.table_name)
-   - If you're unsure about a table or column, do NOT include it - only use what's explicitly provided
-
-6. **Query Requirements**:
-   - Use explicit JOIN syntax rather than implicit joins
-   - Include appropriate WHERE clauses for filtering
-   - Use proper aggregation functions when needed
-   - Add ORDER BY when the question implies specific ordering
-   - Use table aliases for readability
-   - Handle potential NULL values appropriately
-
-# Expected Output Format
-
-Your response should follow this structure:
-
-```
-## Query Analysis
-[Brief explanation of what you're trying to achieve and which tables/columns you'll use]
-
-## Schema Validation Check
-[Confirm that all tables and columns in your query exist in the provided schema - list the specific tables and key columns you're using]
-
-## T-SQL Query
-```sql
-[Your complete, executable T-SQL query using only schema-provided tables/columns]
-```
-
-## Business Logic Explanation
-[Explain in plain English what this query is doing, how the data flows through the system, and why these specific tables are connected. Help someone unfamiliar with the database understand the business relationships and data structure.]
-
-## Assumptions
-[List any assumptions made about the data or relationships]
-```
-
-## Few-Shot Examples
-**Example:**
-```
-User Question: "Get a list of org id, account id with their billed amount for which they have autopay enabled."
-Tables Provided:
-- t_acct_payment_info
-- t_billed
-
-Query Analysis:
-Need to find billing records for accounts that have autopay enabled by connecting payment information to billing data.
-
-Schema Validation Check:
-- t_acct_payment_info: Contains autopay_enabled column and acct_id for joining
-- t_billed: Contains billing amounts and acct_id for joining
-
-T-SQL Query:
-```sql
-WITH autopay_on AS (
-    SELECT DISTINCT acct_id
-    FROM dbo.t_acct_payment_info
-    WHERE autopay_enabled IS NOT NULL
-)
-SELECT b.org_id, b.acct_id, b.billed_amount
-FROM dbo.t_billed AS b
-JOIN autopay_on AS ap
-    ON b.acct_id = ap.acct_id;
-```
-
-Business Logic Explanation:
-This query is looking for customers who have automatic payment set up and retrieving their billing information. In our system, customer payment preferences (like autopay) are stored separately from billing records. We first identify all accounts that have autopay enabled, then connect that information to the billing table to get the actual billing amounts. This gives us a list of customers who pay automatically along with how much they're being billed.
-
-
-Assumptions:
-- autopay_enabled IS NOT NULL indicates autopay is active
-- acct_id is the common key between payment info and billing tables
-```
-
-# Any Additional Notes on Scope or Limitations
-
-- You should only generate queries using the tables explicitly provided to you
-- If the provided tables are clearly insufficient to answer the question, state this explicitly and explain what additional tables or information would be needed
-- Do not fabricate table names, column names, or relationships not present in the provided schema
-- If the question is ambiguous, state your interpretation and proceed with the most logical query
-- Focus on standard T-SQL syntax compatible with SQL Server 2016 and later versions
-- Prioritize correctness over performance, but note any obvious optimization opportunities"""
-    return prompt.strip()
+# Retrieval settings shared by single-question and batch generation
+SCHEMA_RETRIEVAL_PARAMS = {
+    "method": "chess",
+    "k_cols": 40,               # Column hits from the column-level index
+    "max_tables": 5,            # Fewer tables for clearer schema
+    "max_cols_per_table": 10,   # Focus on most relevant columns
+    "max_char_per_table": 1000, # Per-table cap when no token budget is set
+    "token_budget": default_token_budget(),  # SCHEMA_TOKEN_BUDGET / LLM_CHARACTER_LIMIT
+}
 
 
+class PipelineState(Enum):
+    GENERATE = "generate"   # full prompt -> new candidate
+    FIX = "fix"             # targeted fix of the last invalid candidate
+    DONE = "done"
+
+
+@dataclass
+class LLMCallRecord:
+    attempt: int
+    stage: str
+    latency_s: float
+    prompt_chars: int
+    response_chars: int
+    is_valid: bool
+    errors: list[str] = field(default_factory=list)
+    time_to_sql_s: float | None = None  # streamed calls: when the ```sql block closed
+
+
+@dataclass
+class SQLGenerationResult:
+    question: str
+    full_response: str  # streamed: text up to the SQL block; call wait_full_response() for the rest
+    sql_query: str
+    is_valid: bool
+    validation: dict
+    pruned_schema: str
+    calls: list[LLMCallRecord] = field(default_factory=list)
+    cache_hit: bool = False
+    cache_similarity: float | None = None
+    pending_response: StreamedCompletion | None = field(default=None, repr=False)
+    cancelled_calls: int = 0  # speculative candidates discarded once a winner was found
+
+    def wait_full_response(self, timeout: float | None = None) -> str:
+        """With streaming, the explanation may still be arriving; wait for it and return the full response."""
+        if self.pending_response is not None:
+            try:
+                self.full_response = self.pending_response.wait_text(timeout)
+            except Exception as e:  # the SQL is already validated; keep what arrived
+                logger.warning(f"⚠️  Explanation stream failed: {e}")
+                self.full_response = self.pending_response.text
+            self.pending_response = None
+        return self.full_response
+
+    @property
+    def llm_calls(self) -> int:
+        return len(self.calls)
+
+    @property
+    def llm_latency_s(self) -> float:
+        return sum(c.latency_s for c in self.calls)
+
+
+def complete_and_extract(prompt: str, stream: bool = False, cancel_explanation: bool = False):
+    """
+    One LLM call. Returns (response, sql_query, completion, time_to_sql_s);
+    when streamed, `response` is the text up to the SQL block and `completion`
+    is still receiving the rest.
+    """
+    if not stream:
+        response = chat_once(prompt)
+        # Extract just the SQL query from the response (remove markdown formatting)
+        with span("sql.extract", response_chars=len(response)):
+            return response, extract_sql_from_response(response), None, None
+    with span("llm.stream", provider=get_llm_provider().name, prompt_chars=len(prompt)) as s:
+        completion = stream_once(prompt, cancel_after_sql=cancel_explanation)
+        streamed_sql = completion.wait_sql()
+        s.set(time_to_sql_s=completion.time_to_sql_s, sql_in_stream=streamed_sql is not None)
+    if streamed_sql is None:  # no ```sql block: fall back to the full answer
+        response = completion.wait_text()
+        with span("sql.extract", response_chars=len(response)):
+            return response, extract_sql_from_response(response), completion, completion.time_to_sql_s
+    return completion.text, streamed_sql, completion, completion.time_to_sql_s
+
+
+@dataclass
+class SQLCandidate:
+    index: int
+    prompt: str
+    response: str
+    sql_query: str
+    validation: dict
+    latency_s: float
+    time_to_sql_s: float | None = None
+    completion: StreamedCompletion | None = field(default=None, repr=False)
+
+    @property
+    def score(self) -> tuple:
+        # valid first, then fewest errors, then fewest warnings
+        return (self.validation["is_valid"], -len(self.validation["errors"]), -len(self.validation["warnings"]))
+
+
+def candidate_prompts(question: str, pruned_schema: str, n: int, prefer_hierarchy_context: bool = False) -> list[str]:
+    """N generation prompts alternating with and without the hierarchy context (preferred variant first)."""
+    variants = [prefer_hierarchy_context, not prefer_hierarchy_context]
+    return [build_sql_prompt(question, pruned_schema, include_hierarchy_context=variants[i % 2]) for i in range(n)]
+
+
+def generate_candidates(
+    prompts: list[str],
+    pruned_schema: str,
+    catalog=None,
+    stream: bool = False,
+    cancel_explanation: bool = False,
+) -> tuple[SQLCandidate, list[SQLCandidate], int]:
+    """
+    Send all `prompts` concurrently and validate each answer as it arrives.
+    Stops at the first valid candidate: queued calls are dropped and streamed
+    ones cancelled; calls already in flight without streaming run to
+    completion in the background and are ignored.
 
+    Returns:
+        (selected candidate, every validated candidate, number of calls whose
+        answers were discarded or cut short)
+    """
 
+    def run(index: int, prompt: str) -> SQLCandidate:
+        with span("pipeline.candidate", index=index) as s:
+            start = time.perf_counter()
+            response, sql_query, completion, time_to_sql = complete_and_extract(prompt, stream, cancel_explanation)
+            latency = time.perf_counter() - start
+            validation = validate_sql_against_schema(sql_query, pruned_schema, catalog=catalog)
+            s.set(is_valid=validation["is_valid"])
+            return SQLCandidate(index, prompt, response, sql_query, validation, latency, time_to_sql, completion)
+
+    def cancel_stream(future) -> None:
+        if not future.cancelled() and future.exception() is None and future.result().completion is not None:
+            future.result().completion.cancel()
+
+    finished: list[SQLCandidate] = []
+    consumed = set()
+    first_error: Exception | None = None
+    winner = None
+    pool = ThreadPoolExecutor(max_workers=len(prompts), thread_name_prefix="candidate")
+    # each worker joins the caller's trace
+    futures = [pool.submit(propagate(run), i, prompt) for i, prompt in enumerate(prompts)]
+    try:
+        for future in as_completed(futures):
+            consumed.add(future)
+            try:
+                candidate = future.result()
+            except Exception as e:
+                logger.warning(f"⚠️  Candidate failed: {e}")
+                first_error = first_error or e
+                continue
+            finished.append(candidate)
+            status = "valid" if candidate.validation["is_valid"] else f"{len(candidate.validation['errors'])} errors"
+            logger.info(f"🧪 Candidate {candidate.index + 1}/{len(prompts)} arrived after {candidate.latency_s:.1f}s ({status})")
+            if candidate.validation["is_valid"]:
+                winner = candidate
+                break
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    unused = [f for f in futures if f not in consumed]
+    for future in unused:
+        future.add_done_callback(cancel_stream)
+    if not finished:
+        raise first_error or RuntimeError("No candidate finished")
+
+    best = winner or max(finished, key=lambda c: c.score)
+    for candidate in finished:
+        if candidate is not best and candidate.completion is not None:
+            candidate.completion.cancel()
+    if not best.validation["is_valid"] and best.completion is not None:
+        best.completion.cancel()
+    return best, finished, len(unused)
+
+
+def run_sql_pipeline(
+    question: str,
+    max_attempts: int = 3,
+    pruned_schema: str | None = None,
+    use_cache: bool = True,
+    stream: bool | None = None,
+    candidates: int | None = None,
+    max_calls: int | None = None,
+) -> SQLGenerationResult:
+    """
+    Generate SQL with a validate -> fix -> regenerate state machine.
 
-def chat_once(prompt: str) -> str:
-    url = f"{BASE_URL}/completions"
-    payload = {
-        "mission_id": MISSION_ID,
-        "input": prompt,   # or use "messages" if you want full chat structure
-    }
+    Each generation attempt is validated; an invalid candidate gets one
+    targeted fix call whose SQL is extracted and validated too, and a full
+    regeneration (with hierarchy context) only happens if the fix also fails.
+    Every LLM call is recorded with its stage, latency and validation outcome.
 
-    print("🤖 Sending request to Matcha API... Please wait for response.")
-    resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=500)
-    resp.raise_for_status()
-    data = resp.json()
+    Args:
+        question: Natural language question
+        max_attempts: Maximum number of full generations (each may be followed by one fix)
+        pruned_schema: Schema block already retrieved for this question; retrieved here when omitted
+        use_cache: Answer from / store into the semantic answer cache
+        stream: Stream completions and validate each query as soon as its
+            ```sql block closes (default LLM_STREAMING=1). The explanation
+            keeps streaming into `pending_response` (see wait_full_response),
+            or is cancelled with LLM_STREAM_EXPLANATION=cancel.
+        candidates: Speculative mode when > 1 (default LLM_CANDIDATES=1): send
+            this many generations at once, with and without hierarchy context,
+            validate each as it arrives and keep the first valid one (or the
+            one with the fewest errors, which then gets one fix call)
+        max_calls: Cost cap on LLM calls for this question, cancelled
+            in-flight candidates included (default LLM_MAX_CALLS, unlimited)
+    """
+    with span("pipeline", question_chars=len(question)) as s:
+        result = _run_sql_pipeline(question, max_attempts, pruned_schema, use_cache, stream, candidates, max_calls)
+        s.set(
+            cache_hit=result.cache_hit,
+            is_valid=result.is_valid,
+            llm_calls=result.llm_calls,
+            cancelled_calls=result.cancelled_calls,
+            fix_calls=sum(c.stage == PipelineState.FIX.value for c in result.calls),
+        )
+    return result
+
+
+def _run_sql_pipeline(
+    question: str,
+    max_attempts: int,
+    pruned_schema: str | None,
+    use_cache: bool,
+    stream: bool | None,
+    candidates: int | None,
+    max_calls: int | None,
+) -> SQLGenerationResult:
+    """run_sql_pipeline inside its "pipeline" span."""
+    if stream is None:
+        stream = os.getenv("LLM_STREAMING", "0") == "1"
+    if candidates is None:
+        candidates = int(os.getenv("LLM_CANDIDATES", "1"))
+    if max_calls is None and os.getenv("LLM_MAX_CALLS"):
+        max_calls = int(os.getenv("LLM_MAX_CALLS"))
+    cancel_explanation = os.getenv("LLM_STREAM_EXPLANATION", "background") == "cancel"
+
+    # 0) Semantic answer cache: a near-identical question with the same literals,
+    # answered against the same schema index, returns immediately with no
+    # retrieval or LLM call once its SQL re-validates against the catalog.
+    answer_cache = get_answer_cache() if use_cache else None
+    if answer_cache is not None:
+        with span("answer_cache.lookup") as s:
+            schema_fingerprint = get_retrieval_context().index_fingerprint
+            # the embedding cache makes the retrieval step below reuse this vector
+            question_vec = normalize_rows(embed_texts([question]))[0]
+            cached = answer_cache.lookup(question, question_vec, schema_fingerprint)
+            s.set(cache_hit=cached is not None)
+        if cached is not None:
+            catalog = get_schema_catalog_or_none()
+            if catalog is None:
+                cached_validation = {"is_valid": True, "errors": [], "warnings": []}
+            else:
+                # the catalog may have changed since the answer was cached; any catalog table is allowed
+                cached_validation = validate_sql_against_schema(cached.sql_query, "", catalog, allowed_tables=set())
+            if not cached_validation["is_valid"]:
+                logger.warning(
+                    f"⚠️  Cached answer for \"{cached.question}\" no longer validates "
+                    f"({'; '.join(cached_validation['errors'])}); generating a new one"
+                )
+                answer_cache.discard(cached)
+                cached = None
+        if cached is not None:
+            logger.info(f"⚡ Answer cache hit (similarity {cached.similarity:.3f}): \"{cached.question}\"")
+            return SQLGenerationResult(
+                question=question,
+                full_response=cached.full_response,
+                sql_query=cached.sql_query,
+                is_valid=True,
+                validation=cached_validation,
+                pruned_schema=pruned_schema or "",
+                cache_hit=True,
+                cache_similarity=cached.similarity,
+            )
 
-    if data.get("status") != "success":
-        raise RuntimeError(f"Matcha error: {data.get('error')}")
+    # 1) Retrieve small schema slice with better parameters
+    if pruned_schema is None:
+        pruned_schema = query_schema(question, **SCHEMA_RETRIEVAL_PARAMS)
+    logger.debug(f"=== Schema Retrieved ===\n{pruned_schema}\n========================")
+    catalog = get_schema_catalog_or_none()
+
+    id_keywords = ['id', 'account', 'organization', 'client', 'user', 'sub_account', 'statement', 'hierarchy']
+    question_mentions_ids = any(keyword in question.lower() for keyword in id_keywords)
+
+    calls: list[LLMCallRecord] = []
+    attempt = 0
+    state = PipelineState.GENERATE
+    response = sql_query = ""
+    validation: dict = {"is_valid": False, "errors": [], "warnings": []}
+    completion: StreamedCompletion | None = None
+
+    def call_llm(stage: PipelineState, prompt: str) -> str:
+        nonlocal response, sql_query, validation, completion
+        start = time.perf_counter()
+        response, sql_query, completion, time_to_sql = complete_and_extract(prompt, stream, cancel_explanation)
+        latency = time.perf_counter() - start
+
+        logger.info(f"📝 {'Generated' if stage is PipelineState.GENERATE else 'Fixed'} SQL:\n{sql_query}")
+
+        logger.info("🔍 Validating SQL against schema...")
+        validation = validate_sql_against_schema(sql_query, pruned_schema, catalog=catalog)
+        calls.append(
+            LLMCallRecord(
+                attempt=attempt,
+                stage=stage.value,
+                latency_s=round(latency, 3),
+                prompt_chars=len(prompt),
+                response_chars=len(response),
+                is_valid=validation["is_valid"],
+                errors=list(validation["errors"]),
+                time_to_sql_s=round(time_to_sql, 3) if time_to_sql is not None else None,
+            )
+        )
+        if completion is not None and not validation["is_valid"]:
+            # the explanation of a rejected query is not needed; stop generating it
+            completion.cancel()
+            response = completion.wait_text()
+            completion = None
+        if validation["is_valid"]:
+            logger.info("✅ SQL validation passed!")
+            if validation["warnings"]:
+                logger.warning(f"⚠️  Warnings: {'; '.join(validation['warnings'])}")
+        else:
+            logger.info(f"❌ SQL validation failed: {'; '.join(validation['errors'])}")
+        return response
+
+    cancelled_calls = 0
+    if candidates > 1:
+        # 2a) Speculative round: N candidates at once, first valid one wins
+        n = min(candidates, max_calls) if max_calls else candidates
+        logger.info(f"\n🔀 Generating {n} candidates concurrently...")
+        prompts = candidate_prompts(question, pruned_schema, n, prefer_hierarchy_context=question_mentions_ids)
+        best, finished, cancelled_calls = generate_candidates(prompts, pruned_schema, catalog, stream, cancel_explanation)
+        for c in finished:
+            calls.append(
+                LLMCallRecord(
+                    attempt=c.index + 1,
+                    stage=PipelineState.GENERATE.value,
+                    latency_s=round(c.latency_s, 3),
+                    prompt_chars=len(c.prompt),
+                    response_chars=len(c.response),
+                    is_valid=c.validation["is_valid"],
+                    errors=list(c.validation["errors"]),
+                    time_to_sql_s=round(c.time_to_sql_s, 3) if c.time_to_sql_s is not None else None,
+                )
+            )
+        response, sql_query, validation, completion = best.response, best.sql_query, best.validation, best.completion
+        if completion is not None and not validation["is_valid"]:
+            response, completion = completion.wait_text(), None  # cancelled by generate_candidates
+        attempt = max_attempts  # at most the one fix below
+        logger.info(f"{'✅' if validation['is_valid'] else '❌'} Candidate {best.index + 1} selected:\n{sql_query}")
+        state = PipelineState.DONE if validation["is_valid"] else PipelineState.FIX
 
-    # grab first text block
-    first_output = data["output"][0]["content"][0]["text"]
-    return first_output
+    # 2) Generate and validate SQL with feedback loop
+    while state is not PipelineState.DONE:
+        if max_calls and len(calls) + cancelled_calls >= max_calls:
+            logger.warning(f"💰 Call budget of {max_calls} reached.")
+            break
+        if state is PipelineState.GENERATE:
+            attempt += 1
+            logger.info(f"\n🔄 Attempt {attempt}/{max_attempts}")
+            # include hierarchy context only for regenerations or ID-related questions
+            needs_context = attempt > 1 or question_mentions_ids
+            prompt = build_sql_prompt(question, pruned_schema, include_hierarchy_context=needs_context)
+            logger.info("🤖 Generating SQL query...")
+            call_llm(PipelineState.GENERATE, prompt)
+            state = PipelineState.DONE if validation["is_valid"] or attempt >= max_attempts else PipelineState.FIX
+
+        elif state is PipelineState.FIX:
+            logger.info(f"🔧 Attempting to fix SQL (attempt {attempt}/{max_attempts})...")
+            prompt = build_fix_prompt(
+                sql_query, validation["errors"], pruned_schema, question,
+                issues=validation.get("issues"), catalog=catalog,
+            )
+            call_llm(PipelineState.FIX, prompt)
+            if validation["is_valid"] or attempt >= max_attempts:
+                state = PipelineState.DONE
+            else:
+                state = PipelineState.GENERATE
+
+    if not validation["is_valid"]:
+        logger.warning("⚠️  Maximum attempts reached. Returning last generated SQL with validation errors.")
+        logger.warning(f"Final validation errors: {'; '.join(validation['errors'])}")
+
+    if answer_cache is not None and validation["is_valid"]:
+        if completion is not None:
+            # store the full response once the explanation has finished streaming
+            completion.add_done_callback(
+                lambda text: answer_cache.put(question, question_vec, sql_query, text, schema_fingerprint)
+            )
+        else:
+            answer_cache.put(question, question_vec, sql_query, response, schema_fingerprint)
+
+    result = SQLGenerationResult(
+        question=question,
+        full_response=response,
+        sql_query=sql_query,
+        is_valid=validation["is_valid"],
+        validation=validation,
+        pruned_schema=pruned_schema,
+        calls=calls,
+        pending_response=completion,
+        cancelled_calls=cancelled_calls,
+    )
+    logger.info(
+        f"📊 LLM calls: {result.llm_calls} ("
+        + ", ".join(f"{c.stage} {c.latency_s:.1f}s" for c in calls)
+        + f"), total {result.llm_latency_s:.1f}s"
+        + (f", {cancelled_calls} cancelled" if cancelled_calls else "")
+    )
+    return result
 
 
-def generate_sql_from_question(question: str, max_attempts: int = 3) -> tuple[str, str]:
+def generate_sql_from_question(question: str, max_attempts: int = 3, pruned_schema: str | None = None) -> tuple[str, str]:
     """
     Generate SQL from a natural language question with validation feedback loop.
     
     Args:
         question: Natural language question
         max_attempts: Maximum number of attempts to generate valid SQL
+        pruned_schema: Schema block already retrieved for this question (e.g. by
+            a batch retrieval); retrieved here when omitted
     
     Returns:
         Tuple of (full_response_with_explanations, validated_sql_query)
     """
-    # 1) Retrieve small schema slice with better parameters
-    pruned_schema = query_schema(
-        question, 
-        method="chess",
-        k_cols=5,           # Reduce to get more focused results
-        max_tables=100,        # Fewer tables for clearer schema
-        max_cols_per_table=10, # Focus on most relevant columns
-        max_char_per_table=1000  # Allow more characters per table
-    )
-    print("=== Schema Retrieved ===")
-    print(pruned_schema)
-    print("========================")
-    
-    # 2) Generate and validate SQL with feedback loop
-    for attempt in range(max_attempts):
-        print(f"\n🔄 Attempt {attempt + 1}/{max_attempts}")
-        
-        # Build prompt for Matcha (include hierarchy context only for retry attempts or ID-related questions)
-        id_keywords = ['id', 'account', 'organization', 'client', 'user', 'sub_account', 'statement', 'hierarchy']
-        needs_context = attempt > 0 or any(keyword in question.lower() for keyword in id_keywords)
-        
-        prompt = build_sql_prompt(question, pruned_schema, include_hierarchy_context=needs_context)
-        
-        # Generate SQL
-        print("🤖 Generating SQL query...")
-        sql = chat_once(prompt)
-        
-        # Extract just the SQL query from the response (remove markdown formatting)
-        sql_query = extract_sql_from_response(sql)
-        
-        print(f"📝 Generated SQL:\n{sql_query}")
-        
-        # Validate the SQL query
-        print("🔍 Validating SQL against schema...")
-        validation = validate_sql_against_schema(sql_query, pruned_schema)
-        
-        if validation["is_valid"]:
-            print("✅ SQL validation passed!")
-            if validation["warnings"]:
-                print(f"⚠️  Warnings: {'; '.join(validation['warnings'])}")
-            return sql, sql_query  # Return both full response and SQL query
-        else:
-            print(f"❌ SQL validation failed: {'; '.join(validation['errors'])}")
-            
-            if attempt < max_attempts - 1:
-                print(f"🔧 Attempting to fix SQL (attempt {attempt + 2}/{max_attempts})...")
-                # Try to fix the SQL with feedback
-                sql_query = fix_sql_with_feedback(sql_query, validation["errors"], pruned_schema, question)
-            else:
-                print("⚠️  Maximum attempts reached. Returning last generated SQL with validation errors.")
-                print(f"Final validation errors: {'; '.join(validation['errors'])}")
-                return sql, sql_query  # Return both even with errors
-    
-    return sql, sql_query  # Fallback return
+    with span("generate_sql_from_question"):
+        result = run_sql_pipeline(question, max_attempts=max_attempts, pruned_schema=pruned_schema)
+        return result.wait_full_response(), result.sql_query  # Return both full response and SQL query
+
+
+# a reply that is the query itself: SELECT, a CTE head (WITH name [(cols)] AS) or a leading SQL comment
+_BARE_SQL_START = re.compile(r"\s*(?:SELECT\b|WITH\s+\[?\w+\]?\s*(?:\([^)]*\)\s*)?AS\s*\(|--|/\*)", re.IGNORECASE)
 
 
 def extract_sql_from_response(response: str) -> str:
     """
     Extract SQL query from LLM response, removing markdown formatting.
+    A response without a code block that starts with the query itself (a
+    bare SELECT / WITH, as fix replies often are) is returned whole.
     """
     # Look for SQL code blocks
-    sql_pattern = r'```sql\s*(.*?)\s*```'
+    sql_pattern = r'```t?sql\s*(.*?)\s*```'
     match = re.search(sql_pattern, response, re.DOTALL | re.IGNORECASE)
+    if not match:
+        match = re.search(r'```[^\S\n]*\n(.*?)\s*```', response, re.DOTALL)  # untagged fence
     
     if match:
         return match.group(1).strip()
+
+    if _BARE_SQL_START.match(response):
+        return response.strip()
     
     # If no code block found, try to find SELECT statement
     lines = response.split('\n')
@@ -517,6 +753,8 @@ def extract_sql_from_response(response: str) -> str:
 
 
 if __name__ == "__main__":
+    configure_logging()
+    start_metrics_server()
     # Interactive mode - ask user for input
     print("🔍 LLM-to-SQL Query Generator")
     print("="*50)
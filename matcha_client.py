@@ -0,0 +1,265 @@
+"""
+Shared Matcha API client.
+
+One pooled keep-alive `requests.Session` (plus an optional `httpx.AsyncClient`)
+is reused for every completion, with configurable timeouts, retries with
+jittered backoff on 429/5xx/connection errors and a cap on in-flight requests.
+
+Settings come from the environment (.env):
+- MATCHA_BASE_URL, MATCHA_API_KEY, MATCHA_MISSION_ID (required)
+- MATCHA_CONNECT_TIMEOUT / MATCHA_READ_TIMEOUT: seconds (default 10 / 200)
+- MATCHA_MAX_RETRIES: retries per request (default 3)
+- MATCHA_MAX_CONCURRENCY: in-flight requests per process (default 8)
+"""
+
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+from typing import Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+
+from tracing import current_span, metrics
+
+try:
+    import httpx
+except ImportError:  # async client is optional
+    httpx = None
+
+load_dotenv()
+
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class MatchaError(RuntimeError):
+    """Matcha answered, but with a non-success status."""
+
+
+class MatchaClient:
+    completion_path = "/completions"
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: str,
+        mission_id: int,
+        connect_timeout: float = 10.0,
+        read_timeout: float = 200.0,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        backoff_max: float = 30.0,
+        max_concurrency: int = 8,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.mission_id = int(mission_id)
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.max_concurrency = max_concurrency
+
+        self.headers = {
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+            "MATCHA-API-KEY": api_key,
+        }
+
+        self._session: Optional[requests.Session] = None
+        self._session_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+
+        # httpx clients and semaphores are bound to the event loop that created them:
+        # one pair per running loop, so repeated asyncio.run() calls each get their own
+        self._async_clients: dict = {}  # loop -> (httpx.AsyncClient, asyncio.Semaphore)
+
+    @classmethod
+    def from_env(cls) -> "MatchaClient":
+        base_url = os.getenv("MATCHA_BASE_URL")
+        api_key = os.getenv("MATCHA_API_KEY")
+        mission_id = os.getenv("MATCHA_MISSION_ID")
+
+        required_vars = {
+            "MATCHA_BASE_URL": base_url,
+            "MATCHA_API_KEY": api_key,
+            "MATCHA_MISSION_ID": mission_id,
+        }
+        missing_vars = [var for var, value in required_vars.items() if not value]
+        if missing_vars:
+            raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
+
+        return cls(
+            base_url=base_url,
+            api_key=api_key,
+            mission_id=int(mission_id),
+            connect_timeout=float(os.getenv("MATCHA_CONNECT_TIMEOUT", "10")),
+            read_timeout=float(os.getenv("MATCHA_READ_TIMEOUT", "200")),
+            max_retries=int(os.getenv("MATCHA_MAX_RETRIES", "3")),
+            max_concurrency=int(os.getenv("MATCHA_MAX_CONCURRENCY", "8")),
+        )
+
+    # ---- helpers ----
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    session.headers.update(self.headers)
+                    # one pooled keep-alive connection per concurrent slot; retries are ours
+                    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency, max_retries=0)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def _payload(self, prompt: str) -> str:
+        return json.dumps({"mission_id": self.mission_id, "input": prompt})
+
+    def _backoff_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        if retry_after:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        # full jitter so parallel callers do not retry in lockstep
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    @staticmethod
+    def _parse_completion(data: dict) -> str:
+        if data.get("status") != "success":
+            raise MatchaError(f"Matcha error: {data.get('error')}")
+        # first text block
+        return data["output"][0]["content"][0]["text"]
+
+    # ---- sync API ----
+
+    def request(self, method: str, path: str, timeout=None, **kwargs) -> requests.Response:
+        """Send a request with retries; raises for non-retryable HTTP errors."""
+        url = f"{self.base_url}/{path.lstrip('/')}"
+        attempt = 0
+        with self._slots:
+            while True:
+                try:
+                    resp = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    if attempt >= self.max_retries:
+                        raise
+                    self._record_retry(type(e).__name__)
+                    time.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+                    continue
+
+                if resp.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    self._record_retry(str(resp.status_code))
+                    time.sleep(self._backoff_delay(attempt, resp.headers.get("Retry-After")))
+                    attempt += 1
+                    continue
+
+                resp.raise_for_status()
+                return resp
+
+    def _record_retry(self, reason: str) -> None:
+        # counted on the caller's span (llm.complete / llm.stream) and in the metrics registry
+        current_span().incr("retries")
+        metrics.inc("llm_sql_http_retries_total", reason=reason)
+
+    def get(self, path: str, timeout=None) -> requests.Response:
+        return self.request("GET", path, timeout=timeout)
+
+    def complete(self, prompt: str) -> str:
+        """Single-turn completion; returns the first text block of the response."""
+        resp = self.request("POST", self.completion_path, data=self._payload(prompt))
+        return self._parse_completion(resp.json())
+
+    def close(self) -> None:
+        if self._session is not None:
+            self._session.close()
+            self._session = None
+
+    # ---- async API ----
+
+    def _get_async_client(self):
+        """(client, semaphore) for the running event loop, created on first use in that loop."""
+        if httpx is None:
+            raise RuntimeError("The async Matcha client needs httpx (pip install httpx).")
+        loop = asyncio.get_running_loop()
+        pair = self._async_clients.get(loop)
+        if pair is None:
+            with self._session_lock:
+                pair = self._async_clients.get(loop)
+                if pair is None:
+                    # loops that have finished cannot use (or close) their clients any more
+                    for old_loop in [l for l in self._async_clients if l.is_closed()]:
+                        del self._async_clients[old_loop]
+                    client = httpx.AsyncClient(
+                        base_url=self.base_url,
+                        headers=self.headers,
+                        timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+                        limits=httpx.Limits(
+                            max_connections=self.max_concurrency,
+                            max_keepalive_connections=self.max_concurrency,
+                        ),
+                    )
+                    pair = self._async_clients[loop] = (client, asyncio.Semaphore(self.max_concurrency))
+        return pair
+
+    async def acomplete(self, prompt: str) -> str:
+        client, slots = self._get_async_client()
+        attempt = 0
+        async with slots:
+            while True:
+                try:
+                    resp = await client.post(self.completion_path, content=self._payload(prompt))
+                except (httpx.ConnectError, httpx.TimeoutException):
+                    if attempt >= self.max_retries:
+                        raise
+                    await asyncio.sleep(self._backoff_delay(attempt))
+                    attempt += 1
+                    continue
+
+                if resp.status_code in RETRYABLE_STATUS_CODES and attempt < self.max_retries:
+                    await asyncio.sleep(self._backoff_delay(attempt, resp.headers.get("Retry-After")))
+                    attempt += 1
+                    continue
+
+                resp.raise_for_status()
+                return self._parse_completion(resp.json())
+
+    async def aclose(self) -> None:
+        """Close the async client of the running event loop."""
+        with self._session_lock:
+            pair = self._async_clients.pop(asyncio.get_running_loop(), None)
+        if pair is not None:
+            await pair[0].aclose()
+
+
+# ========= SHARED INSTANCE =========
+
+_client: Optional[MatchaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_matcha_client() -> MatchaClient:
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = MatchaClient.from_env()
+    return _client
+
+
+def _after_fork_in_child() -> None:
+    # pooled sockets must not be shared with the parent process
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -1,54 +1,68 @@
 import os
 import json
+import hashlib
 import numpy as np
-import pandas as pd
-import faiss
-from azure.ai.inference import EmbeddingsClient
-from azure.core.credentials import AzureKeyCredential
 from dotenv import load_dotenv
 
+from embedding_cache import get_embedding_cache
+from embedding_providers import EmbeddingProvider, get_embedding_provider
+from index_factory import (
+    IndexSpec,
+    build_index,
+    build_manifest,
+    index_kind,
+    manifest_path,
+    read_index_files,
+    read_manifest,
+    sha256_bytes,
+)
+from lexical_index import search_schema
+from tracing import span
+from retrieval_context import (
+    DEFAULT_COLUMN_FAISS_PATH,
+    DEFAULT_COLUMN_METADATA_PATH,
+    DEFAULT_FAISS_INDEX_PATH,
+    DEFAULT_METADATA_PATH,
+    DEFAULT_SCHEMA_CSV_PATH,
+    get_retrieval_context,
+)
+
 # Load environment variables
 load_dotenv()
 
 # ========= CONFIG =========
+# Only plain settings are read here. Indexes and the Azure client are created
+# lazily by retrieval_context on first use, and pandas / faiss are imported by
+# the build functions that need them, so importing this module (and
+# llm_to_query) is cheap and does not require Azure credentials.
+
+SCHEMA_CSV_PATH = os.getenv("SCHEMA_CSV_PATH") or DEFAULT_SCHEMA_CSV_PATH
+FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH") or DEFAULT_FAISS_INDEX_PATH
+METADATA_PATH = os.getenv("METADATA_PATH") or DEFAULT_METADATA_PATH
+COLUMN_FAISS_PATH = os.getenv("COLUMN_FAISS_PATH") or DEFAULT_COLUMN_FAISS_PATH
+COLUMN_METADATA_PATH = os.getenv("COLUMN_METADATA_PATH") or DEFAULT_COLUMN_METADATA_PATH
+
+
+# Column order of the raw (headerless, tab-separated) SQL Server schema dump
+SCHEMA_DUMP_COLUMNS = [
+    "table_schema",
+    "table_name",
+    "table_description",
+    "column_name",
+    "data_type",
+    "max_length",
+    "precision",
+    "scale",
+    "is_nullable",
+    "column_default",
+    "is_primary_key",
+    "is_foreign_key",
+    "referenced_schema",
+    "referenced_table",
+    "referenced_column",
+    "column_description",
+]
 
-SCHEMA_CSV_PATH = os.getenv("SCHEMA_CSV_PATH")
-FAISS_INDEX_PATH = os.getenv("FAISS_INDEX_PATH")
-METADATA_PATH = os.getenv("METADATA_PATH")
-
-# Azure OpenAI settings from environment
-endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-model_name = os.getenv("AZURE_OPENAI_MODEL_NAME")
-deployment = os.getenv("AZURE_OPENAI_DEPLOYMENT")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION")
-AZURE_OPENAI_API_KEY = os.getenv("AZURE_OPENAI_API_KEY")
-
-# Validate required environment variables
-required_vars = {
-    "AZURE_OPENAI_ENDPOINT": endpoint,
-    "AZURE_OPENAI_API_KEY": AZURE_OPENAI_API_KEY,
-    "AZURE_OPENAI_MODEL_NAME": model_name,
-    "AZURE_OPENAI_DEPLOYMENT": deployment,
-    "AZURE_OPENAI_API_VERSION": api_version,
-    "SCHEMA_CSV_PATH": SCHEMA_CSV_PATH,
-    "FAISS_INDEX_PATH": FAISS_INDEX_PATH,
-    "METADATA_PATH": METADATA_PATH,
-}
-
-missing_vars = [var for var, value in required_vars.items() if not value]
-if missing_vars:
-    raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
-
-AZURE_OPENAI_EMBEDDING_DEPLOYMENT = deployment
-AZURE_OPENAI_API_VERSION = api_version
-
-
-# ========= AZURE CLIENT =========
-
-client = EmbeddingsClient(
-    endpoint=endpoint,
-    credential=AzureKeyCredential(AZURE_OPENAI_API_KEY),
-)
 
 
 # ========= SCHEMA → TEXT DESCRIPTION =========
@@ -61,11 +75,194 @@ def humanize_table_name(name: str) -> str:
     return name.replace("_", " ").lower()
 
 
-def build_table_descriptions(df: pd.DataFrame) -> list[dict]:
+def load_schema_csv(path: str) -> "pd.DataFrame":
+    """
+    Load the schema export. Accepts either a CSV with a header row or the
+    raw headerless, tab-separated dump (e.g. attwln_dbo_schem.txt).
+    """
+    import pandas as pd
+
+    with open(path, "r", encoding="utf-8") as f:
+        first_line = f.readline()
+    sep = "\t" if "\t" in first_line else ","
+    if first_line.split(sep)[0].strip() == "table_schema":
+        return pd.read_csv(path, sep=sep)
+    return pd.read_csv(path, sep=sep, header=None, names=SCHEMA_DUMP_COLUMNS)
+
+
+def _positive_int_part(df: "pd.DataFrame", col: str) -> "pd.Series":
+    """' max_length=8' style fragment for rows where `col` is set and > 0, else ''."""
+    import pandas as pd
+
+    part = pd.Series("", index=df.index, dtype=object)
+    if col not in df.columns:
+        return part
+    values = df[col]
+    mask = values.notna() & (values > 0)
+    part[mask] = f" {col}=" + values[mask].astype("int64").astype(str)
+    return part
+
+
+def _optional_part(df: "pd.DataFrame", col: str, prefix: str) -> "pd.Series":
+    import pandas as pd
+
+    part = pd.Series("", index=df.index, dtype=object)
+    if col not in df.columns:
+        return part
+    values = df[col]
+    mask = values.notna()
+    part[mask] = prefix + values[mask].astype(str)
+    return part
+
+
+def render_column_lines(df: "pd.DataFrame") -> "pd.Series":
+    """
+    Render one description line per column, e.g.
+    'acct_id (int max_length=4 precision=10 ) [PK] NOT NULL - account id'.
+    Works on whole columns at once instead of row by row.
+    """
+    is_pk = df["is_primary_key"].fillna(0).astype(int) == 1
+    is_fk = df["is_foreign_key"].fillna(0).astype(int) == 1
+
+    lines = (
+        df["column_name"].astype(str)
+        + " ("
+        + df["data_type"].astype(str)
+        + _positive_int_part(df, "max_length")
+        + _positive_int_part(df, "precision")
+        + _positive_int_part(df, "scale")
+        + " )"
+        + np.where(is_pk, " [PK]", "")
+        + np.where(is_fk, " [FK]", "")
+        + np.where(df["is_nullable"].astype(str).str.upper() == "NO", " NOT NULL", " NULL")
+        + _optional_part(df, "column_default", " default=")
+        + _optional_part(df, "column_description", " - ")
+    )
+    return lines
+
+
+def render_fk_lines(df: "pd.DataFrame") -> "pd.Series":
+    """'col references schema.table(col)' for FK columns with a known target, else NaN."""
+    import pandas as pd
+
+    fk_lines = pd.Series(np.nan, index=df.index, dtype=object)
+    if "referenced_table" not in df.columns or "referenced_column" not in df.columns:
+        return fk_lines
+    mask = (
+        (df["is_foreign_key"].fillna(0).astype(int) == 1)
+        & df["referenced_table"].notna()
+        & df["referenced_column"].notna()
+    )
+    fk_lines[mask] = (
+        df.loc[mask, "column_name"].astype(str)
+        + " references "
+        + df.loc[mask, "referenced_schema"].astype(str)
+        + "."
+        + df.loc[mask, "referenced_table"].astype(str)
+        + "("
+        + df.loc[mask, "referenced_column"].astype(str)
+        + ")"
+    )
+    return fk_lines
+
+
+def build_table_descriptions(df: "pd.DataFrame") -> list[dict]:
     """
     Returns a list of {id, text, table_schema, table_name} entries,
     where `text` is a natural-language-ish description of the table + columns.
     """
+    import pandas as pd
+
+    rendered = pd.DataFrame(
+        {
+            "table_schema": df["table_schema"],
+            "table_name": df["table_name"],
+            "col_line": render_column_lines(df),
+            "fk_line": render_fk_lines(df),
+        }
+    )
+
+    # groupby keeps the original row order inside each table
+    keys = ["table_schema", "table_name"]
+    columns_text = rendered.groupby(keys, sort=True)["col_line"].agg("\n- ".join)
+    fk_text = (
+        rendered.dropna(subset=["fk_line"]).groupby(keys)["fk_line"].agg("\n- ".join).to_dict()
+    )
+
+    records: list[dict] = []
+    for (schema, table), cols in columns_text.items():
+        # simple auto description from table name
+        auto_desc = f"This table stores data related to {humanize_table_name(table)}."
+        full_text = f"Table {schema}.{table}. {auto_desc}\nColumns:\n- {cols}"
+
+        fks = fk_text.get((schema, table))
+        if fks:
+            full_text += "\nForeign keys:\n- " + fks
+
+        records.append(
+            {
+                "id": f"{schema}.{table}",
+                "table_schema": schema,
+                "table_name": table,
+                "text": full_text,
+            }
+        )
+
+    return records
+
+
+def build_column_descriptions(df: "pd.DataFrame") -> list[dict]:
+    """
+    One entry per column for the column-level index:
+    {id, table_schema, table_name, column_name, line, fks, is_primary_key,
+    is_foreign_key, text}. `line` / `fks` are the same strings the table
+    descriptions use, so CHESS can rebuild a table block from only the
+    selected columns; `text` adds the table context that gets embedded.
+    """
+    import pandas as pd
+
+    lines = render_column_lines(df)
+    fk_lines = render_fk_lines(df)
+    is_pk = df["is_primary_key"].fillna(0).astype(int) == 1
+    is_fk = df["is_foreign_key"].fillna(0).astype(int) == 1
+    table_desc = (
+        df["table_description"] if "table_description" in df.columns else pd.Series(np.nan, index=df.index)
+    )
+
+    records: dict[str, dict] = {}
+    for schema, table, column, line, fk, pk_flag, fk_flag, desc in zip(
+        df["table_schema"], df["table_name"], df["column_name"], lines, fk_lines, is_pk, is_fk, table_desc
+    ):
+        column_id = f"{schema}.{table}.{column}"
+        record = records.get(column_id)
+        if record is None:
+            header = f"Table {schema}.{table} ({humanize_table_name(table)})"
+            if isinstance(desc, str) and desc.strip():
+                header += f" - {desc.strip()}"
+            record = records[column_id] = {
+                "id": column_id,
+                "table_schema": schema,
+                "table_name": table,
+                "column_name": str(column),
+                "line": line,
+                "fks": [],
+                "is_primary_key": bool(pk_flag),
+                "is_foreign_key": bool(fk_flag),
+                "text": f"{header}. Column: {line}",
+            }
+        # the dump can repeat a column row once per FK constraint on it
+        if isinstance(fk, str) and fk not in record["fks"]:
+            record["fks"].append(fk)
+            record["text"] += f"; {fk}"
+    return list(records.values())
+
+
+def build_table_descriptions_iterrows(df: "pd.DataFrame") -> list[dict]:
+    """
+    Reference row-by-row renderer. Kept for benchmarking and to check that
+    `build_table_descriptions` stays byte-identical; not used by the pipeline.
+    """
+    import pandas as pd
 
     # Normalize booleans just in case
     for col in ["is_primary_key", "is_foreign_key"]:
@@ -146,28 +343,41 @@ def build_table_descriptions(df: pd.DataFrame) -> list[dict]:
     return records
 
 
-# ========= EMBEDDINGS (AZURE OPENAI) =========
+# ========= EMBEDDINGS =========
 
-def embed_texts_azure(texts: list[str], batch_size: int = 16) -> np.ndarray:
+def embed_texts(
+    texts: list[str],
+    batch_size: int | None = None,
+    use_cache: bool = True,
+    provider: EmbeddingProvider | None = None,
+) -> np.ndarray:
     """
-    Embed a list of strings using Azure AI Inference embeddings.
+    Embed a list of strings with the configured provider (EMBEDDING_PROVIDER,
+    see embedding_providers). Texts already seen (same provider model +
+    normalized text) are served from the embedding cache; only the misses
+    are embedded.
     Returns: numpy array of shape (len(texts), embedding_dim)
     """
-    vectors: list[list[float]] = []
+    provider = provider or get_embedding_provider()
+    cache = get_embedding_cache() if use_cache else None
+    with span("embedding.embed", provider=provider.name, texts=len(texts)) as s:
+        if cache is None:
+            return provider.embed(texts, batch_size=batch_size)
 
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i : i + batch_size]
+        embedded = []
 
-        response = client.embed(
-            input=batch,
-            model=model_name
-        )
+        def embed_misses(misses: list[str]) -> np.ndarray:
+            embedded.append(len(misses))
+            return provider.embed(misses, batch_size=batch_size)
 
-        # response.data is in order of input
-        for item in response.data:
-            vectors.append(item.embedding)
+        vectors = cache.get_or_embed(provider.cache_model, texts, embed_misses)
+        s.set(embedded=sum(embedded), cache_hit=not embedded)
+        return vectors
 
-    return np.array(vectors, dtype="float32")
+
+def embed_texts_azure(texts: list[str], batch_size: int = 16, use_cache: bool = True) -> np.ndarray:
+    """Embed with Azure AI Inference regardless of EMBEDDING_PROVIDER."""
+    return embed_texts(texts, batch_size=batch_size, use_cache=use_cache, provider=get_embedding_provider("azure"))
 
 
 def normalize_rows(x: np.ndarray) -> np.ndarray:
@@ -177,36 +387,51 @@ def normalize_rows(x: np.ndarray) -> np.ndarray:
 
 # ========= RETRIEVAL FUNCTIONS =========
 
-def simple_retrieval(question: str, k: int = 5) -> str:
+def simple_retrieval(question: str, k: int = 5, retrieval_mode: str | None = None) -> str:
     """
     Simple embedding-based table retrieval.
     Returns top-k most similar tables based on cosine similarity.
     """
-    # Load the FAISS index and metadata if not already loaded
-    if not hasattr(simple_retrieval, 'index'):
-        simple_retrieval.index = faiss.read_index(FAISS_INDEX_PATH)
-        with open(METADATA_PATH, "r", encoding="utf-8") as f:
-            simple_retrieval.metadata = json.load(f)
-    
-    # Embed the question
-    q_vec = embed_texts_azure([question])
-    q_vec = normalize_rows(q_vec)
-    
-    # Search for similar tables
-    D, I = simple_retrieval.index.search(q_vec, k)
-    
-    # Build result
-    results = []
-    for rank, idx in enumerate(I[0]):
-        table_info = simple_retrieval.metadata[idx]
-        results.append(f"Rank {rank + 1} (Score: {D[0][rank]:.3f}):")
-        results.append(f"{table_info['text']}")
-        results.append("")  # blank line
-    
-    return "\n".join(results)
+    return simple_retrieval_batch([question], k=k, retrieval_mode=retrieval_mode)[0]
 
 
-def chess_retrieval(question: str, k_cols: int = 40, max_tables: int = 5, max_cols_per_table: int = 10, max_char_per_table: int = 2000) -> str:
+def simple_retrieval_batch(questions: list[str], k: int = 5, retrieval_mode: str | None = None) -> list[str]:
+    """
+    simple_retrieval for many questions: one embedding call and one FAISS
+    search for the whole batch. Returns one schema block per question.
+    `retrieval_mode` (vector | lexical | hybrid | auto, default RETRIEVAL_MODE)
+    adds BM25 over table / column names, see lexical_index.
+    """
+    # FAISS index, metadata and the BM25 index are built once per process on first use
+    ctx = get_retrieval_context()
+    index, metadata = ctx.table_index
+
+    ranked = search_schema(
+        questions,
+        k,
+        index,
+        ctx.table_lexical,
+        embed=lambda texts: normalize_rows(embed_texts(texts)),
+        mode=retrieval_mode,
+    )
+
+    # Build results
+    blocks = []
+    for hits in ranked:
+        results = []
+        for rank, (idx, score) in enumerate(hits):
+            table_info = metadata.get(idx)
+            if table_info is None:
+                continue
+            results.append(f"Rank {rank + 1} (Score: {score:.3f}):")
+            results.append(f"{table_info['text']}")
+            results.append("")  # blank line
+        blocks.append("\n".join(results))
+
+    return blocks
+
+
+def chess_retrieval(question: str, k_cols: int = 40, max_tables: int = 5, max_cols_per_table: int = 10, max_char_per_table: int = 2000, token_budget: int | None = None, retrieval_mode: str | None = None) -> str:
     """
     CHESS-style retrieval using the chess_preprocess module.
     """
@@ -218,7 +443,9 @@ def chess_retrieval(question: str, k_cols: int = 40, max_tables: int = 5, max_co
             k_cols=k_cols,
             max_tables=max_tables,
             max_cols_per_table=max_cols_per_table,
-            max_char_per_table=max_char_per_table
+            max_char_per_table=max_char_per_table,
+            token_budget=token_budget,
+            retrieval_mode=retrieval_mode,
         )
     except ImportError as e:
         return f"Error: Could not import chess_preprocess module. {e}"
@@ -238,64 +465,293 @@ def query_schema(question: str, method: str = "simple", **kwargs) -> str:
     Returns:
         Formatted schema information relevant to the question
     """
+    with span("retrieval.query_schema", method=method) as s:
+        if method.lower() == "simple":
+            k = kwargs.get('k', 10)
+            schema = simple_retrieval(question, k=k, retrieval_mode=kwargs.get('retrieval_mode'))
+        elif method.lower() == "chess":
+            k_cols = kwargs.get('k_cols', 40)
+            max_tables = kwargs.get('max_tables', 5)
+            max_cols_per_table = kwargs.get('max_cols_per_table', 10)
+            max_char_per_table = kwargs.get('max_char_per_table', 2000)
+            token_budget = kwargs.get('token_budget')
+            retrieval_mode = kwargs.get('retrieval_mode')
+            schema = chess_retrieval(question, k_cols, max_tables, max_cols_per_table, max_char_per_table, token_budget, retrieval_mode)
+        else:
+            return f"Error: Unknown method '{method}'. Use 'simple' or 'chess'."
+        s.set(schema_chars=len(schema))
+        return schema
+
+
+def query_schema_batch(questions: list[str], method: str = "simple", **kwargs) -> list[str]:
+    """
+    Batch version of query_schema: questions are embedded in one call and
+    searched with one FAISS query. Returns one schema block per question.
+    """
+    with span("retrieval.query_schema_batch", method=method, questions=len(questions)):
+        return _query_schema_batch(questions, method, **kwargs)
+
+
+def _query_schema_batch(questions: list[str], method: str, **kwargs) -> list[str]:
     if method.lower() == "simple":
-        k = kwargs.get('k', 10)
-        return simple_retrieval(question, k=k)
+        return simple_retrieval_batch(questions, k=kwargs.get('k', 10), retrieval_mode=kwargs.get('retrieval_mode'))
     elif method.lower() == "chess":
-        k_cols = kwargs.get('k_cols', 40)
-        max_tables = kwargs.get('max_tables', 5)
-        max_cols_per_table = kwargs.get('max_cols_per_table', 10)
-        max_char_per_table = kwargs.get('max_char_per_table', 2000)
-        return chess_retrieval(question, k_cols, max_tables, max_cols_per_table, max_char_per_table)
+        from chess_preprocess import get_pruned_schemas_for_questions
+        return get_pruned_schemas_for_questions(
+            questions,
+            k_cols=kwargs.get('k_cols', 40),
+            max_tables=kwargs.get('max_tables', 5),
+            max_cols_per_table=kwargs.get('max_cols_per_table', 10),
+            max_char_per_table=kwargs.get('max_char_per_table', 2000),
+            token_budget=kwargs.get('token_budget'),
+            retrieval_mode=kwargs.get('retrieval_mode'),
+        )
     else:
-        return f"Error: Unknown method '{method}'. Use 'simple' or 'chess'."
+        raise ValueError(f"Unknown method '{method}'. Use 'simple' or 'chess'.")
 
 
-# ========= MAIN PIPELINE =========
+# ========= INDEX PERSISTENCE =========
+
+def fingerprint_text(text: str) -> str:
+    """Stable content hash of a rendered table description."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _atomic_replace(path: str, write_tmp) -> None:
+    # temp file in the same directory so os.replace is an atomic rename
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        write_tmp(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_bytes_atomic(data: bytes, path: str) -> str:
+    """Atomically replace `path` with `data`; returns its SHA-256 for the manifest."""
+    def write(tmp):
+        with open(tmp, "wb") as f:
+            f.write(data)
 
+    _atomic_replace(path, write)
+    return sha256_bytes(data)
 
 
-def preprocess_faiss():
+def write_index_atomic(index, path: str) -> str:
+    import faiss
+
+    return write_bytes_atomic(faiss.serialize_index(index).tobytes(), path)
+
+
+def write_json_atomic(obj, path: str) -> str:
+    return write_bytes_atomic(json.dumps(obj, ensure_ascii=False, indent=2).encode("utf-8"), path)
+
+
+def _load_id_mapped_index(index_path: str, metadata_path: str):
     """
-    Build embeddings and FAISS index for table-level retrieval.
-    This creates the foundation for both simple and CHESS retrieval methods.
+    Load an existing index for an incremental update.
+    Returns (None, None) when there is nothing usable, e.g. a legacy
+    IndexFlatIP without stable ids.
     """
-    # 1) Load schema CSV
-    df = pd.read_csv(SCHEMA_CSV_PATH)
-    print(f"Loaded schema CSV with {len(df)} rows")
+    import faiss
 
-    # 2) Build table descriptions
-    table_docs = build_table_descriptions(df)
-    print(f"Built {len(table_docs)} table descriptions")
-    print("--- Example description ---")
-    print(table_docs[0]["text"][:500])
-    print("---------------------------")
+    if not (os.path.exists(index_path) and os.path.exists(metadata_path)):
+        return None, None
 
-    # 3) Create embeddings
-    texts = [doc["text"] for doc in table_docs]
-    print("Creating embeddings with Azure OpenAI...")
-    vectors = embed_texts_azure(texts)
+    try:
+        index, metadata_bytes, _ = read_index_files(index_path, metadata_path, retries=0)
+    except RuntimeError as e:
+        print(f"⚠️  {e}")
+        return None, None
+    metadata = json.loads(metadata_bytes)
+
+    if isinstance(index, faiss.IndexIDMap2):
+        # IVF-PQ saved inside IndexIDMap2 (older builds): its id table breaks on remove_ids
+        if index_kind(index) == "ivfpq":
+            return None, None
+    elif not isinstance(index, faiss.IndexIVF):
+        return None, None
+    if any("vector_id" not in m or "fingerprint" not in m for m in metadata):
+        return None, None
+    return index, metadata
+
+
+# ========= MAIN PIPELINE =========
+
+def _build_full_index(docs: list[dict], spec: IndexSpec):
+    texts = [doc["text"] for doc in docs]
+    provider = get_embedding_provider()
+    print(f"Creating embeddings with {provider.name} ({provider.model})...")
+    vectors = embed_texts(texts)
     print("Embeddings shape:", vectors.shape)
 
-    # 4) Normalize for cosine similarity
+    # Normalize for cosine similarity
     vectors = normalize_rows(vectors)
 
-    # 5) Build FAISS index
-    dim = vectors.shape[1]
-    index = faiss.IndexFlatIP(dim)   # inner product on normalized vectors = cosine sim
-    index.add(vectors)
+    for vector_id, doc in enumerate(docs):
+        doc["vector_id"] = vector_id
+
+    # inner product on normalized vectors = cosine sim; vector ids stay stable across updates
+    print(f"Building {spec.kind} index...")
+    index = build_index(vectors, np.arange(len(docs), dtype="int64"), spec)
+    return index, docs
+
+
+def _update_index(index, old_metadata: list[dict], docs: list[dict]):
+    """
+    Apply the delta between `old_metadata` and `docs` to `index` in place.
+    Returns (None, None) when the index cannot drop vectors (HNSW) but the
+    delta needs it; the caller then rebuilds from scratch.
+    """
+    old_by_id = {m["id"]: m for m in old_metadata}
+    new_ids = {doc["id"] for doc in docs}
+
+    removed = [m for m in old_metadata if m["id"] not in new_ids]
+    changed = [d for d in docs if d["id"] in old_by_id and old_by_id[d["id"]]["fingerprint"] != d["fingerprint"]]
+    added = [d for d in docs if d["id"] not in old_by_id]
+    print(f"Incremental update: {len(added)} added, {len(changed)} changed, {len(removed)} removed")
+
+    if (removed or changed) and index_kind(index) == "hnsw":
+        print("HNSW indexes cannot drop vectors; doing a full rebuild.")
+        return None, None
+
+    # Unchanged and changed entries keep their vector id; new ones get fresh ids
+    next_id = max((m["vector_id"] for m in old_metadata), default=-1) + 1
+    for doc in docs:
+        if doc["id"] in old_by_id:
+            doc["vector_id"] = old_by_id[doc["id"]]["vector_id"]
+        else:
+            doc["vector_id"] = next_id
+            next_id += 1
+
+    stale_ids = [m["vector_id"] for m in removed] + [d["vector_id"] for d in changed]
+    if stale_ids:
+        index.remove_ids(np.array(stale_ids, dtype="int64"))
+
+    to_embed = changed + added
+    if to_embed:
+        vectors = normalize_rows(embed_texts([d["text"] for d in to_embed]))
+        if vectors.shape[1] != index.d:
+            raise ValueError(
+                f"Embedding dimension changed ({index.d} -> {vectors.shape[1]}); run a full rebuild"
+            )
+        index.add_with_ids(vectors, np.array([d["vector_id"] for d in to_embed], dtype="int64"))
+    return index, docs
+
+
+def _embedding_changed(index_path: str, index) -> bool:
+    built = (read_manifest(index_path) or {}).get("embedding")
+    current = get_embedding_provider().describe(index.d)
+    # indexes from before the manifest recorded it were built with Azure
+    return (built or {}).get("provider", "azure") != current["provider"] or (
+        built is not None and built.get("model") != current["model"]
+    )
+
+
+def _build_and_save(
+    docs: list[dict],
+    index_path: str,
+    metadata_path: str,
+    incremental: bool,
+    spec: IndexSpec,
+):
+    """Embed `docs` (fully or only the delta) and atomically save index, metadata and manifest."""
+    for doc in docs:
+        doc["fingerprint"] = fingerprint_text(doc["text"])
+
+    existing_index, existing_metadata = (None, None)
+    if incremental:
+        existing_index, existing_metadata = _load_id_mapped_index(index_path, metadata_path)
+        if existing_index is None:
+            print("No id-mapped index found; doing a full rebuild.")
+        elif index_kind(existing_index) != spec.kind:
+            print(f"Index type changed ({index_kind(existing_index)} -> {spec.kind}); doing a full rebuild.")
+            existing_index = None
+        elif _embedding_changed(index_path, existing_index):
+            print("Embedding provider or model changed; doing a full rebuild.")
+            existing_index = None
+
+    index = None
+    if existing_index is not None:
+        index, updated_docs = _update_index(existing_index, existing_metadata, docs)
+        if index is not None:
+            docs = updated_docs
+    if index is None:
+        index, docs = _build_full_index(docs, spec)
     print("FAISS index size:", index.ntotal)
 
-    # 6) Save FAISS index + metadata
-    faiss.write_index(index, FAISS_INDEX_PATH)
-    with open(METADATA_PATH, "w", encoding="utf-8") as f:
-        json.dump(table_docs, f, ensure_ascii=False, indent=2)
+    # Save FAISS index + metadata, then the manifest with both digests: readers only
+    # accept a pair that matches it, so the manifest write publishes the build
+    files = {"index": write_index_atomic(index, index_path), "metadata": write_json_atomic(docs, metadata_path)}
+    embedding = get_embedding_provider().describe(index.d)
+    write_json_atomic(build_manifest(index, spec, embedding, files), manifest_path(index_path))
+    print(f"Saved FAISS index to {index_path}")
+    print(f"Saved metadata to {metadata_path}")
 
-    print(f"Saved FAISS index to {FAISS_INDEX_PATH}")
-    print(f"Saved metadata to {METADATA_PATH}")
-    print("✅ Done. Ready for both simple and CHESS retrieval.")
 
+def preprocess_faiss(incremental: bool = False, spec: IndexSpec | None = None, columns: bool = True):
+    """
+    Build embeddings and FAISS indexes: the table-level index used by simple
+    retrieval and the column-level index used by CHESS column filtering.
 
+    Args:
+        incremental: Re-embed only tables / columns whose rendered description
+            was added or changed since the last build, and drop ones that no
+            longer exist. Falls back to a full rebuild when no id-mapped index
+            exists or the index type changed. IVF-PQ updates reuse the saved training.
+        spec: Index type and build parameters (default: IndexSpec.from_env())
+        columns: Also build the column-level index
+    """
+    spec = spec or IndexSpec.from_env()
+
+    # 1) Load schema CSV
+    df = load_schema_csv(SCHEMA_CSV_PATH)
+    print(f"Loaded schema CSV with {len(df)} rows")
+
+    # 2) Table-level index
+    table_docs = build_table_descriptions(df)
+    print(f"Built {len(table_docs)} table descriptions")
+    print("--- Example description ---")
+    print(table_docs[0]["text"][:500])
+    print("---------------------------")
+    _build_and_save(table_docs, FAISS_INDEX_PATH, METADATA_PATH, incremental, spec)
+
+    # 3) Column-level index (one vector per column)
+    if columns and COLUMN_FAISS_PATH == FAISS_INDEX_PATH:
+        print("COLUMN_FAISS_PATH is the table index; skipping the column-level index.")
+    elif columns:
+        column_docs = build_column_descriptions(df)
+        print(f"Built {len(column_docs)} column descriptions")
+        _build_and_save(column_docs, COLUMN_FAISS_PATH, COLUMN_METADATA_PATH, incremental, spec)
 
+    get_retrieval_context().reset()  # pick up the new files on next retrieval
+    print("✅ Done. Ready for both simple and CHESS retrieval.")
 
 
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build the schema FAISS index")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only re-embed added/changed tables and drop removed ones",
+    )
+    parser.add_argument(
+        "--tables-only",
+        action="store_true",
+        help="skip the column-level index used by CHESS retrieval",
+    )
+    parser.add_argument(
+        "--index-type",
+        choices=["flat", "hnsw", "ivfpq"],
+        help="override FAISS_INDEX_TYPE (default: flat)",
+    )
+    args = parser.parse_args()
+
+    spec = IndexSpec.from_env()
+    if args.index_type:
+        spec.kind = args.index_type
+    preprocess_faiss(incremental=args.incremental, spec=spec, columns=not args.tables_only)
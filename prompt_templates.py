@@ -0,0 +1,302 @@
+"""
+Prompt templates for SQL generation and fixing.
+
+Every prompt is laid out as a static prefix followed by the per-question
+part:
+- static prefix: role, checklists, output format and few-shot example, plus
+  the data-hierarchy reference when it is needed. It is identical for every
+  question and attempt, so it is built once per process and sits first in
+  the prompt, where provider-side prompt caching can reuse it.
+- dynamic suffix: the retrieved schema and the question (and, for fixes,
+  the failing query and its errors). The rendered schema section is cached
+  per (question, schema), so retries do not re-render it.
+
+Context files such as DATA_HIERARCHY_CONTEXT.md are read once and cached.
+"""
+
+import logging
+import os
+from functools import lru_cache
+from typing import Optional
+
+HIERARCHY_CONTEXT_FILE = "DATA_HIERARCHY_CONTEXT.md"
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=None)
+def load_context_file(name: str) -> Optional[str]:
+    """
+    Read a context file once per process. Looks in the working directory
+    first, then next to this module. Returns None (and warns once) when missing.
+    """
+    for path in (name, os.path.join(os.path.dirname(os.path.abspath(__file__)), name)):
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                return f.read()
+    logger.warning(f"Warning: {name} not found. Proceeding without hierarchy context.")
+    return None
+
+
+def hierarchy_context() -> Optional[str]:
+    return load_context_file(HIERARCHY_CONTEXT_FILE)
+
+
+# ========= SQL GENERATION =========
+
+SQL_STATIC_PREFIX = """You are an expert T-SQL assistant. You write correct and efficient queries for Microsoft SQL Server.
+
+# Role Definition
+
+You are an expert T-SQL database developer with deep expertise in query optimization, schema analysis, and translating natural language questions into precise, efficient SQL queries. Your queries will be automatically validated against the provided schema, so accuracy is critical.
+
+# Data Structure Awareness
+
+This system follows a strict hierarchical data structure with specific ID relationships:
+- **Client ID** → **Product/Bundle ID** → **Organization ID** → **Account ID** → **User ID / Sub_Account ID**
+- Be especially careful when distinguishing between **Account ID** (customer entity) and **Sub_Account ID** (specific services/usage data)
+- When queries involve multiple ID types, consider their hierarchical relationships
+- If your initial query fails validation due to ID relationship issues, additional hierarchy context will be provided
+
+# Important ID Guidelines
+
+- For usage/data queries: Focus on **Sub_Account ID** level
+- For customer/billing queries: Focus on **Account ID** level  
+- For organizational structure: Focus on **Organization ID** level
+- Always verify ID relationships match the hierarchical structure
+
+# CRITICAL: Schema Validation Process
+
+ **IMPORTANT**: Your generated SQL will be automatically validated against the provided schema. Queries that reference non-existent tables or columns will be rejected and you'll be asked to fix them. To avoid validation errors:
+
+1. **Use ONLY the tables explicitly listed in the Available Schema section**
+2. **Use ONLY the columns that exist in those tables**
+3. **Match table names exactly as they appear in the schema**
+4. **Pay attention to schema prefixes (e.g., dbo.table_name)**
+
+# Contextual Information
+
+You will be provided with:
+- A curated list of the most relevant database tables with their complete schemas
+- Table names, column names, data types, constraints, and relationships
+- A natural language question that requires a SQL query to answer
+
+The tables provided have been pre-selected as the most relevant to the user's question through semantic search. You are working within a T-SQL environment (SQL Server/Azure SQL Database).
+
+# Task Description and Goals
+
+Your primary goal is to generate a precise, executable T-SQL query that accurately answers the user's question using the provided table schemas. The query should be:
+
+1. **Schema-Compliant**: Uses only tables and columns that exist in the provided schema
+2. **Accurate**: Directly answers the specific question asked
+3. **Efficient**: Uses appropriate joins, filters, and indexing strategies
+4. **Executable**: Valid T-SQL syntax that will run without errors
+5. **Readable**: Well-formatted with clear aliasing and logical structure
+
+# Instructional Guidance and Constraints
+
+Follow this systematic approach:
+
+1. **Schema Analysis First**: Before writing any SQL, carefully review the provided schema to identify:
+   - Exact table names and how they're referenced (with/without schema prefix)
+   - Available columns in each table and their data types
+   - Primary keys ([PK]) and foreign keys ([FK]) for joins
+   - Relationships between tables based on foreign key references
+
+2. **Question Analysis**: Break down what the user is asking for:
+   - Required columns for the output
+   - Filtering conditions needed
+   - Aggregations or calculations required
+   - Relationships between tables needed
+
+3. **Query Construction**:
+   - Start with the main table that contains the core data
+   - Add JOINs only for tables that are necessary and exist in the schema
+   - Use explicit JOIN syntax (INNER JOIN, LEFT JOIN, etc.)
+   - Reference columns exactly as they appear in the schema
+   - Add WHERE clauses for filtering
+   - Include appropriate ORDER BY, GROUP BY, or HAVING clauses
+
+4. **Pre-Validation Checklist** (CRITICAL - Follow Before Writing SQL):
+   ✅ Verify ALL table names exist exactly as shown in the Available Schema section
+   ✅ Verify ALL column names exist in their respective tables 
+   ✅ Ensure JOIN conditions use valid foreign key relationships from the schema
+   ✅ Check that data types are compatible for comparisons and operations
+   ✅ Confirm SQL syntax follows valid T-SQL standards
+   ✅ Double-check that no assumptions are made about tables/columns not in the schema
+
+5. **Schema Validation Requirements**:
+   - **MANDATORY**: Every table name in your query MUST appear in the Available Schema section
+   - **MANDATORY**: Every column name in your query MUST exist in the specified table
+   - **MANDATORY**: Use exact naming conventions including schema prefixes (e.g., dbo.table_name)
+   - If you're unsure about a table or column, do NOT include it - only use what's explicitly provided
+
+6. **Query Requirements**:
+   - Use explicit JOIN syntax rather than implicit joins
+   - Include appropriate WHERE clauses for filtering
+   - Use proper aggregation functions when needed
+   - Add ORDER BY when the question implies specific ordering
+   - Use table aliases for readability
+   - Handle potential NULL values appropriately
+
+# Expected Output Format
+
+Your response should follow this structure:
+
+```
+## Query Analysis
+[Brief explanation of what you're trying to achieve and which tables/columns you'll use]
+
+## Schema Validation Check
+[Confirm that all tables and columns in your query exist in the provided schema - list the specific tables and key columns you're using]
+
+## T-SQL Query
+```sql
+[Your complete, executable T-SQL query using only schema-provided tables/columns]
+```
+
+## Business Logic Explanation
+[Explain in plain English what this query is doing, how the data flows through the system, and why these specific tables are connected. Help someone unfamiliar with the database understand the business relationships and data structure.]
+
+## Assumptions
+[List any assumptions made about the data or relationships]
+```
+
+## Few-Shot Examples
+**Example:**
+```
+User Question: "Get a list of org id, account id with their billed amount for which they have autopay enabled."
+Tables Provided:
+- t_acct_payment_info
+- t_billed
+
+Query Analysis:
+Need to find billing records for accounts that have autopay enabled by connecting payment information to billing data.
+
+Schema Validation Check:
+- t_acct_payment_info: Contains autopay_enabled column and acct_id for joining
+- t_billed: Contains billing amounts and acct_id for joining
+
+T-SQL Query:
+```sql
+WITH autopay_on AS (
+    SELECT DISTINCT acct_id
+    FROM dbo.t_acct_payment_info
+    WHERE autopay_enabled IS NOT NULL
+)
+SELECT b.org_id, b.acct_id, b.billed_amount
+FROM dbo.t_billed AS b
+JOIN autopay_on AS ap
+    ON b.acct_id = ap.acct_id;
+```
+
+Business Logic Explanation:
+This query is looking for customers who have automatic payment set up and retrieving their billing information. In our system, customer payment preferences (like autopay) are stored separately from billing records. We first identify all accounts that have autopay enabled, then connect that information to the billing table to get the actual billing amounts. This gives us a list of customers who pay automatically along with how much they're being billed.
+
+
+Assumptions:
+- autopay_enabled IS NOT NULL indicates autopay is active
+- acct_id is the common key between payment info and billing tables
+```
+
+# Any Additional Notes on Scope or Limitations
+
+- You should only generate queries using the tables explicitly provided to you
+- If the provided tables are clearly insufficient to answer the question, state this explicitly and explain what additional tables or information would be needed
+- Do not fabricate table names, column names, or relationships not present in the provided schema
+- If the question is ambiguous, state your interpretation and proceed with the most logical query
+- Focus on standard T-SQL syntax compatible with SQL Server 2016 and later versions
+- Prioritize correctness over performance, but note any obvious optimization opportunities"""
+
+SQL_HIERARCHY_SECTION = """
+
+# Data Hierarchy Reference
+
+{hierarchy_context}"""
+
+SQL_DYNAMIC_SUFFIX = """
+
+# Available Schema
+
+{schema}
+
+# User Question
+
+{question}"""
+
+
+@lru_cache(maxsize=None)
+def sql_prompt_prefix(include_hierarchy_context: bool = False) -> str:
+    """The static part of the generation prompt, built once per variant."""
+    prefix = SQL_STATIC_PREFIX
+    context = hierarchy_context() if include_hierarchy_context else None
+    if context:
+        prefix += SQL_HIERARCHY_SECTION.format(hierarchy_context=context.strip())
+    return prefix
+
+
+@lru_cache(maxsize=256)
+def render_schema_section(question: str, schema: str) -> str:
+    """Per-question part of the generation prompt (cached across retries)."""
+    return SQL_DYNAMIC_SUFFIX.format(schema=schema, question=question)
+
+
+def render_sql_prompt(question: str, schema: str, include_hierarchy_context: bool = False) -> str:
+    return sql_prompt_prefix(include_hierarchy_context) + render_schema_section(question, schema)
+
+
+# ========= SQL FIXING =========
+
+FIX_STATIC_PREFIX = """You are an expert T-SQL assistant. A SQL query generated for Microsoft SQL Server failed automatic validation against the database schema.
+
+Please provide a corrected T-SQL query that:
+1. Fixes all the validation errors listed below
+2. Uses only tables and columns that exist in the provided schema
+3. Still answers the original user question accurately"""
+
+FIX_HIERARCHY_SECTION = """
+
+{hierarchy_context}
+
+IMPORTANT: If the validation errors suggest confusion about ID relationships, use the hierarchy context above to understand the correct relationships between different ID types."""
+
+FIX_DYNAMIC_SUFFIX = """
+
+The following SQL query has validation errors and needs to be corrected:
+
+ORIGINAL QUERY:
+```sql
+{original_query}
+```
+
+VALIDATION ERRORS:
+{errors}
+
+AVAILABLE SCHEMA:
+{schema}
+
+USER QUESTION:
+{question}
+
+Return ONLY the corrected SQL query in a ```sql code block, without any explanation:"""
+
+
+@lru_cache(maxsize=None)
+def fix_prompt_prefix(include_hierarchy_context: bool = False) -> str:
+    prefix = FIX_STATIC_PREFIX
+    context = hierarchy_context() if include_hierarchy_context else None
+    if context:
+        prefix += FIX_HIERARCHY_SECTION.format(hierarchy_context=context.strip())
+    return prefix
+
+
+def render_fix_prompt(
+    original_query: str,
+    errors: str,
+    schema: str,
+    question: str,
+    include_hierarchy_context: bool = False,
+) -> str:
+    return fix_prompt_prefix(include_hierarchy_context) + FIX_DYNAMIC_SUFFIX.format(
+        original_query=original_query, errors=errors, schema=schema, question=question
+    )
@@ -0,0 +1,327 @@
+"""
+Lazily initialized retrieval resources.
+
+Nothing here touches the network or disk at import time. The FAISS indexes,
+their metadata and the Azure embeddings client are created on first use,
+exactly once per process, behind a lock so concurrent threads share them.
+
+Paths and credentials come from the environment (.env):
+- FAISS_INDEX_PATH / METADATA_PATH: table-level index used by simple retrieval
+- FAISS_NPROBE / FAISS_EF_SEARCH: search-time knobs for IVF-PQ / HNSW indexes
+- COLUMN_FAISS_PATH / COLUMN_METADATA_PATH: column-level index used by CHESS
+  column filtering (defaults to schema_columns.*; falls back to the table-level
+  files when no column index has been built)
+- SCHEMA_CSV_PATH / SCHEMA_CATALOG_PATH: schema export and its compiled catalog
+- AZURE_OPENAI_*: embeddings endpoint, key and model
+- EMBEDDING_PROVIDER: must match the provider that built the indexes (see embedding_providers)
+"""
+
+import hashlib
+import json
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DEFAULT_FAISS_INDEX_PATH = "schema_tables.faiss"
+DEFAULT_METADATA_PATH = "schema_tables_metadata.json"
+DEFAULT_COLUMN_FAISS_PATH = "schema_columns.faiss"
+DEFAULT_COLUMN_METADATA_PATH = "schema_columns_metadata.json"
+DEFAULT_SCHEMA_CSV_PATH = "attwln_dbo_schem.txt"
+DEFAULT_SCHEMA_CATALOG_PATH = "schema_catalog.bin"
+DEFAULT_TABLE_STATS_PATH = "table_stats.json"
+
+
+def metadata_by_vector_id(metadata: list[dict]) -> dict[int, dict]:
+    """
+    Map FAISS ids back to metadata entries.
+    Indexes built before stable ids existed use the list position as the id.
+    """
+    return {m.get("vector_id", i): m for i, m in enumerate(metadata)}
+
+
+def load_index_and_metadata(index_path: str, metadata_path: str) -> Tuple[object, Dict[int, dict]]:
+    # faiss (heavy) is only imported by index_factory when an index is actually needed
+    from index_factory import apply_search_params_from_env, read_index_files
+
+    if not os.path.exists(index_path):
+        raise FileNotFoundError(
+            f"FAISS index not found at '{index_path}'. Run `python3 preprocess.py` to build it."
+        )
+    from embedding_providers import check_index_embedding
+
+    # index and metadata of the same build, checked against the manifest digests
+    index, metadata_bytes, _ = read_index_files(index_path, metadata_path)
+    check_index_embedding(index_path, index)  # built by the current EMBEDDING_PROVIDER?
+    apply_search_params_from_env(index)  # FAISS_NPROBE / FAISS_EF_SEARCH
+    metadata = metadata_by_vector_id(json.loads(metadata_bytes))
+    return index, metadata
+
+
+class RetrievalContext:
+    """
+    Holds the indexes and clients used by retrieval. Every resource is
+    created on first access; call `warm()` before forking workers if you
+    want them to inherit already-loaded indexes.
+    """
+
+    def __init__(
+        self,
+        table_index_path: Optional[str] = None,
+        table_metadata_path: Optional[str] = None,
+        column_index_path: Optional[str] = None,
+        column_metadata_path: Optional[str] = None,
+        schema_csv_path: Optional[str] = None,
+        schema_catalog_path: Optional[str] = None,
+        table_stats_path: Optional[str] = None,
+    ):
+        self.table_index_path = table_index_path or os.getenv("FAISS_INDEX_PATH") or DEFAULT_FAISS_INDEX_PATH
+        self.table_metadata_path = table_metadata_path or os.getenv("METADATA_PATH") or DEFAULT_METADATA_PATH
+        self._column_paths = (
+            column_index_path or os.getenv("COLUMN_FAISS_PATH"),
+            column_metadata_path or os.getenv("COLUMN_METADATA_PATH"),
+        )
+        self._resolve_column_paths()
+        self.schema_csv_path = schema_csv_path or os.getenv("SCHEMA_CSV_PATH") or DEFAULT_SCHEMA_CSV_PATH
+        self.schema_catalog_path = (
+            schema_catalog_path or os.getenv("SCHEMA_CATALOG_PATH") or DEFAULT_SCHEMA_CATALOG_PATH
+        )
+        self.table_stats_path = table_stats_path or os.getenv("TABLE_STATS_PATH") or DEFAULT_TABLE_STATS_PATH
+
+        self.embedding_model = os.getenv("AZURE_OPENAI_MODEL_NAME")
+
+        self._lock = threading.RLock()
+        self._table_index = None
+        self._column_index = None
+        self._schema_catalog = None
+        self._table_lexical = None
+        self._column_lexical = None
+        self._index_fingerprint = None
+        self._embeddings_client = None
+
+    def _resolve_column_paths(self) -> None:
+        index_path, metadata_path = self._column_paths
+        if index_path is None and metadata_path is None and not os.path.exists(DEFAULT_COLUMN_FAISS_PATH):
+            # no column index built yet: CHESS runs on table-level hits
+            index_path, metadata_path = self.table_index_path, self.table_metadata_path
+        self.column_index_path = index_path or DEFAULT_COLUMN_FAISS_PATH
+        self.column_metadata_path = metadata_path or DEFAULT_COLUMN_METADATA_PATH
+
+    # ---- indexes ----
+
+    @property
+    def table_index(self) -> Tuple[object, Dict[int, dict]]:
+        """(faiss index, {vector_id: metadata}) for table-level retrieval."""
+        if self._table_index is None:
+            with self._lock:
+                if self._table_index is None:
+                    self._table_index = load_index_and_metadata(
+                        self.table_index_path, self.table_metadata_path
+                    )
+        return self._table_index
+
+    @property
+    def column_index(self) -> Tuple[object, Dict[int, dict]]:
+        """(faiss index, {vector_id: metadata}) for CHESS column filtering."""
+        if self._column_index is None:
+            with self._lock:
+                if self._column_index is None:
+                    same_files = (
+                        self.column_index_path == self.table_index_path
+                        and self.column_metadata_path == self.table_metadata_path
+                    )
+                    self._column_index = (
+                        self.table_index
+                        if same_files
+                        else load_index_and_metadata(self.column_index_path, self.column_metadata_path)
+                    )
+        return self._column_index
+
+    @property
+    def table_lexical(self):
+        """BM25 index over the table-level metadata (built in-process on first use)."""
+        if self._table_lexical is None:
+            with self._lock:
+                if self._table_lexical is None:
+                    from lexical_index import BM25Index
+
+                    self._table_lexical = BM25Index(self.table_index[1])
+        return self._table_lexical
+
+    @property
+    def column_lexical(self):
+        """BM25 index over the metadata of the CHESS column index."""
+        if self._column_lexical is None:
+            with self._lock:
+                if self._column_lexical is None:
+                    from lexical_index import BM25Index
+
+                    self._column_lexical = (
+                        self.table_lexical
+                        if self.column_index is self.table_index
+                        else BM25Index(self.column_index[1])
+                    )
+        return self._column_lexical
+
+    @property
+    def schema_catalog(self):
+        """
+        Compiled SchemaCatalog, loaded from SCHEMA_CATALOG_PATH or built from
+        SCHEMA_CSV_PATH, with the row counts and indexes of TABLE_STATS_PATH
+        when that file exists.
+        """
+        if self._schema_catalog is None:
+            with self._lock:
+                if self._schema_catalog is None:
+                    from schema_catalog import load_or_build_catalog, load_table_stats
+
+                    catalog = load_or_build_catalog(self.schema_catalog_path, self.schema_csv_path)
+                    if os.path.exists(self.table_stats_path):
+                        catalog = catalog.with_stats(load_table_stats(self.table_stats_path))
+                    self._schema_catalog = catalog
+        return self._schema_catalog
+
+    @property
+    def index_fingerprint(self) -> str:
+        """
+        Hash identifying the current schema index build (metadata contents plus
+        index and manifest file size/mtime). The files are re-stat'ed on every
+        call, so a rebuild by another process changes it too; the hash itself
+        is only recomputed when the stats change.
+        """
+        from index_factory import manifest_path
+
+        paths = [self.table_index_path, self.table_metadata_path]
+        paths += [self.column_index_path, self.column_metadata_path]
+        paths += [manifest_path(self.table_index_path), manifest_path(self.column_index_path)]
+        paths = list(dict.fromkeys(paths))  # dedupe, keep order
+        signature = []
+        for path in paths:
+            try:
+                st = os.stat(path)
+                signature.append((path, st.st_size, st.st_mtime_ns))
+            except OSError:
+                signature.append((path, None, None))
+        signature = tuple(signature)
+
+        cached = self._index_fingerprint
+        if cached is not None and cached[0] == signature:
+            return cached[1]
+        with self._lock:
+            h = hashlib.sha256()
+            for path, size, mtime_ns in signature:
+                if size is None:
+                    h.update(f"{path}:missing".encode())
+                    continue
+                h.update(f"{path}:{size}:{mtime_ns}".encode())
+                if path.endswith(".json"):
+                    try:
+                        with open(path, "rb") as f:
+                            h.update(f.read())
+                    except OSError:
+                        pass
+            fingerprint = h.hexdigest()
+            self._index_fingerprint = (signature, fingerprint)
+        return fingerprint
+
+    # ---- clients ----
+
+    @property
+    def embeddings_client(self):
+        if self._embeddings_client is None:
+            with self._lock:
+                if self._embeddings_client is None:
+                    self._embeddings_client = self._create_embeddings_client()
+        return self._embeddings_client
+
+    def _create_embeddings_client(self):
+        endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+        api_key = os.getenv("AZURE_OPENAI_API_KEY")
+
+        required_vars = {
+            "AZURE_OPENAI_ENDPOINT": endpoint,
+            "AZURE_OPENAI_API_KEY": api_key,
+            "AZURE_OPENAI_MODEL_NAME": self.embedding_model,
+        }
+        missing_vars = [var for var, value in required_vars.items() if not value]
+        if missing_vars:
+            raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
+
+        from azure.ai.inference import EmbeddingsClient
+        from azure.core.credentials import AzureKeyCredential
+
+        # Retries are handled by embedding_pipeline (each batch backs off on its own,
+        # honouring Retry-After), so the SDK's own retry policy is turned off to
+        # avoid multiplying attempts.
+        return EmbeddingsClient(
+            endpoint=endpoint,
+            credential=AzureKeyCredential(api_key),
+            retry_total=0,
+        )
+
+    # ---- lifecycle ----
+
+    def warm(self, clients: bool = False) -> "RetrievalContext":
+        """Eagerly load the indexes (and optionally clients), e.g. before forking."""
+        _ = self.table_index
+        _ = self.column_index
+        _ = self.table_lexical
+        _ = self.column_lexical
+        if clients:
+            _ = self.embeddings_client
+        return self
+
+    def reset_clients(self) -> None:
+        """Drop network clients; they are recreated on next use."""
+        self._embeddings_client = None
+
+    def reset(self) -> None:
+        """Drop everything, e.g. after the index files were rebuilt."""
+        with self._lock:
+            self._resolve_column_paths()
+            self._table_index = None
+            self._column_index = None
+            self._schema_catalog = None
+            self._table_lexical = None
+            self._column_lexical = None
+            self._index_fingerprint = None
+            self._embeddings_client = None
+
+
+# ========= SHARED INSTANCE =========
+
+_context: Optional[RetrievalContext] = None
+_context_lock = threading.Lock()
+
+
+def get_retrieval_context() -> RetrievalContext:
+    global _context
+    if _context is None:
+        with _context_lock:
+            if _context is None:
+                _context = RetrievalContext()
+    return _context
+
+
+def set_retrieval_context(context: Optional[RetrievalContext]) -> None:
+    """Swap the shared context (e.g. different index paths); None resets to env defaults."""
+    global _context
+    with _context_lock:
+        _context = context
+
+
+def _after_fork_in_child() -> None:
+    # Indexes loaded before the fork are inherited copy-on-write, but HTTP
+    # connections and locks must not be shared with the parent.
+    global _context_lock
+    _context_lock = threading.Lock()
+    if _context is not None:
+        _context._lock = threading.RLock()
+        _context.reset_clients()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,337 @@
+"""
+Compiled schema catalog.
+
+An immutable, hash-indexed view of the database schema built once from the
+schema export (see preprocess.load_schema_csv):
+- schema.table lookups, plus bare table-name aliases ("t_billed" -> "dbo.t_billed")
+- table.column lookups with type, nullability and PK/FK flags
+- foreign-key edges between tables
+- optional table statistics (row counts, indexes) from a local stats file,
+  used by cost_estimator
+
+The catalog can be saved to a compact file (zlib-compressed JSON rows, no
+pickle, so a replaced file cannot run code) and loaded back in a few
+milliseconds, so validation does not have to re-derive the schema from
+prompt text on every call.
+"""
+
+import hashlib
+import json
+import os
+import re
+import zlib
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
+
+CATALOG_MAGIC = b"SQLCAT"
+CATALOG_VERSION = 2  # 1 = pickled rows; never read back, rebuilt from the schema export
+
+# (schema, table, column, data_type, is_nullable, is_pk, is_fk, ref_schema, ref_table, ref_column)
+ColumnRow = tuple
+
+
+def normalize_identifier(name: str) -> str:
+    """Strip [brackets] / "quotes" / `backticks` and lowercase one identifier part."""
+    name = name.strip()
+    if len(name) >= 2 and name[0] in '["`' and name[-1] in ']"`':
+        name = name[1:-1]
+    return name.lower()
+
+
+def split_qualified_name(name: str) -> list[str]:
+    """'[dbo].[t_billed]' -> ['dbo', 't_billed'] (bracket-aware split on dots)."""
+    parts = re.findall(r'\[[^\]]*\]|"[^"]*"|`[^`]*`|[^.]+', name.strip())
+    return [normalize_identifier(p) for p in parts]
+
+
+@dataclass(frozen=True)
+class ColumnInfo:
+    name: str
+    data_type: str
+    is_nullable: bool
+    is_primary_key: bool
+    is_foreign_key: bool
+    references: Optional[tuple[str, str]] = None  # (schema.table, column)
+
+
+@dataclass(frozen=True)
+class TableInfo:
+    schema: str
+    name: str
+    columns: tuple[ColumnInfo, ...]
+    column_lookup: Mapping[str, ColumnInfo]
+
+    @property
+    def id(self) -> str:
+        return f"{self.schema}.{self.name}"
+
+    @property
+    def primary_key(self) -> tuple[str, ...]:
+        return tuple(c.name for c in self.columns if c.is_primary_key)
+
+    def column(self, name: str) -> Optional[ColumnInfo]:
+        return self.column_lookup.get(normalize_identifier(name))
+
+
+@dataclass(frozen=True)
+class IndexInfo:
+    name: str
+    columns: tuple[str, ...]  # key columns, in index order
+    unique: bool = False
+    clustered: bool = False
+
+
+@dataclass(frozen=True)
+class TableStats:
+    rows: int
+    indexes: tuple[IndexInfo, ...] = ()
+
+    @property
+    def indexed_columns(self) -> list[str]:
+        return list(dict.fromkeys(ix.columns[0] for ix in self.indexes if ix.columns))
+
+
+@dataclass(frozen=True)
+class ForeignKey:
+    table: str
+    column: str
+    ref_table: str
+    ref_column: str
+
+
+class SchemaCatalog:
+    """
+    Immutable catalog. Table ids are "schema.table" in their original case;
+    every lookup is case-insensitive and O(1).
+    """
+
+    def __init__(self, rows: Iterable[ColumnRow], stats: Optional[Mapping[str, TableStats]] = None):
+        self._rows: tuple[ColumnRow, ...] = tuple(rows)
+
+        columns_by_table: dict[tuple[str, str], list[ColumnInfo]] = {}
+        fks: list[ForeignKey] = []
+        for schema, table, column, dtype, nullable, is_pk, is_fk, ref_schema, ref_table, ref_column in self._rows:
+            references = None
+            if is_fk and ref_table and ref_column:
+                references = (f"{ref_schema or schema}.{ref_table}", ref_column)
+                fks.append(ForeignKey(f"{schema}.{table}", column, references[0], ref_column))
+            columns_by_table.setdefault((schema, table), []).append(
+                ColumnInfo(column, dtype, nullable, is_pk, is_fk, references)
+            )
+
+        tables: dict[str, TableInfo] = {}
+        aliases: dict[str, list[str]] = {}
+        for (schema, table), cols in columns_by_table.items():
+            info = TableInfo(
+                schema=schema,
+                name=table,
+                columns=tuple(cols),
+                column_lookup=MappingProxyType({c.name.lower(): c for c in cols}),
+            )
+            tables[info.id.lower()] = info
+            aliases.setdefault(table.lower(), []).append(info.id)
+
+        self._tables: Mapping[str, TableInfo] = MappingProxyType(tables)
+        self._aliases: Mapping[str, tuple[str, ...]] = MappingProxyType(
+            {k: tuple(v) for k, v in aliases.items()}
+        )
+        self.foreign_keys: tuple[ForeignKey, ...] = tuple(fks)
+
+        fks_by_table: dict[str, list[ForeignKey]] = {}
+        for fk in fks:
+            fks_by_table.setdefault(fk.table.lower(), []).append(fk)
+            if fk.ref_table.lower() != fk.table.lower():
+                fks_by_table.setdefault(fk.ref_table.lower(), []).append(fk)
+        self._fks_by_table: Mapping[str, tuple[ForeignKey, ...]] = MappingProxyType(
+            {k: tuple(v) for k, v in fks_by_table.items()}
+        )
+
+        resolved_stats = {}
+        for name, table_stats in (stats or {}).items():
+            info = self.resolve_table(name)
+            if info is not None:
+                resolved_stats[info.id.lower()] = table_stats
+        self._stats: Mapping[str, TableStats] = MappingProxyType(resolved_stats)
+
+    # ---- construction ----
+
+    @classmethod
+    def from_dataframe(cls, df) -> "SchemaCatalog":
+        """Build from a schema DataFrame as returned by preprocess.load_schema_csv."""
+
+        def col(name, default=None):
+            return df[name].tolist() if name in df.columns else [default] * len(df)
+
+        def text(value) -> Optional[str]:
+            return None if value is None or value != value else str(value)  # NaN-safe
+
+        def flag(value) -> bool:
+            return text(value) is not None and int(float(value)) == 1
+
+        rows = [
+            (
+                str(schema),
+                str(table),
+                str(column),
+                str(dtype),
+                str(nullable).upper() != "NO",
+                flag(is_pk),
+                flag(is_fk),
+                text(ref_schema),
+                text(ref_table),
+                text(ref_column),
+            )
+            for schema, table, column, dtype, nullable, is_pk, is_fk, ref_schema, ref_table, ref_column in zip(
+                col("table_schema"),
+                col("table_name"),
+                col("column_name"),
+                col("data_type"),
+                col("is_nullable", "YES"),
+                col("is_primary_key", 0),
+                col("is_foreign_key", 0),
+                col("referenced_schema"),
+                col("referenced_table"),
+                col("referenced_column"),
+            )
+            if text(schema) and text(table) and text(column)
+        ]
+        return cls(rows)
+
+    @classmethod
+    def from_schema_file(cls, path: str) -> "SchemaCatalog":
+        from preprocess import load_schema_csv
+
+        return cls.from_dataframe(load_schema_csv(path))
+
+    def with_stats(self, stats: Mapping[str, TableStats]) -> "SchemaCatalog":
+        """A copy of this catalog with table statistics (keys: any name resolve_table accepts)."""
+        return SchemaCatalog(self._rows, stats)
+
+    # ---- persistence ----
+
+    def save(self, path: str) -> None:
+        payload = zlib.compress(json.dumps(self._rows, ensure_ascii=False).encode("utf-8"), 6)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(CATALOG_MAGIC + bytes([CATALOG_VERSION]) + payload)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "SchemaCatalog":
+        with open(path, "rb") as f:
+            data = f.read()
+        header = CATALOG_MAGIC + bytes([CATALOG_VERSION])
+        if not data.startswith(header):
+            raise ValueError(f"'{path}' is not a schema catalog (or was written by another version)")
+        rows = json.loads(zlib.decompress(data[len(header):]).decode("utf-8"))
+        if not isinstance(rows, list) or not all(isinstance(r, list) and len(r) == 10 for r in rows):
+            raise ValueError(f"'{path}' does not hold schema catalog rows")
+        return cls(tuple(r) for r in rows)
+
+    # ---- lookups ----
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __contains__(self, table_id: str) -> bool:
+        return self.resolve_table(table_id) is not None
+
+    @property
+    def tables(self) -> Mapping[str, TableInfo]:
+        return self._tables
+
+    def resolve_table(self, name: str, default_schema: str = "dbo") -> Optional[TableInfo]:
+        """
+        Resolve 'dbo.t_billed', '[dbo].[t_billed]', 'db.dbo.t_billed' or bare 't_billed'.
+        Bare names resolve through the alias map; ambiguous bare names fall back
+        to `default_schema`.
+        """
+        parts = split_qualified_name(name)
+        if not parts:
+            return None
+        if len(parts) >= 2:
+            return self._tables.get(f"{parts[-2]}.{parts[-1]}")
+        candidates = self._aliases.get(parts[0], ())
+        if len(candidates) == 1:
+            return self._tables[candidates[0].lower()]
+        return self._tables.get(f"{default_schema}.{parts[0]}")
+
+    def get_column(self, table: str, column: str) -> Optional[ColumnInfo]:
+        info = self.resolve_table(table)
+        return info.column(column) if info else None
+
+    def has_column(self, table: str, column: str) -> bool:
+        return self.get_column(table, column) is not None
+
+    def foreign_keys_of(self, table: str) -> tuple[ForeignKey, ...]:
+        """FK edges where `table` is either side."""
+        info = self.resolve_table(table)
+        if info is None:
+            return ()
+        return self._fks_by_table.get(info.id.lower(), ())
+
+    @property
+    def has_stats(self) -> bool:
+        return bool(self._stats)
+
+    def stats_of(self, table: str) -> Optional[TableStats]:
+        info = self.resolve_table(table)
+        return self._stats.get(info.id.lower()) if info else None
+
+    def fingerprint(self) -> str:
+        return hashlib.sha256(json.dumps(self._rows, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def tables_in_schema_text(schema_text: str) -> set[str]:
+    """
+    Table ids named in a retrieved schema block ("Table dbo.x:" / "Table dbo.x. ...").
+    One regex pass over the header lines; used to know which tables the LLM was shown.
+    """
+    return set(re.findall(r"^\s*Table (\S+?)[:.]?(?:\s|$)", schema_text, flags=re.MULTILINE))
+
+
+def load_or_build_catalog(catalog_path: str, schema_path: str) -> SchemaCatalog:
+    """
+    Load the compiled catalog, rebuilding (and saving) it when it is missing
+    or older than the schema export.
+    """
+    if os.path.exists(catalog_path) and (
+        not os.path.exists(schema_path) or os.path.getmtime(catalog_path) >= os.path.getmtime(schema_path)
+    ):
+        try:
+            return SchemaCatalog.load(catalog_path)
+        except (ValueError, zlib.error):
+            pass  # stale / foreign format: rebuild below
+
+    catalog = SchemaCatalog.from_schema_file(schema_path)
+    try:
+        catalog.save(catalog_path)
+    except OSError:
+        pass  # read-only deployments still get an in-memory catalog
+    return catalog
+
+
+def load_table_stats(path: str) -> dict[str, TableStats]:
+    """
+    Read a table stats file:
+
+        {"tables": {"dbo.t_billed": {"rows": 180000000,
+                                     "indexes": [{"name": "pk_t_billed", "columns": ["billed_id"],
+                                                  "unique": true, "clustered": true}]}}}
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    stats = {}
+    for name, entry in (data.get("tables") or {}).items():
+        indexes = tuple(
+            IndexInfo(
+                name=ix.get("name", ""),
+                columns=tuple(ix.get("columns") or ()),
+                unique=bool(ix.get("unique")),
+                clustered=bool(ix.get("clustered")),
+            )
+            for ix in entry.get("indexes") or ()
+        )
+        stats[name] = TableStats(rows=int(entry.get("rows") or 0), indexes=indexes)
+    return stats
@@ -0,0 +1,256 @@
+"""
+Token-budgeted schema packing for the SQL prompt.
+
+Takes the scored column hits from CHESS column filtering and packs the
+best tables and columns into a fixed token budget, instead of capping
+each table by characters:
+
+1. Tables are considered in order of their best hit score. A table is only
+   included if its header plus its join columns (PK / FK, from the schema
+   catalog) fit, so every included table can actually be joined.
+2. With a join graph, the tables that bridge the included ones (see
+   join_paths) are added next, with the join conditions that connect them.
+3. The remaining budget is filled greedily with the highest-scoring hit
+   columns of the included tables.
+
+The tokenizer is tiktoken when installed (SCHEMA_TOKENIZER picks the
+encoding) and the chars/4 estimate otherwise. The budget comes from
+SCHEMA_TOKEN_BUDGET, or is derived from the model's character_limit (as
+listed by settingup_matcha.list_llms) via LLM_CHARACTER_LIMIT.
+"""
+
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+
+from embedding_pipeline import CHARS_PER_TOKEN, estimate_tokens
+from join_paths import render_join_paths
+
+Tokenizer = Callable[[str], int]
+
+DEFAULT_SCHEMA_TOKEN_BUDGET = 3000
+# Characters reserved for the instructions, examples and question around the schema
+DEFAULT_PROMPT_OVERHEAD_CHARS = 14000
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(encoding: Optional[str] = None) -> Tokenizer:
+    """Token counter for `encoding` (default SCHEMA_TOKENIZER or cl100k_base); chars/4 without tiktoken."""
+    encoding = encoding or os.getenv("SCHEMA_TOKENIZER") or "cl100k_base"
+    try:
+        import tiktoken
+
+        enc = tiktoken.get_encoding(encoding)
+    except Exception:  # not installed, unknown encoding or no network to fetch it
+        return estimate_tokens
+    return lambda text: len(enc.encode(text, disallowed_special=()))
+
+
+def budget_from_character_limit(
+    character_limit: int,
+    prompt_overhead_chars: int = DEFAULT_PROMPT_OVERHEAD_CHARS,
+    chars_per_token: int = CHARS_PER_TOKEN,
+) -> int:
+    """Schema token budget that keeps the whole prompt under a model's character_limit."""
+    return max(0, (int(character_limit) - prompt_overhead_chars) // chars_per_token)
+
+
+def default_token_budget() -> int:
+    """SCHEMA_TOKEN_BUDGET, else derived from LLM_CHARACTER_LIMIT, else DEFAULT_SCHEMA_TOKEN_BUDGET."""
+    if os.getenv("SCHEMA_TOKEN_BUDGET"):
+        return int(os.getenv("SCHEMA_TOKEN_BUDGET"))
+    if os.getenv("LLM_CHARACTER_LIMIT"):
+        return budget_from_character_limit(int(os.getenv("LLM_CHARACTER_LIMIT")))
+    return DEFAULT_SCHEMA_TOKEN_BUDGET
+
+
+@dataclass
+class PackedSchema:
+    text: str
+    tokens: int
+    budget: int
+    sections: Dict[str, int] = field(default_factory=dict)  # table id -> tokens of its block
+    tables: List[str] = field(default_factory=list)
+    dropped_tables: List[str] = field(default_factory=list)
+    columns: int = 0
+
+    def summary(self) -> str:
+        per_table = ", ".join(f"{tid}={n}" for tid, n in self.sections.items())
+        dropped = f", {len(self.dropped_tables)} tables dropped" if self.dropped_tables else ""
+        return (
+            f"{self.tokens}/{self.budget} tokens, {len(self.tables)} tables, "
+            f"{self.columns} columns{dropped} ({per_table})"
+        )
+
+
+@dataclass
+class _TableBlock:
+    tid: str
+    score: float
+    legacy_text: Optional[str] = None  # whole-table hit from a table-level index
+    columns: Dict[str, str] = field(default_factory=dict)  # column name (lower) -> line
+    fks: List[str] = field(default_factory=list)
+    order: Dict[str, int] = field(default_factory=dict)  # catalog column position
+    hit_columns: int = 0  # columns added from hits (join columns not counted)
+
+    def render(self) -> str:
+        if self.legacy_text is not None:
+            return f"Table {self.tid}:\n{self.legacy_text}"
+        names = sorted(self.columns, key=lambda n: self.order.get(n, len(self.order)))
+        lines = [f"Table {self.tid}:", "Columns:"] + [f"- {self.columns[n]}" for n in names]
+        if self.fks:
+            lines.append("Foreign keys:")
+            lines.extend(f"- {fk}" for fk in self.fks)
+        return "\n".join(lines)
+
+
+def catalog_column_line(col) -> str:
+    # same shape as preprocess.render_column_lines, without length details
+    flags = (" [PK]" if col.is_primary_key else "") + (" [FK]" if col.is_foreign_key else "")
+    return f"{col.name} ({col.data_type} ){flags}{' NULL' if col.is_nullable else ' NOT NULL'}"
+
+
+def catalog_fk_line(col) -> Optional[str]:
+    if not col.references:
+        return None
+    ref_table, ref_column = col.references
+    return f"{col.name} references {ref_table}({ref_column})"
+
+
+def _key_column_block(tid: str, score: float, catalog) -> _TableBlock:
+    """Block holding only a table's PK / FK columns (empty without a catalog)."""
+    block = _TableBlock(tid, score)
+    info = catalog.resolve_table(tid) if catalog is not None else None
+    if info is not None:
+        block.order = {c.name.lower(): i for i, c in enumerate(info.columns)}
+        for col in info.columns:
+            if col.is_primary_key or col.is_foreign_key:
+                block.columns[col.name.lower()] = catalog_column_line(col)
+                fk = catalog_fk_line(col)
+                if fk:
+                    block.fks.append(fk)
+    return block
+
+
+def pack_schema(
+    hits: List[Dict],
+    budget_tokens: int,
+    catalog=None,
+    tokenizer: Optional[Tokenizer] = None,
+    max_tables: Optional[int] = None,
+    max_cols_per_table: Optional[int] = None,
+    join_graph=None,
+) -> PackedSchema:
+    """
+    Pack column hits (dicts with score, table_schema, table_name and either
+    `line` / `fks` from the column-level index or the whole-table `text`)
+    into at most `budget_tokens` tokens.
+
+    Args:
+        hits: Column filtering results, any order
+        budget_tokens: Global token budget for the schema section
+        catalog: SchemaCatalog used to add PK / FK join columns; optional
+        tokenizer: Token counter (default get_tokenizer())
+        max_tables / max_cols_per_table: Optional hard caps on top of the budget
+        join_graph: JoinGraph used to add bridge tables between the selected
+            ones (not counted against max_tables) and a "Join paths:" section
+    """
+    count = tokenizer or get_tokenizer()
+    ranked = sorted(hits, key=lambda h: h["score"], reverse=True)
+
+    # best score per table, in ranking order
+    table_scores: Dict[str, float] = {}
+    for h in ranked:
+        table_scores.setdefault(f"{h['table_schema']}.{h['table_name']}", h["score"])
+
+    used = 0
+    blocks: Dict[str, _TableBlock] = {}
+    dropped: List[str] = []
+
+    # 1) tables with their join columns
+    for tid, score in table_scores.items():
+        if max_tables is not None and len(blocks) >= max_tables:
+            dropped.append(tid)
+            continue
+        legacy = next((h for h in ranked if h.get("line") is None and h["id"] == tid), None)
+        if legacy is not None:
+            block = _TableBlock(tid, score, legacy_text=legacy["text"])
+        else:
+            block = _key_column_block(tid, score, catalog)
+
+        cost = count(block.render()) + 1  # blank line between tables
+        if used + cost > budget_tokens:
+            dropped.append(tid)
+            continue
+        blocks[tid] = block
+        used += cost
+
+    # 2) bridge tables that connect the selected ones over the FK graph, if they fit
+    join_edges = []
+    if join_graph is not None and len(blocks) > 1:
+        plan = join_graph.connect(list(blocks))
+        for bridge in plan.bridges:
+            block = _key_column_block(bridge, 0.0, catalog)
+            cost = count(block.render()) + 1
+            if used + cost <= budget_tokens:
+                blocks[bridge] = block
+                used += cost
+        for edge in plan.edges:
+            ends = [(edge.table, edge.column), (edge.ref_table, edge.ref_column)]
+            if not all(tid in blocks for tid, _ in ends):
+                continue
+            # inferred joins can use columns that are not flagged PK / FK
+            additions = []
+            for tid, col in ends:
+                block = blocks[tid]
+                info = catalog.get_column(tid, col)
+                if block.legacy_text is None and info is not None and col.lower() not in block.columns:
+                    additions.append((block, col.lower(), catalog_column_line(info)))
+            cost = count(f"- {edge.condition()}") + sum(count(f"- {line}") for _, _, line in additions) + 1
+            if not join_edges:
+                cost += count("Join paths:") + 1
+            if used + cost > budget_tokens:
+                continue
+            for block, name, line in additions:
+                block.columns[name] = line
+            join_edges.append(edge)
+            used += cost
+
+    # 3) fill with the best remaining hit columns
+    for h in ranked:
+        block = blocks.get(f"{h['table_schema']}.{h['table_name']}")
+        if block is None or block.legacy_text is not None or h.get("line") is None:
+            continue
+        name = h["column_name"].lower()
+        if name in block.columns:
+            # join column already present: prefer the full rendered line if it fits
+            delta = count(f"- {h['line']}") - count(f"- {block.columns[name]}")
+            if used + delta <= budget_tokens:
+                block.columns[name] = h["line"]
+                used += delta
+            continue
+        if max_cols_per_table is not None and block.hit_columns >= max_cols_per_table:
+            continue
+        new_fks = [fk for fk in h.get("fks") or [] if fk not in block.fks]
+        cost = count(f"- {h['line']}") + sum(count(f"- {fk}") for fk in new_fks) + 1
+        if used + cost > budget_tokens:
+            continue
+        block.columns[name] = h["line"]
+        block.fks.extend(new_fks)
+        block.hit_columns += 1
+        used += cost
+
+    rendered = {tid: block.render() for tid, block in blocks.items()}
+    text = "\n\n".join(rendered.values())
+    if join_edges:
+        text += "\n\n" + render_join_paths(join_edges)
+    return PackedSchema(
+        text=text,
+        tokens=count(text) if text else 0,
+        budget=budget_tokens,
+        sections={tid: count(block_text) for tid, block_text in rendered.items()},
+        tables=list(blocks),
+        dropped_tables=dropped,
+        columns=sum(len(b.columns) for b in blocks.values()),
+    )
@@ -1,38 +1,17 @@
 import os
-import requests
-import json
 from dotenv import load_dotenv
 
+from matcha_client import get_matcha_client
+
 # Load environment variables
 load_dotenv()
 
-# Configuration from environment variables
-BASE_URL = os.getenv("MATCHA_BASE_URL")
-API_KEY = os.getenv("MATCHA_API_KEY")
-MISSION_ID_STR = os.getenv("MATCHA_MISSION_ID")
-
-# Validate required environment variables
-required_vars = {
-    "MATCHA_BASE_URL": BASE_URL,
-    "MATCHA_API_KEY": API_KEY,
-    "MATCHA_MISSION_ID": MISSION_ID_STR,
-}
-
-missing_vars = [var for var, value in required_vars.items() if not value]
-if missing_vars:
-    raise RuntimeError(f"Required environment variables are missing: {', '.join(missing_vars)}. Please set them in your .env file.")
-
-MISSION_ID = int(MISSION_ID_STR)
+LLMS_PATH = "/llms?select=id,list_header,name,character_limit"
 
-headers = {
-    "Content-Type": "application/json",
-    "Accept": "application/json",
-    "MATCHA-API-KEY": API_KEY,
-}
 
 def test_api_key():
-    url = f"{BASE_URL}/llms?select=id,list_header,name,character_limit"
-    resp = requests.get(url, headers=headers, timeout=10)
+    client = get_matcha_client()
+    resp = client.session.get(f"{client.base_url}{LLMS_PATH}", timeout=10)
 
     print("Status:", resp.status_code)
     print("Body:", resp.text)
@@ -45,9 +24,7 @@ def test_api_key():
         print("⚠️ Unexpected error – see body above.")
 
 def list_llms():
-    url = f"{BASE_URL}/llms?select=id,list_header,name,character_limit"
-    resp = requests.get(url, headers=headers, timeout=10)
-    resp.raise_for_status()
+    resp = get_matcha_client().get(LLMS_PATH, timeout=10)
     llms = resp.json()
     print("Available LLMs:")
     for llm in llms:
@@ -58,22 +35,7 @@ def list_llms():
 
 
 def chat_once(prompt: str) -> str:
-    url = f"{BASE_URL}/completions"
-    payload = {
-        "mission_id": MISSION_ID,
-        "input": prompt,   # or use "messages" if you want full chat structure
-    }
-
-    resp = requests.post(url, headers=headers, data=json.dumps(payload), timeout=30)
-    resp.raise_for_status()
-    data = resp.json()
-
-    if data.get("status") != "success":
-        raise RuntimeError(f"Matcha error: {data.get('error')}")
-
-    # grab first text block
-    first_output = data["output"][0]["content"][0]["text"]
-    return first_output
+    return get_matcha_client().complete(prompt)
 
 
 # Azure OpenAI configuration from environment
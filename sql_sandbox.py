@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+"""
+Local SQL execution sandbox.
+
+The schema catalog is materialized as empty tables in an in-memory SQLite
+database, with one ATTACHed database per SQL Server schema, so both
+`dbo.t_billed` and bare `t_billed` resolve. A generated T-SQL query is
+transpiled to SQLite with sqlglot and then compiled with EXPLAIN QUERY PLAN
+against those tables. Nothing runs and no data exists, so the check takes
+milliseconds and never touches the warehouse.
+
+The plan is then inspected for join shapes that are cheap to write and
+ruinous to run:
+- missing_join_predicate: a base table is fully scanned inside the join
+  loop and no predicate links it to the rest of the query (an accidental
+  cartesian product: a comma join, ON 1=1, a forgotten ON clause)
+- cross_join: the same for an explicit CROSS JOIN
+- non_equi_join_scan (warning): a base table is fully scanned per outer
+  row because its join predicate cannot use an index (OR, functions,
+  inequalities)
+
+Statements other than a read-only SELECT (INSERT ... SELECT, SELECT ...
+INTO, UPDATE, DELETE) are rejected before EXPLAIN, which would compile
+them without complaint.
+
+SQLite errors that point at the query (unknown table or column, ambiguous
+column, wrong number of UNION columns, aggregate misuse) are reported as
+errors. Errors caused by dialect gaps, such as T-SQL functions SQLite lacks
+or constructs sqlglot cannot transpile, are warnings, because they say
+nothing about the query itself.
+
+Environment:
+- SQL_SANDBOX: 1 to run the sandbox after parser validation (default), 0 to skip
+
+    python3 sql_sandbox.py "SELECT TOP 10 * FROM t_billed b, t_customer c"
+"""
+
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from dotenv import load_dotenv
+
+from sql_validation import SQLGLOT_AVAILABLE, ValidationIssue, read_only_violation
+from tracing import span
+
+if SQLGLOT_AVAILABLE:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ErrorLevel, SqlglotError
+
+load_dotenv()
+
+# sqlite messages that are about the query, not about the dialect translation
+_QUERY_ERRORS = (
+    "no such table",
+    "no such column",
+    "ambiguous column name",
+    "do not have the same number of result columns",
+    "misuse of aggregate",
+    "aggregate functions are not allowed",
+    "sub-select returns",
+    "row value misused",
+)
+_SCAN = re.compile(r"^SCAN (\w+)(?: USING |$)")
+
+
+@dataclass
+class PlanStep:
+    id: int
+    parent: int
+    detail: str
+
+
+@dataclass
+class SandboxResult:
+    issues: list[ValidationIssue] = field(default_factory=list)
+    plan: list[PlanStep] = field(default_factory=list)
+    sqlite_sql: Optional[str] = None
+    elapsed_ms: float = 0.0
+
+    @property
+    def errors(self) -> list[str]:
+        return [i.message for i in self.issues if i.severity == "error"]
+
+    @property
+    def warnings(self) -> list[str]:
+        return [i.message for i in self.issues if i.severity != "error"]
+
+
+def sandbox_enabled() -> bool:
+    return SQLGLOT_AVAILABLE and os.getenv("SQL_SANDBOX", "1").lower() not in ("0", "false", "no", "off")
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+class SQLSandbox:
+    """
+    Empty copy of `catalog` in SQLite. One shared connection guarded by a
+    lock; EXPLAIN only compiles, so callers barely contend for it.
+    """
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+        self._lock = threading.Lock()
+        started = time.perf_counter()
+        self._conn = sqlite3.connect(":memory:", check_same_thread=False)
+        schemas = sorted({info.schema for info in catalog.tables.values()})
+        for schema in schemas:
+            if schema.lower() != "main":
+                self._conn.execute(f"ATTACH DATABASE ':memory:' AS {_quote(schema)}")
+        ddl = []
+        for info in catalog.tables.values():
+            # the export repeats some columns (one row per FK constraint); SQLite names are case-insensitive
+            unique = {c.name.lower(): c for c in reversed(info.columns)}
+            columns = ", ".join(
+                f"{_quote(c.name)} {re.sub(r'[^A-Za-z0-9_ ]', '', c.data_type)}".rstrip() for c in reversed(unique.values())
+            )
+            ddl.append(f"CREATE TABLE {_quote(info.schema)}.{_quote(info.name)} ({columns});")
+        self._conn.executescript("\n".join(ddl))
+        self.build_ms = 1000 * (time.perf_counter() - started)
+
+    # ---- translation ----
+
+    def transpile(self, sql_query: str) -> "exp.Expression":
+        """Parse T-SQL and rewrite it for SQLite (three-part names lose the database part)."""
+        statements = [s for s in sqlglot.parse(sql_query, read="tsql") if s is not None]
+        if len(statements) != 1:
+            raise ValueError(f"expected one statement, found {len(statements)}")
+        tree = statements[0]
+        for table in tree.find_all(exp.Table):
+            if table.args.get("catalog") is not None:
+                table.set("catalog", None)
+        return tree
+
+    def explain(self, sqlite_sql: str) -> list[PlanStep]:
+        with self._lock:
+            rows = self._conn.execute(f"EXPLAIN QUERY PLAN {sqlite_sql}").fetchall()
+        return [PlanStep(row[0], row[1], row[3]) for row in rows]
+
+    # ---- plan inspection ----
+
+    @staticmethod
+    def _nested_scans(plan: list[PlanStep]) -> list[str]:
+        """Names fully scanned inside another table's loop (every SCAN after the first of a select)."""
+        nested, seen_parents = [], set()
+        for step in plan:
+            match = _SCAN.match(step.detail)
+            if not match or match.group(1) == "CONSTANT":
+                continue
+            if step.parent in seen_parents:
+                nested.append(match.group(1))
+            seen_parents.add(step.parent)
+        return nested
+
+    def _join_shape(self, tree: "exp.Expression", name: str) -> tuple[Optional[str], bool, bool]:
+        """
+        For the table aliased / named `name`: (table id, joined with CROSS JOIN?,
+        linked to another source by some predicate?). Table id is None when
+        `name` is not a base table (CTE, derived table).
+        """
+        for select in tree.find_all(exp.Select):
+            sources = {}
+            from_ = select.args.get("from")
+            for node in ([from_.this] if from_ else []) + [j.this for j in select.args.get("joins") or []]:
+                if isinstance(node, (exp.Table, exp.Subquery)):
+                    sources[(node.alias_or_name or "").lower()] = node
+            node = sources.get(name.lower())
+            if node is None:
+                continue
+            table_id = None
+            if isinstance(node, exp.Table) and not any(
+                cte.alias_or_name.lower() == node.name.lower() for cte in tree.find_all(exp.CTE)
+            ):
+                info = self.catalog.resolve_table(".".join(p for p in (node.db, node.name) if p))
+                table_id = info.id if info else node.name
+
+            cross = False
+            predicates = [select.args["where"].this] if select.args.get("where") else []
+            for join in select.args.get("joins") or []:
+                if join.this is node and (join.kind or "").upper() == "CROSS":
+                    cross = True
+                if join.args.get("on") is not None:
+                    predicates.append(join.args["on"])
+
+            linked = False
+            for predicate in predicates:
+                for comparison in predicate.find_all(exp.Binary):
+                    if isinstance(comparison, (exp.And, exp.Or)):
+                        continue
+                    qualifiers = {c.table.lower() for c in comparison.find_all(exp.Column)}
+                    if name.lower() in qualifiers and len(qualifiers) > 1:
+                        linked = True
+                    elif "" in qualifiers and len(qualifiers) > 1:
+                        linked = True  # unqualified column: can't tell which source, assume linked
+            return table_id, cross, linked
+        return None, False, True
+
+    # ---- driver ----
+
+    def check(self, sql_query: str) -> SandboxResult:
+        """Compile `sql_query` against the empty schema and inspect its plan."""
+        started = time.perf_counter()
+        result = SandboxResult()
+        try:
+            tree = self.transpile(sql_query)
+            result.sqlite_sql = tree.sql(dialect="sqlite", unsupported_level=ErrorLevel.IGNORE)
+        except (SqlglotError, ValueError) as e:
+            result.issues.append(
+                ValidationIssue("sandbox_skipped", f"Sandbox could not translate the query to SQLite: {e}", "warning")
+            )
+            result.elapsed_ms = 1000 * (time.perf_counter() - started)
+            return result
+
+        # EXPLAIN compiles INSERT / UPDATE / DELETE just as well; only read-only queries get a plan
+        violation = read_only_violation(tree)
+        if violation:
+            result.issues.append(ValidationIssue("not_select", violation))
+            result.elapsed_ms = 1000 * (time.perf_counter() - started)
+            return result
+
+        if any(t.name.startswith("#") for t in tree.find_all(exp.Table)):
+            result.elapsed_ms = 1000 * (time.perf_counter() - started)
+            return result  # temp tables only exist in the session that creates them
+
+        try:
+            result.plan = self.explain(result.sqlite_sql)
+        except sqlite3.Error as e:
+            message = str(e)
+            if any(marker in message for marker in _QUERY_ERRORS):
+                result.issues.append(ValidationIssue("sandbox_error", f"Query does not compile: {message}"))
+            else:
+                result.issues.append(
+                    ValidationIssue("sandbox_skipped", f"Sandbox could not compile the SQLite translation: {message}", "warning")
+                )
+            result.elapsed_ms = 1000 * (time.perf_counter() - started)
+            return result
+
+        for name in self._nested_scans(result.plan):
+            table_id, cross, linked = self._join_shape(tree, name)
+            if table_id is None:
+                continue  # CTE / derived table: often a one-row aggregate, cheap to cross with
+            if cross:
+                result.issues.append(
+                    ValidationIssue(
+                        "cross_join",
+                        f"CROSS JOIN with {table_id} ('{name}') produces a full cartesian product; "
+                        "join it on its key columns instead",
+                        table=table_id,
+                    )
+                )
+            elif not linked:
+                result.issues.append(
+                    ValidationIssue(
+                        "missing_join_predicate",
+                        f"No join predicate links {table_id} ('{name}') to the other tables, so every row is "
+                        "combined with every other row; add an ON condition on its key columns",
+                        table=table_id,
+                    )
+                )
+            else:
+                result.issues.append(
+                    ValidationIssue(
+                        "non_equi_join_scan",
+                        f"{table_id} ('{name}') is fully scanned for every outer row; its join condition "
+                        "cannot use an index (prefer an equality on key columns)",
+                        "warning",
+                        table=table_id,
+                    )
+                )
+        result.elapsed_ms = 1000 * (time.perf_counter() - started)
+        return result
+
+
+_sandboxes: dict[int, SQLSandbox] = {}
+_sandboxes_lock = threading.Lock()
+
+
+def get_sql_sandbox(catalog) -> SQLSandbox:
+    """Sandbox for `catalog`, materialized once per catalog instance."""
+    sandbox = _sandboxes.get(id(catalog))
+    if sandbox is None or sandbox.catalog is not catalog:
+        with _sandboxes_lock:
+            sandbox = _sandboxes.get(id(catalog))
+            if sandbox is None or sandbox.catalog is not catalog:
+                sandbox = _sandboxes[id(catalog)] = SQLSandbox(catalog)
+    return sandbox
+
+
+def apply_sandbox(validation_results: dict, sql_query: str, catalog) -> dict:
+    """
+    Run the sandbox on a query that passed parser validation and merge its
+    findings into `validation_results` (the validate_sql shape).
+    """
+    if not validation_results.get("is_valid") or not sandbox_enabled():
+        return validation_results
+    with span("sql.sandbox") as s:
+        result = get_sql_sandbox(catalog).check(sql_query)
+        s.set(errors=len(result.errors), warnings=len(result.warnings))
+    validation_results["errors"].extend(result.errors)
+    validation_results["warnings"].extend(result.warnings)
+    validation_results.setdefault("issues", []).extend(asdict(i) for i in result.issues)
+    validation_results["is_valid"] = not validation_results["errors"]
+    return validation_results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("query", help="T-SQL query (or @file)")
+    args = parser.parse_args()
+
+    query = args.query
+    if query.startswith("@"):
+        with open(query[1:], "r", encoding="utf-8") as f:
+            query = f.read()
+
+    from retrieval_context import get_retrieval_context
+
+    sandbox = get_sql_sandbox(get_retrieval_context().schema_catalog)
+    print(f"🧪 Materialized {len(sandbox.catalog)} empty tables in {sandbox.build_ms:.0f} ms")
+    result = sandbox.check(query)
+    if result.sqlite_sql:
+        print(f"\nSQLite:\n{result.sqlite_sql}")
+    if result.plan:
+        print("\nPlan:")
+        for step in result.plan:
+            print(f"  {step.detail}")
+    print()
+    for issue in result.issues:
+        print(f"{'❌' if issue.severity == 'error' else '⚠️'} [{issue.code}] {issue.message}")
+    if not result.issues:
+        print("✅ No issues")
+    print(f"\nChecked in {result.elapsed_ms:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
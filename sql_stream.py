@@ -0,0 +1,134 @@
+"""
+Streaming completions with early SQL extraction.
+
+Responses put the ```sql block first and then spend most of their tokens
+on "Business Logic Explanation" and "Assumptions". StreamingSQLExtractor
+watches the token stream for the closing fence of the first ```sql block,
+so the query can be validated (or returned) while the explanation is still
+being generated. StreamedCompletion consumes a provider stream on a
+background thread and exposes the SQL as soon as it is complete. The rest
+of the text keeps streaming in the background, or is cancelled, which
+closes the connection.
+"""
+
+import re
+import threading
+import time
+from typing import Iterator, Optional
+
+_OPEN_FENCE = re.compile(r"```sql[^\S\n]*\n?", re.IGNORECASE)
+_CLOSE_FENCE = "```"
+
+
+class StreamingSQLExtractor:
+    """Incremental ```sql block detector; fences may be split across chunks."""
+
+    def __init__(self):
+        self.text = ""
+        self.sql: Optional[str] = None
+        self._sql_start: Optional[int] = None
+        self._scan_from = 0
+
+    def feed(self, chunk: str) -> Optional[str]:
+        """Add a chunk; returns the SQL once, on the chunk that closes the block."""
+        if self.sql is not None:
+            self.text += chunk
+            return None
+        self.text += chunk
+        if self._sql_start is None:
+            match = _OPEN_FENCE.search(self.text, self._scan_from)
+            if match is None:
+                # a fence may still be completing at the end of the buffer
+                self._scan_from = max(0, len(self.text) - len("```sql "))
+                return None
+            self._sql_start = match.end()
+            self._scan_from = self._sql_start
+        end = self.text.find(_CLOSE_FENCE, self._scan_from)
+        if end == -1:
+            self._scan_from = max(self._sql_start, len(self.text) - len(_CLOSE_FENCE) + 1)
+            return None
+        self.sql = self.text[self._sql_start:end].strip()
+        return self.sql
+
+
+class StreamedCompletion:
+    """
+    Consumes `chunks` on a daemon thread.
+
+    Args:
+        chunks: Text chunks from a provider's stream()
+        cancel_after_sql: Stop reading (and close the stream) as soon as the
+            SQL block is complete, instead of collecting the explanation
+    """
+
+    def __init__(self, chunks: Iterator[str], cancel_after_sql: bool = False):
+        self.extractor = StreamingSQLExtractor()
+        self.cancel_after_sql = cancel_after_sql
+        self.started = time.perf_counter()
+        self.time_to_sql_s: Optional[float] = None
+        self.cancelled = False
+        self.error: Optional[BaseException] = None
+        self._cancel = threading.Event()
+        self._sql_ready = threading.Event()
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._consume, args=(chunks,), name="llm-stream", daemon=True)
+        self._thread.start()
+
+    def _consume(self, chunks: Iterator[str]) -> None:
+        try:
+            for chunk in chunks:
+                if self.extractor.feed(chunk) is not None:
+                    self.time_to_sql_s = time.perf_counter() - self.started
+                    self._sql_ready.set()
+                    if self.cancel_after_sql:
+                        self._cancel.set()
+                if self._cancel.is_set():
+                    self.cancelled = True
+                    break
+        except BaseException as e:
+            self.error = e
+        finally:
+            close = getattr(chunks, "close", None)
+            if close is not None:
+                close()  # drops the HTTP response when we stop early
+            with self._callbacks_lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            self._sql_ready.set()
+            if self.error is None:
+                for callback in callbacks:
+                    callback(self.text)
+
+    @property
+    def text(self) -> str:
+        """Text received so far (the full response once finished)."""
+        return self.extractor.text
+
+    def wait_sql(self, timeout: Optional[float] = None) -> Optional[str]:
+        """The ```sql block as soon as it is closed; None if the response has none."""
+        self._sql_ready.wait(timeout)
+        if self.extractor.sql is None and self.error is not None:
+            raise self.error
+        return self.extractor.sql
+
+    def wait_text(self, timeout: Optional[float] = None) -> str:
+        """The whole response (up to the cancellation point, if cancelled)."""
+        self._done.wait(timeout)
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    def add_done_callback(self, callback) -> None:
+        """Call `callback(full_text)` once the stream has finished (now, if it already has)."""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        if self.error is None:
+            callback(self.text)
+
+    def cancel(self) -> None:
+        """Stop consuming; the thread closes the stream after the current chunk."""
+        self._cancel.set()
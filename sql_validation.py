@@ -0,0 +1,348 @@
+"""
+Parser-based T-SQL validation against the compiled schema catalog.
+
+Queries are parsed with sqlglot's tsql dialect and walked scope by scope
+(main query, CTEs, derived tables, subqueries). Every table reference is
+resolved in the catalog, table aliases and CTE / derived-table names are
+tracked, and every column reference is checked against the table (or
+derived table) it belongs to. Problems come back as structured issues with
+suggestions, so a single targeted fix prompt can correct them.
+
+sqlglot is optional: when it is not installed, SQLGLOT_AVAILABLE is False
+and callers fall back to the regex validator in llm_to_query.
+"""
+
+import difflib
+from dataclasses import asdict, dataclass, field
+from typing import Iterable, Optional
+
+try:
+    import sqlglot
+    from sqlglot import exp
+    from sqlglot.errors import ParseError
+    from sqlglot.optimizer.scope import Scope, traverse_scope
+
+    SQLGLOT_AVAILABLE = True
+except ImportError:  # pragma: no cover - exercised only without sqlglot
+    SQLGLOT_AVAILABLE = False
+
+
+@dataclass
+class ValidationIssue:
+    # syntax_error | not_select | unknown_table | table_not_in_prompt | unknown_alias | unknown_column | ambiguous_column,
+    # from sql_sandbox: sandbox_error | cross_join | missing_join_predicate | non_equi_join_scan | sandbox_skipped,
+    # from cost_estimator: cost_over_budget | unfiltered_scan
+    code: str
+    message: str
+    severity: str = "error"
+    table: Optional[str] = None
+    column: Optional[str] = None
+    suggestions: list[str] = field(default_factory=list)
+
+
+def _suggest(name: str, candidates: Iterable[str], n: int = 3) -> list[str]:
+    lookup = {c.lower(): c for c in candidates}
+    return [lookup[m] for m in difflib.get_close_matches(name.lower(), list(lookup), n=n, cutoff=0.6)]
+
+
+def read_only_violation(statement: "exp.Expression") -> Optional[str]:
+    """
+    Why `statement` is not a plain read-only query, or None if it is. The top
+    level must be a SELECT or a set operation (CTEs hang off it), with no
+    SELECT ... INTO and no DML / DDL anywhere in the tree.
+    """
+    node = statement
+    while isinstance(node, exp.Subquery):
+        node = node.this
+    if not isinstance(node, (exp.Select, exp.SetOperation)):
+        return f"Only SELECT queries are allowed (found {statement.key.upper()})"
+    writes = (
+        exp.DML, exp.DDL, exp.Drop, exp.Alter, exp.TruncateTable, exp.Command,
+        exp.Execute, exp.Grant, exp.Set, exp.Use, exp.Declare,
+    )
+    for child in node.walk():
+        if isinstance(child, exp.Into):
+            return "SELECT ... INTO writes a table; only read-only SELECT queries are allowed"
+        if isinstance(child, writes):
+            return f"Only read-only SELECT queries are allowed (found {child.key.upper()})"
+    return None
+
+
+def _table_ref_name(table: "exp.Table") -> str:
+    return ".".join(p for p in (table.catalog, table.db, table.name) if p)
+
+
+class _Validator:
+    def __init__(self, catalog, allowed_tables: Optional[Iterable[str]]):
+        self.catalog = catalog
+        self.issues: list[ValidationIssue] = []
+        self.allowed: set[str] = set()
+        for tid in allowed_tables or ():
+            info = catalog.resolve_table(tid)
+            if info is not None:
+                self.allowed.add(info.id.lower())
+        self._reported: set[tuple] = set()
+
+    def add(self, issue: ValidationIssue) -> None:
+        key = (issue.code, (issue.table or "").lower(), (issue.column or "").lower())
+        if key not in self._reported:
+            self._reported.add(key)
+            self.issues.append(issue)
+
+    # ---- tables ----
+
+    def resolve_table(self, table: "exp.Table"):
+        name = _table_ref_name(table)
+        if table.name.startswith("#") or not table.name:
+            return None  # temp tables / table functions: not in the catalog by design
+        info = self.catalog.resolve_table(name)
+        if info is None:
+            suggestions = _suggest(table.name, (t.id for t in self.catalog.tables.values()))
+            self.add(
+                ValidationIssue(
+                    "unknown_table",
+                    f"Table '{name}' not found in schema catalog"
+                    + (f"; did you mean {', '.join(suggestions)}?" if suggestions else ""),
+                    table=name,
+                    suggestions=suggestions,
+                )
+            )
+        elif self.allowed and info.id.lower() not in self.allowed:
+            self.add(
+                ValidationIssue(
+                    "table_not_in_prompt",
+                    f"Table '{name}' not found in provided schema",
+                    table=info.id,
+                )
+            )
+        return info
+
+    # ---- columns ----
+
+    @staticmethod
+    def _scope_output_names(scope: "Scope") -> Optional[list[str]]:
+        """
+        Column names a derived table / CTE / APPLY exposes, in order; None when
+        unknown (SELECT *, table-valued functions).
+        """
+        node = scope.expression
+        parent = node.parent if isinstance(node.parent, (exp.Subquery, exp.CTE)) else node
+        alias = parent.args.get("alias")
+        if isinstance(alias, exp.TableAlias) and alias.columns:
+            return [c.name for c in alias.columns]  # (...) AS d(a, b) / WITH c(a, b) AS (...)
+        if isinstance(node, exp.Lateral):
+            # CROSS / OUTER APPLY (subquery) x: the columns of the applied query
+            node = node.this.unnest() if isinstance(node.this, exp.Subquery) else node.this
+            if not isinstance(node, (exp.Select, exp.SetOperation)):
+                return None
+        if isinstance(node, exp.Select) and any(isinstance(e, exp.Star) for e in node.expressions):
+            return None
+        if any(isinstance(e, exp.Column) and isinstance(e.this, exp.Star) for e in getattr(node, "expressions", [])):
+            return None
+        return list(node.named_selects)
+
+    def _scope_outputs(self, scope: "Scope") -> Optional[set[str]]:
+        names = self._scope_output_names(scope)
+        return None if names is None else {name.lower() for name in names}
+
+    def _source_has_column(self, source, column: str) -> Optional[bool]:
+        """True/False if we can tell, None when unknown (unresolved table, SELECT *)."""
+        if isinstance(source, exp.Table):
+            info = self.catalog.resolve_table(_table_ref_name(source))
+            return None if info is None else info.column(column) is not None
+        if isinstance(source, Scope):
+            outputs = self._scope_outputs(source)
+            return None if outputs is None else column.lower() in outputs
+        return None
+
+    def _source_label(self, source) -> str:
+        if isinstance(source, exp.Table):
+            info = self.catalog.resolve_table(_table_ref_name(source))
+            return info.id if info else _table_ref_name(source)
+        return "derived table"
+
+    def _source_columns(self, source) -> list[str]:
+        if isinstance(source, exp.Table):
+            info = self.catalog.resolve_table(_table_ref_name(source))
+            return [c.name for c in info.columns] if info else []
+        if isinstance(source, Scope):
+            return self._scope_output_names(source) or []
+        return []
+
+    @staticmethod
+    def _find_source(scope: "Scope", qualifier: str):
+        # walk outwards for correlated references to an outer query's alias
+        current = scope
+        while current is not None:
+            for name, source in current.sources.items():
+                if name.lower() == qualifier.lower():
+                    return source
+            current = current.parent
+        return None
+
+    def check_column(self, scope: "Scope", column: "exp.Column", select_aliases: set[str]) -> None:
+        """
+        `select_aliases` are the select-list aliases of `scope`; T-SQL resolves
+        them only in the ORDER BY of that same SELECT.
+        """
+        name = column.name
+        if not name or isinstance(column.this, exp.Star):
+            return
+
+        qualifier = column.table
+        if qualifier:
+            source = self._find_source(scope, qualifier)
+            if source is None:
+                self.add(
+                    ValidationIssue(
+                        "unknown_alias",
+                        f"Alias or table '{qualifier}' used in '{qualifier}.{name}' is not defined in the query",
+                        column=name,
+                        suggestions=_suggest(qualifier, scope.sources),
+                    )
+                )
+                return
+            if self._source_has_column(source, name) is False:
+                label = self._source_label(source)
+                suggestions = _suggest(name, self._source_columns(source))
+                self.add(
+                    ValidationIssue(
+                        "unknown_column",
+                        f"Column '{name}' not found in {label} (alias '{qualifier}')"
+                        + (f"; did you mean {', '.join(suggestions)}?" if suggestions else ""),
+                        table=label,
+                        column=name,
+                        suggestions=suggestions,
+                    )
+                )
+            return
+
+        # unqualified: must exist in exactly one source of this scope (or outer scopes)
+        if name.lower() in select_aliases:
+            order = column.find_ancestor(exp.Order, exp.Window, exp.Select)
+            if isinstance(order, exp.Order) and order.parent is scope.expression:
+                return
+        current = scope
+        while current is not None:
+            # only sources in this scope's FROM/JOIN, not every visible CTE name
+            sources = {alias: src for alias, (_, src) in current.selected_sources.items()}
+            verdicts = {alias: self._source_has_column(src, name) for alias, src in sources.items()}
+            matches = [a for a, v in verdicts.items() if v]
+            if len(matches) > 1:
+                self.add(
+                    ValidationIssue(
+                        "ambiguous_column",
+                        f"Column '{name}' is ambiguous; it exists in {', '.join(matches)}. Qualify it with a table alias",
+                        column=name,
+                        suggestions=matches,
+                    )
+                )
+                return
+            if matches or any(v is None for v in verdicts.values()):
+                return
+            current = current.parent
+
+        if name.lower() in select_aliases:
+            self.add(
+                ValidationIssue(
+                    "unknown_column",
+                    f"'{name}' is a select-list alias; T-SQL only resolves aliases in ORDER BY, "
+                    "so repeat the aliased expression here",
+                    column=name,
+                )
+            )
+            return
+
+        candidates = [c for _, src in scope.selected_sources.values() for c in self._source_columns(src)]
+        suggestions = _suggest(name, candidates)
+        self.add(
+            ValidationIssue(
+                "unknown_column",
+                f"Column '{name}' not found in any table of the query"
+                + (f"; did you mean {', '.join(suggestions)}?" if suggestions else ""),
+                column=name,
+                suggestions=suggestions,
+            )
+        )
+
+    # ---- driver ----
+
+    def run(self, sql_query: str) -> None:
+        try:
+            statements = [s for s in sqlglot.parse(sql_query, read="tsql") if s is not None]
+        except ParseError as e:
+            detail = e.errors[0] if e.errors else {}
+            where = f" at line {detail['line']}, col {detail['col']}" if detail.get("line") else ""
+            self.add(ValidationIssue("syntax_error", f"SQL syntax error{where}: {detail.get('description', str(e))}"))
+            return
+
+        if not statements:
+            self.add(ValidationIssue("not_select", "Query does not appear to be a valid SELECT statement"))
+            return
+
+        for statement in statements:
+            violation = read_only_violation(statement)
+            if violation:
+                self.add(ValidationIssue("not_select", violation))
+                continue
+
+            for scope in traverse_scope(statement):
+                for source in scope.sources.values():
+                    if isinstance(source, exp.Table):
+                        self.resolve_table(source)
+
+                select_aliases = set()
+                if isinstance(scope.expression, exp.Select):
+                    select_aliases = {
+                        e.alias.lower() for e in scope.expression.expressions if isinstance(e, exp.Alias)
+                    }
+                for column in scope.columns:
+                    self.check_column(scope, column, select_aliases)
+
+
+def validate_sql(sql_query: str, catalog, allowed_tables: Optional[Iterable[str]] = None) -> dict:
+    """
+    Validate `sql_query` against `catalog`.
+
+    Args:
+        sql_query: T-SQL query text
+        catalog: Compiled SchemaCatalog
+        allowed_tables: Table ids that were in the prompt; others are errors
+
+    Returns:
+        {"is_valid", "errors": [str], "warnings": [str], "issues": [dict]} —
+        the same shape as validate_sql_against_schema plus structured issues.
+    """
+    validator = _Validator(catalog, allowed_tables)
+    validator.run(sql_query)
+
+    errors = [i.message for i in validator.issues if i.severity == "error"]
+    warnings = [i.message for i in validator.issues if i.severity != "error"]
+    return {
+        "is_valid": not errors,
+        "errors": errors,
+        "warnings": warnings,
+        "issues": [asdict(i) for i in validator.issues],
+    }
+
+
+def format_issues_for_fix(issues: list[dict], catalog=None, max_columns: int = 40) -> str:
+    """
+    Render structured issues as targeted fix instructions, listing the real
+    columns of each table a bad column was looked up in.
+    """
+    lines = []
+    for issue in issues:
+        if issue.get("severity") != "error":
+            continue
+        line = f"- [{issue['code']}] {issue['message']}"
+        lines.append(line)
+        if catalog is not None and issue["code"] == "unknown_column" and issue.get("table"):
+            info = catalog.resolve_table(issue["table"])
+            if info is not None:
+                cols = [c.name for c in info.columns]
+                more = f" (+{len(cols) - max_columns} more)" if len(cols) > max_columns else ""
+                lines.append(f"  Columns of {info.id}: {', '.join(cols[:max_columns])}{more}")
+        if issue["code"] == "cost_over_budget" and issue.get("suggestions"):
+            lines.append(f"  Indexed columns of {issue['table']}: {', '.join(issue['suggestions'])}")
+    return "\n".join(lines)
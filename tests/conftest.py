@@ -0,0 +1,29 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from schema_catalog import IndexInfo, SchemaCatalog, TableStats
+
+# (schema, table, column, data_type, is_nullable, is_pk, is_fk, ref_schema, ref_table, ref_column)
+ROWS = [
+    ("dbo", "t_acct", "acct_id", "int", False, True, False, None, None, None),
+    ("dbo", "t_acct", "organization_id", "int", True, False, True, "dbo", "t_organization", "organization_id"),
+    ("dbo", "t_acct", "acct_name", "varchar", True, False, False, None, None, None),
+    ("dbo", "t_organization", "organization_id", "int", False, True, False, None, None, None),
+    ("dbo", "t_organization", "organization_name", "varchar", True, False, False, None, None, None),
+]
+
+STATS = {
+    "dbo.t_acct": TableStats(5000, (IndexInfo("PK_t_acct", ("acct_id",), unique=True, clustered=True),)),
+    "dbo.t_organization": TableStats(
+        200, (IndexInfo("PK_t_organization", ("organization_id",), unique=True, clustered=True),)
+    ),
+}
+
+
+@pytest.fixture
+def catalog():
+    return SchemaCatalog(ROWS, STATS)
@@ -0,0 +1,70 @@
+import sqlite3
+
+import numpy as np
+
+from answer_cache import SemanticAnswerCache, question_literals
+
+
+def _vec(seed: int = 0) -> np.ndarray:
+    v = np.random.default_rng(seed).standard_normal(16).astype("float32")
+    return v / np.linalg.norm(v)
+
+
+def test_questions_differing_only_in_a_number_do_not_share_an_entry():
+    cache = SemanticAnswerCache()
+    vec = _vec()  # same embedding: the worst case for near-duplicates
+    cache.put("Total billed for account 12345", vec, "SELECT ... WHERE acct_id = 12345", "r", "fp")
+
+    assert cache.lookup("Total billed for account 67890", vec, "fp") is None
+    hit = cache.lookup("total billed for account 12345", vec, "fp")
+    assert hit is not None and "12345" in hit.sql_query
+
+    cache.put("Total billed for account 67890", vec, "SELECT ... WHERE acct_id = 67890", "r", "fp")
+    assert "67890" in cache.lookup("Total billed for account 67890", vec, "fp").sql_query
+    assert "12345" in cache.lookup("Total billed for account 12345", vec, "fp").sql_query
+
+
+def test_years_and_quoted_values_must_match():
+    cache = SemanticAnswerCache()
+    vec = _vec()
+    cache.put("Disputes opened in 2023 for org 'Acme'", vec, "SELECT 2023", "r", "fp")
+    assert cache.lookup("Disputes opened in 2024 for org 'Acme'", vec, "fp") is None
+    assert cache.lookup("Disputes opened in 2023 for org 'Globex'", vec, "fp") is None
+    assert cache.lookup("disputes opened in 2023 for org 'acme'", vec, "fp") is not None
+
+
+def test_question_literals():
+    assert question_literals("How many accounts?") == ""
+    assert question_literals("account 12345 in 2023") != question_literals("account 67890 in 2023")
+    assert question_literals("in 2023 and 2024") != question_literals("in 2024 and 2023")
+
+
+def test_old_cache_file_is_upgraded(tmp_path):
+    path = str(tmp_path / "answers.sqlite")
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE answers (id INTEGER PRIMARY KEY AUTOINCREMENT, question TEXT NOT NULL, embedding BLOB NOT NULL,"
+        " sql_query TEXT NOT NULL, full_response TEXT NOT NULL, schema_fingerprint TEXT NOT NULL,"
+        " created_at REAL NOT NULL, last_hit REAL NOT NULL, hits INTEGER NOT NULL DEFAULT 0)"
+    )
+    conn.execute(
+        "INSERT INTO answers (question, embedding, sql_query, full_response, schema_fingerprint, created_at, last_hit)"
+        " VALUES ('account 12345', ?, 'SELECT 12345', 'r', 'fp', strftime('%s','now'), strftime('%s','now'))",
+        (_vec().tobytes(),),
+    )
+    conn.commit()
+    conn.close()
+
+    cache = SemanticAnswerCache(path)
+    # rows written before literals were stored are never served
+    assert len(cache) == 1 and cache.lookup("account 67890", _vec(), "fp") is None
+    cache.put("account 67890", _vec(), "SELECT 67890", "r", "fp")
+    assert SemanticAnswerCache(path).lookup("account 67890", _vec(), "fp").sql_query == "SELECT 67890"
+
+
+def test_discard():
+    cache = SemanticAnswerCache()
+    cache.put("account 1", _vec(), "SELECT 1", "r", "fp")
+    hit = cache.lookup("account 1", _vec(), "fp")
+    cache.discard(hit)
+    assert len(cache) == 0 and cache.lookup("account 1", _vec(), "fp") is None
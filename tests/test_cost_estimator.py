@@ -0,0 +1,48 @@
+from cost_estimator import apply_cost_budget, estimate_query_cost
+
+APPLY_SQL = (
+    "SELECT a.acct_id, x.n FROM t_acct a CROSS APPLY "
+    "(SELECT COUNT(*) AS n FROM t_organization o WHERE o.organization_id = a.organization_id) x"
+)
+
+
+def _valid():
+    return {"is_valid": True, "errors": [], "warnings": []}
+
+
+def test_union_sums_branches(catalog):
+    estimate = estimate_query_cost(
+        "SELECT acct_id FROM t_acct UNION ALL SELECT organization_id FROM t_organization", catalog
+    )
+    assert estimate.output_rows == 5200
+    assert estimate.rows_read == 5200
+
+
+def test_apply_is_estimated(catalog):
+    estimate = estimate_query_cost(APPLY_SQL, catalog)
+    assert estimate.output_rows == 5000
+    assert {a.table for a in estimate.accesses} >= {"dbo.t_acct", "dbo.t_organization"}
+
+    outer = estimate_query_cost(APPLY_SQL.replace("CROSS APPLY", "OUTER APPLY"), catalog)
+    assert outer.output_rows == 5000
+
+
+def test_union_and_apply_pass_validation_with_stats(catalog):
+    for sql in (
+        "SELECT acct_id FROM t_acct UNION ALL SELECT organization_id FROM t_organization",
+        APPLY_SQL,
+        "SELECT v.x FROM (VALUES (1), (2)) v(x)",
+    ):
+        result = apply_cost_budget(_valid(), sql, catalog)
+        assert result["is_valid"], result
+        assert "estimated_cost" in result
+
+
+def test_estimator_failure_is_a_warning(catalog, monkeypatch):
+    def broken(sql_query, catalog):
+        raise AttributeError("no such scope attribute")
+
+    monkeypatch.setattr("cost_estimator.estimate_query_cost", broken)
+    result = apply_cost_budget(_valid(), "SELECT acct_id FROM t_acct", catalog)
+    assert result["is_valid"]
+    assert result["warnings"] and "AttributeError" in result["warnings"][0]
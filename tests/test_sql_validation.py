@@ -0,0 +1,39 @@
+import pytest
+
+from sql_validation import validate_sql
+
+APPLY_INNER = (
+    "(SELECT COUNT(*) AS n FROM t_organization o WHERE o.organization_id = a.organization_id) x"
+)
+
+
+@pytest.mark.parametrize("apply", ["CROSS APPLY", "OUTER APPLY"])
+def test_apply_qualified_column(catalog, apply):
+    result = validate_sql(f"SELECT a.acct_id, x.n FROM t_acct a {apply} {APPLY_INNER}", catalog)
+    assert result["is_valid"], result["errors"]
+
+
+@pytest.mark.parametrize("apply", ["CROSS APPLY", "OUTER APPLY"])
+def test_apply_unqualified_column(catalog, apply):
+    result = validate_sql(f"SELECT a.acct_id, n FROM t_acct a {apply} {APPLY_INNER}", catalog)
+    assert result["is_valid"], result["errors"]
+
+
+def test_apply_unknown_column_still_rejected(catalog):
+    qualified = validate_sql(f"SELECT a.acct_id, x.bogus FROM t_acct a CROSS APPLY {APPLY_INNER}", catalog)
+    unqualified = validate_sql(f"SELECT a.acct_id, bogus FROM t_acct a CROSS APPLY {APPLY_INNER}", catalog)
+    assert not qualified["is_valid"] and not unqualified["is_valid"]
+
+
+def test_apply_table_function_is_not_rejected(catalog):
+    result = validate_sql("SELECT a.acct_id, f.value FROM t_acct a CROSS APPLY dbo.fn_split(a.acct_name) f", catalog)
+    assert result["is_valid"], result["errors"]
+
+
+def test_column_alias_lists(catalog):
+    for sql in (
+        "SELECT d.m FROM (SELECT acct_id FROM t_acct) d(m)",
+        "WITH c(x) AS (SELECT acct_id FROM t_acct) SELECT c.x FROM c",
+    ):
+        result = validate_sql(sql, catalog)
+        assert result["is_valid"], (sql, result["errors"])
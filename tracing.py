@@ -0,0 +1,337 @@
+"""
+Tracing, metrics and logging for the SQL pipeline.
+
+Pipeline stages run inside spans:
+
+    with span("llm.complete", prompt_chars=len(prompt)) as s:
+        response = provider.complete(prompt)
+        s.set(response_chars=len(response))
+
+Spans nest through contextvars, so each question yields one trace: the
+pipeline, then retrieval, embedding, each LLM call, extraction and
+validation. Attributes carry prompt / response sizes, retry counts and
+cache hit flags. A finished span is
+- appended as one JSON line to TRACE_LOG_PATH (when set)
+- observed in the in-process metrics registry: a duration histogram and an
+  error counter per span name, and a hit / miss counter for spans with a
+  cache_hit attribute
+- logged at DEBUG level
+
+The registry renders the Prometheus text format. It is served over HTTP
+when METRICS_PORT is set (start_metrics_server, started by the CLIs), or
+written to METRICS_TEXTFILE_PATH at the end of a batch, for node_exporter's
+textfile collector.
+
+Thread pools do not inherit contextvars; submit `propagate(fn)` so spans
+opened in worker threads join the caller's trace.
+
+Environment:
+- LOG_LEVEL: console log level for the CLIs (default INFO)
+- TRACE_LOG_PATH: JSON lines file for finished spans (default off)
+- TRACING_DISABLED: 1 turns spans into no-ops
+- METRICS_PORT / METRICS_HOST: serve /metrics (default off / 127.0.0.1)
+- METRICS_TEXTFILE_PATH: Prometheus text file written by batch runs
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+METRIC_PREFIX = "llm_sql"
+
+
+# ========= LOGGING =========
+
+def configure_logging(level: Optional[str] = None) -> None:
+    """
+    Console logging for the CLIs: bare messages on stdout, as the pipeline's
+    progress lines always looked. Library users configure logging themselves.
+    """
+    level = (level or os.getenv("LOG_LEVEL") or "INFO").upper()
+    root = logging.getLogger()
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        root.addHandler(handler)
+    root.setLevel(level)
+    # HTTP client chatter stays out of the pipeline log unless explicitly asked for
+    for name in ("urllib3", "httpx", "azure"):
+        logging.getLogger(name).setLevel(max(logging.WARNING, root.level))
+
+
+# ========= METRICS =========
+
+def _label_text(labels: tuple) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets: tuple = DURATION_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counters: dict[str, dict[tuple, float]] = {}
+        self._histograms: dict[str, dict[tuple, list]] = {}  # labels -> [bucket counts..., sum, count]
+        self._help: dict[str, str] = {}
+
+    def describe(self, name: str, help_text: str) -> None:
+        self._help[name] = help_text
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            state = series.get(key)
+            if state is None:
+                state = series[key] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def summary(self, name: str, label: str) -> dict[str, tuple[int, float]]:
+        """{label value: (count, total)} of histogram `name`, e.g. per-stage call counts and seconds."""
+        with self._lock:
+            return {
+                dict(key).get(label, ""): (state[-1], state[-2])
+                for key, state in self._histograms.get(name, {}).items()
+            }
+
+    def render(self) -> str:
+        lines = []
+        with self._lock:
+            for name, series in sorted(self._counters.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for key, value in sorted(series.items()):
+                    lines.append(f"{name}{_label_text(key)} {value:g}")
+            for name, series in sorted(self._histograms.items()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for key, state in sorted(series.items()):
+                    # bucket counts are kept cumulative by observe()
+                    for bound, count in zip(self.buckets, state):
+                        lines.append(f"{name}_bucket{_label_text(key + (('le', f'{bound:g}'),))} {count}")
+                    lines.append(f"{name}_bucket{_label_text(key + (('le', '+Inf'),))} {state[-1]}")
+                    lines.append(f"{name}_sum{_label_text(key)} {state[-2]:.6f}")
+                    lines.append(f"{name}_count{_label_text(key)} {state[-1]}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+
+
+metrics = MetricsRegistry()
+SPAN_DURATION = f"{METRIC_PREFIX}_span_duration_seconds"
+SPAN_ERRORS = f"{METRIC_PREFIX}_span_errors_total"
+CACHE_LOOKUPS = f"{METRIC_PREFIX}_cache_lookups_total"
+metrics.describe(SPAN_DURATION, "Duration of pipeline stages")
+metrics.describe(SPAN_ERRORS, "Pipeline stages that raised")
+metrics.describe(CACHE_LOOKUPS, "Cache lookups by stage and result")
+
+
+# ========= SPANS =========
+
+class Span:
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start", "duration_s", "status", "attributes")
+
+    def __init__(self, name: str, parent: Optional["Span"], attributes: dict):
+        self.name = name
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.start = time.time()
+        self.duration_s: Optional[float] = None
+        self.status = "ok"
+        self.attributes = attributes
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def incr(self, key: str, value: int = 1) -> None:
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": datetime.fromtimestamp(self.start, tz=timezone.utc).isoformat(),
+            "duration_ms": round(1000 * (self.duration_s or 0.0), 3),
+            "status": self.status,
+            "attributes": self.attributes,
+        }
+
+
+class _NullSpan:
+    """Stand-in outside any span (or with tracing disabled); every call is a no-op."""
+
+    name = trace_id = span_id = parent_id = None
+
+    def set(self, **attributes) -> None:
+        pass
+
+    def incr(self, key: str, value: int = 1) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+_current: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("llm_sql_span", default=None)
+_log_lock = threading.Lock()
+_log_file = None
+_log_path: Optional[str] = None
+
+
+def tracing_enabled() -> bool:
+    return os.getenv("TRACING_DISABLED", "0") != "1"
+
+
+def current_span():
+    """The innermost open span of this context (a no-op span outside one)."""
+    return _current.get() or _NULL_SPAN
+
+
+def _write_span_log(record: dict) -> None:
+    global _log_file, _log_path
+    path = os.getenv("TRACE_LOG_PATH")
+    if not path:
+        return
+    line = json.dumps(record, default=str)
+    with _log_lock:
+        if _log_file is None or _log_path != path:
+            if _log_file is not None:
+                _log_file.close()
+            _log_file, _log_path = open(path, "a", encoding="utf-8", buffering=1), path
+        _log_file.write(line + "\n")
+
+
+def _finish(s: Span) -> None:
+    metrics.observe(SPAN_DURATION, s.duration_s, span=s.name)
+    if s.status == "error":
+        metrics.inc(SPAN_ERRORS, span=s.name)
+    if "cache_hit" in s.attributes:
+        metrics.inc(CACHE_LOOKUPS, span=s.name, result="hit" if s.attributes["cache_hit"] else "miss")
+    try:
+        _write_span_log(s.to_dict())
+    except OSError as e:
+        logger.warning(f"⚠️  Could not write span log: {e}")
+    logger.debug(f"⏱  {s.name} {1000 * s.duration_s:.1f} ms {s.attributes}")
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time the enclosed block as span `name`; yields the Span for attributes."""
+    if not tracing_enabled():
+        yield _NULL_SPAN
+        return
+    s = Span(name, _current.get(), attributes)
+    token = _current.set(s)
+    started = time.perf_counter()
+    try:
+        yield s
+    except BaseException as e:
+        s.status = "error"
+        s.attributes["error"] = f"{type(e).__name__}: {e}"[:500]
+        raise
+    finally:
+        s.duration_s = time.perf_counter() - started
+        _current.reset(token)
+        _finish(s)
+
+
+def traced(name: Optional[str] = None):
+    """Decorator form of span(); the span is named after the function by default."""
+
+    def decorator(fn):
+        span_name = name or fn.__name__
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(fn):
+    """Bind `fn` to the caller's context, so spans it opens in another thread join this trace."""
+    context = contextvars.copy_context()
+    return functools.wraps(fn)(lambda *args, **kwargs: context.run(fn, *args, **kwargs))
+
+
+# ========= EXPORTERS =========
+
+def write_metrics_textfile(path: Optional[str] = None) -> Optional[str]:
+    """Write the registry for node_exporter's textfile collector (METRICS_TEXTFILE_PATH)."""
+    path = path or os.getenv("METRICS_TEXTFILE_PATH")
+    if not path:
+        return None
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(metrics.render())
+    os.replace(tmp_path, path)
+    return path
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?", 1)[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = metrics.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: Optional[int] = None, host: Optional[str] = None) -> Optional[ThreadingHTTPServer]:
+    """Serve /metrics from a daemon thread on `port` (default METRICS_PORT; unset: no server)."""
+    if port is None:
+        port = int(os.getenv("METRICS_PORT") or 0) or None
+    if port is None:
+        return None
+    server = ThreadingHTTPServer((host or os.getenv("METRICS_HOST") or "127.0.0.1", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info(f"📈 Metrics on http://{server.server_address[0]}:{server.server_address[1]}/metrics")
+    return server